@@ -0,0 +1,118 @@
+# Operator endpoints, off (404) unless ADMIN_TOKEN is set; requests send it
+# as "Authorization: Bearer <token>".
+#   GET /admin/stats    the counters of the server's database queries
+#                       (query_stats.py), caches and queues as one JSON
+#                       object, one key per source registered with add_stats()
+#   GET /admin/profile  ?seconds=10&interval_ms=10, a sampling profile of the
+#                       live server as collapsed stacks (see loop_watch.py)
+#   GET /admin/memory   entries and approximate bytes of the server's caches
+#                       and other global structures, and RSS (memory_stats.py)
+#   POST /admin/memory/trace           ?frames=1, starts tracemalloc
+#   POST /admin/memory/snapshot        ?top=20, the top allocations and their
+#                                      change since the previous snapshot
+#   DELETE /admin/memory/trace         stops tracemalloc
+#   curl -H "Authorization: Bearer $ADMIN_TOKEN" localhost:8080/admin/stats
+#   curl -H "Authorization: Bearer $ADMIN_TOKEN" "localhost:8080/admin/profile?seconds=30" > profile.folded
+#   flamegraph.pl profile.folded > profile.svg
+import hmac
+import os
+
+from flask import Blueprint, Response, abort, jsonify, request
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN") or None
+# Longest profile /admin/profile takes
+MAX_PROFILE_SECONDS = 60
+
+bp = Blueprint("admin", __name__, url_prefix="/admin")
+# name -> function returning the source's counters (JSON-able)
+STATS = {}
+# (seconds, interval) -> collapsed stacks, e.g. loop_watch.Watchdog.profile
+profiler = None
+# memory_stats.MemoryStats of the server's structures
+memory_stats = None
+# Most allocations /admin/memory/snapshot lists, and most stack frames traced
+MAX_SNAPSHOT_TOP = 200
+MAX_TRACE_FRAMES = 25
+
+
+def add_stats(name, stats):
+    STATS[name] = stats
+
+
+def set_profiler(profile):
+    global profiler
+    profiler = profile
+
+
+def set_memory_stats(stats):
+    global memory_stats
+    memory_stats = stats
+
+
+def authorized():
+    if ADMIN_TOKEN is None:
+        abort(404)
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+@bp.route("/stats")
+def stats():
+    if not authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify({name: source() for name, source in STATS.items()})
+
+
+@bp.route("/profile")
+def profile():
+    if not authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    if profiler is None:
+        abort(404)
+    seconds = min(max(request.args.get("seconds", 10, type=float), 0.1), MAX_PROFILE_SECONDS)
+    interval = max(request.args.get("interval_ms", 10, type=float), 1) / 1000
+    try:
+        stacks = profiler(seconds, interval)
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 409
+    return Response(
+        stacks, mimetype="text/plain", headers={"Content-Disposition": "attachment; filename=profile.folded"}
+    )
+
+
+@bp.route("/memory")
+def memory():
+    if not authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    if memory_stats is None:
+        abort(404)
+    return jsonify(memory_stats.report())
+
+
+@bp.route("/memory/trace", methods=["POST", "DELETE"])
+def memory_trace():
+    if not authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    if memory_stats is None:
+        abort(404)
+    if request.method == "DELETE":
+        return jsonify(memory_stats.stop_trace())
+    frames = min(max(request.args.get("frames", 1, type=int), 1), MAX_TRACE_FRAMES)
+    return jsonify(memory_stats.start_trace(frames))
+
+
+@bp.route("/memory/snapshot", methods=["POST"])
+def memory_snapshot():
+    if not authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    if memory_stats is None:
+        abort(404)
+    top = min(max(request.args.get("top", 20, type=int), 1), MAX_SNAPSHOT_TOP)
+    try:
+        return jsonify(memory_stats.snapshot(top))
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 409
+
+
+def init_admin(app):
+    app.register_blueprint(bp)
@@ -0,0 +1,583 @@
+# Native asyncio server: the same pages and Socket.IO events as main.py, on
+# python-socketio's AsyncServer under an ASGI server instead of eventlet.
+#   pip install uvicorn asyncpg httpx a2wsgi
+#   uvicorn asgi:app --host 0.0.0.0 --port 8080    (or python asgi.py)
+# Socket.IO events are coroutines: their queries go through SQLAlchemy's
+# asyncio extension (asyncpg for PostgreSQL) and chatbot replies through
+# LLMRouter.achat() on a shared httpx.AsyncClient, so a slow LLM or database
+# never blocks other clients and nothing relies on monkey patching.
+# HTTP routes are main.py's Flask blueprint, unchanged, served from a thread
+# pool through a WSGI adapter; broadcasts from them (reports, announcements)
+# are handed to the event loop. Comment pages and search also run in that
+# pool with main.py's code (comment_cache, search), as they are mostly cache
+# hits and PostgreSQL-specific SQL respectively.
+# Event names, payloads and templates are the same as under eventlet, so
+# room.js works with either. The user's session is the Flask session cookie
+# the pages set, read once when the socket connects (as Flask-SocketIO does).
+# With CHATBOT_QUEUE=1 prompts are queued for llm_worker.py instead, and its
+# replies arrive through SOCKETIO_MESSAGE_QUEUE (see chatbot_jobs.py).
+import asyncio
+import functools
+import inspect
+import json
+import os
+from datetime import datetime
+from time import time
+
+import socketio
+from itsdangerous import BadSignature
+from sqlalchemy import func, select, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from werkzeug.http import parse_cookie
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:  # uvicorn's own adapter, deprecated but always there
+    from uvicorn.middleware.wsgi import WSGIMiddleware
+
+# Nothing is monkey patched here and the Flask views run on a thread pool,
+# so main.py's locks (and loop_watch.py's threads) are plain threading ones;
+# set before concurrency.py reads it
+os.environ["ASYNC_MODE"] = "threading"
+
+import chatbot_inflight
+import chatbot_jobs
+import chatbot_sessions
+import main
+import wire
+from comment_cache import CommentPageError, hot_score
+from compression import socketio_options
+from fanout import AsyncRoomFanout, fanout_from_env
+from llm_router import LLMCancelledError, LLMUnavailableError
+from models import ChatbotJobs, ChatbotMessages, ChatbotSessions, Comments, CommentVotes, Messages, Rooms
+from presence import last_seen_id
+from room_history import HistoryRecord
+
+# Async drivers for the database URLs models.get_database_url() returns
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+def async_database_url(url):
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+flask_app = main.create_app(async_mode=None)
+engine = create_async_engine(
+    async_database_url(flask_app.config["SQLALCHEMY_DATABASE_URI"]),
+    pool_size=int(os.getenv("ASYNC_DB_POOL_SIZE", 10)),
+)
+Session = async_sessionmaker(engine, expire_on_commit=False)
+
+
+def client_manager(url):
+    """This server's end of the message queue (main.MESSAGE_QUEUE) that
+    main.py's servers and llm_worker.py publish to, or None."""
+    if url is None:
+        return None
+    # Flask-SocketIO's channel, so that all of them share it
+    if url.startswith(("redis://", "rediss://")):
+        return socketio.AsyncRedisManager(url, channel="flask-socketio")
+    return socketio.AsyncAioPikaManager(url, channel="flask-socketio")
+
+
+sio = socketio.AsyncServer(
+    async_mode="asgi", cors_allowed_origins="*", client_manager=client_manager(main.MESSAGE_QUEUE), **socketio_options()
+)
+fanout = fanout_from_env(sio, AsyncRoomFanout)
+# Created on startup, inside the event loop
+http_client = None
+
+# Chatbot requests being answered, for the queue message in chatbot_ack; only
+# touched from the event loop, so no lock
+chatbot_requests_in_progress = 0
+
+
+class ThreadsafeFanout:
+    """Stands in for main.fanout in the Flask views, which run in the WSGI
+    thread pool: their broadcasts go out through the event loop."""
+
+    def __init__(self, fanout):
+        self.fanout = fanout
+
+    def emit(self, event, payload, room):
+        self.fanout.emit_threadsafe(event, payload, room)
+
+
+main.fanout = ThreadsafeFanout(fanout)
+main.memory_stats.track("fanout_buffers", lambda: fanout.buffers)
+
+
+def on(event):
+    """sio.on(), with the handler's database queries counted against the
+    event in main.query_stats, as Flask-SocketIO's are."""
+
+    def register(handler):
+        @functools.wraps(handler)
+        async def tracked(*args):
+            with main.query_stats.tracked(f"socket {event}"):
+                return await handler(*args)
+
+        return sio.on(event, tracked)
+
+    return register
+
+
+def start_background_task(target, *args):
+    """sio.start_background_task(), its queries counted as "background"
+    rather than against the event that started it."""
+
+    async def tracked():
+        with main.query_stats.tracked("background"):
+            await target(*args)
+
+    return sio.start_background_task(tracked)
+
+
+async def maybe_await(result):
+    # enter_room()/leave_room() became coroutines in later python-socketio releases
+    if inspect.isawaitable(result):
+        await result
+
+
+def in_app_context(fn, *args, **kwargs):
+    """Run main.py code that uses Flask-SQLAlchemy; for asyncio.to_thread()."""
+    with flask_app.app_context():
+        return fn(*args, **kwargs)
+
+
+def flask_session(environ):
+    """The Flask session of the page that opened the socket, or {}."""
+    cookie = parse_cookie(environ.get("HTTP_COOKIE", "")).get(flask_app.config["SESSION_COOKIE_NAME"])
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    if not cookie or serializer is None:
+        return {}
+    try:
+        return dict(serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds())))
+    except BadSignature:
+        return {}
+
+
+async def save_message(db, room, content, user_type, date):
+    """Saves a chat message and sends it to the room with its id, like
+    main.save_message()."""
+    msg = Messages(room_code=room, name=content["name"], message=content["message"], user_type=user_type, date=date)
+    db.add(msg)
+    await db.flush()
+    await fanout.emit("message", dict(content, id=msg.id), room)
+    await db.commit()
+    main.room_history.add(room, HistoryRecord.from_message(msg))
+
+
+async def update_members(db, room_info, user, joined):
+    members = json.loads(room_info.members) if room_info.members else []
+    if not joined:
+        members = [member for member in members if member["name"] != user["name"]]
+    elif not any(member["name"] == user["name"] for member in members):
+        members.append({"name": user["name"], "user_type": user.get("user_type", "User")})
+    room_info.members = json.dumps(members)
+    await db.commit()
+    await fanout.emit("memberChange", wire.members(members), user["room"])
+    return members
+
+
+async def resume(sid, room, last_id, wire_format):
+    """main.resume(): the messages a (re)connecting client missed."""
+    if last_id is None:
+        return
+    messages_list, has_more = await asyncio.to_thread(in_app_context, main.messages_after, room, last_id)
+    if messages_list or has_more:
+        await sio.emit("resume", wire.encode({"messages": messages_list, "has_more": has_more}, wire_format), to=sid)
+
+
+# Connect occurs when user enters the room; no authentication required
+@on("connect")
+async def connect(sid, environ, auth=None):
+    user = flask_session(environ)
+    room = user.get("room")
+    name = user.get("name")
+    await sio.save_session(sid, user)
+    if not room or not name:
+        return
+    async with Session() as db:
+        room_info = await db.get(Rooms, room)
+        if room_info is None:
+            return
+        # JSON by default; msgpack if the client asked for it and WIRE_MSGPACK=1
+        wire_format = wire.negotiate(auth)
+        user["wire_format"] = wire_format
+        await sio.save_session(sid, user)
+        await maybe_await(sio.enter_room(sid, wire.format_room(room, wire_format)))
+        fanout.join(room, wire_format)
+        # Joined first, so that nothing newer than what it resumes with is missed
+        await resume(sid, room, last_seen_id(auth), wire_format)
+        if not main.presence.arrive(room, name):
+            # Still in the room (another tab, or back within RECONNECT_GRACE)
+            members = json.loads(room_info.members) if room_info.members else []
+            await sio.emit("memberChange", wire.encode(wire.members(members), wire_format), to=sid)
+            print(f"{name} is back in room {room}")
+            return
+        now = datetime.now()
+        content = {"name": "Room", "message": f"{name} has joined the room", "date": wire.timestamp(now)}
+        await save_message(db, room, content, "Administrator", now)
+        members = await update_members(db, room_info, user, joined=True)
+    print(f"{name} has joined room {room}. Current Members: {members}")
+
+
+# Disconnect occurs when user closes the tab, refreshes the page or loses the connection
+@on("disconnect")
+async def disconnect(sid):
+    user = await sio.get_session(sid)
+    # Nobody is left to see the replies to the user's pending chatbot prompts
+    await cancel_chatbot_prompts(sid, user, chatbot_inflight.DISCONNECT)
+    room = user.get("room")
+    name = user.get("name")
+    wire_format = user.get("wire_format")
+    if wire_format is None:
+        # connect() turned the socket away before it joined the room
+        return
+    await maybe_await(sio.leave_room(sid, wire.format_room(room, wire_format)))
+    fanout.leave(room, wire_format)
+    token = main.presence.depart(room, name)
+    if token is None:
+        # Still in the room through another socket
+        return
+    if main.presence.grace > 0:
+        # Gone for good only if they do not reconnect within RECONNECT_GRACE
+        start_background_task(leave_after_grace, user, token)
+        return
+    main.presence.expire(room, name, token)
+    await member_left(user)
+
+
+async def leave_after_grace(user, token):
+    await sio.sleep(main.presence.grace)
+    if main.presence.expire(user["room"], user["name"], token):
+        await member_left(user)
+
+
+async def member_left(user):
+    room = user["room"]
+    name = user["name"]
+    print(f"{name} has left room {room}")
+    async with Session() as db:
+        now = datetime.now()
+        content = {"name": "Room", "message": f"{name} has left the room", "date": wire.timestamp(now)}
+        await save_message(db, room, content, "Administrator", now)
+        # Locked until the commit: leaves after the grace period tend to come together
+        room_info = await db.get(Rooms, room, with_for_update=True)
+        if room_info:
+            await update_members(db, room_info, user, joined=False)
+
+
+# Message event occurs when user sends a message
+@on("message")
+async def message(sid, data):
+    user = await sio.get_session(sid)
+    room = user.get("room")
+    async with Session() as db:
+        if room is None or await db.get(Rooms, room) is None:
+            return
+        now = datetime.now()
+        content = {
+            "name": user.get("name"),
+            "message": data["data"],
+            "date": wire.timestamp(now),
+            "user_type": wire.user_type_code(user.get("user_type")),
+        }
+        # On receiving data from a client, send it to all clients in the room (once it has an id)
+        await save_message(db, room, content, user.get("user_type"), now)
+    print(f"{user.get('name')} said: {data['data']} in room {room}")
+
+
+@on("submit_comment")
+async def handle_comment(sid, data):
+    user = await sio.get_session(sid)
+    room = user.get("room")
+    username = user.get("name")
+    text = data["text"]
+    parent_id = data.get("parent_id")  # None for root comments
+    if not room or not username:
+        print(f"Room or username not found in session. Room: {room}, Username: {username}")
+        return
+    async with Session() as db:
+        if parent_id and await db.get(Comments, parent_id) is None:
+            print(f"Parent comment does not exist. Parent ID: {parent_id}")
+            return
+        now = datetime.now()
+        comment = Comments(
+            room_code=room, username=username, text=text, parent_id=parent_id, user_type=user.get("user_type"),
+            timestamp=now, votes=0, hot_score=hot_score(0, now), reply_count=0,
+        )
+        db.add(comment)
+        if parent_id:
+            await db.execute(
+                update(Comments)
+                .where(Comments.id == parent_id)
+                .values(reply_count=func.coalesce(Comments.reply_count, 0) + 1)
+            )
+        await db.commit()
+    main.comment_cache.add_comment(comment)
+    await fanout.emit("new_comment", {
+        "id": comment.id,
+        "text": text,
+        "username": username,
+        "timestamp": wire.timestamp(comment.timestamp),
+        "votes": 0,
+        "user_type": wire.user_type_code(user.get("user_type")),
+        "parent_id": parent_id,
+        "reply_count": 0,
+    }, room)
+
+
+@on("vote_comment")
+async def handle_vote(sid, data):
+    user = await sio.get_session(sid)
+    comment_id = data["comment_id"]
+    vote = data["vote"]  # 1 for upvote, -1 for downvote
+    username = user.get("name")
+    room = user.get("room")
+    async with Session() as db:
+        existing_vote = (
+            await db.execute(select(CommentVotes).filter_by(comment_id=comment_id, username=username).limit(1))
+        ).scalar()
+        if existing_vote:
+            if existing_vote.vote == vote:
+                # User clicked the same vote again, rescind the vote
+                await db.delete(existing_vote)
+                vote = 0
+            else:
+                existing_vote.vote = vote
+        else:
+            db.add(CommentVotes(comment_id=comment_id, username=username, vote=vote, room_code=room, user_type=user.get("user_type")))
+        await db.flush()
+        updated_votes = (
+            await db.execute(select(func.sum(CommentVotes.vote)).filter_by(comment_id=comment_id))
+        ).scalar() or 0
+        comment = await db.get(Comments, comment_id)
+        if comment:
+            comment.votes = updated_votes
+            comment.hot_score = hot_score(updated_votes, comment.timestamp)
+            await db.commit()
+    user_vote = 1 if vote == 1 else -1 if vote == -1 else 0
+    if comment:
+        main.comment_cache.set_vote(room, int(comment_id), comment.parent_id, updated_votes, username, user_vote)
+    await fanout.emit("update_vote", {"comment_id": comment_id, "votes": updated_votes, "userVote": user_vote}, room)
+
+
+# A page of top-level comments or of a comment's replies (see main.load_comments)
+@on("load_comments")
+async def load_comments(sid, data):
+    user = await sio.get_session(sid)
+    room = user.get("room")
+    name = user.get("name")
+    if not room or not name or not isinstance(data, dict):
+        return
+    parent_id = data.get("parent_id")
+    sort = data.get("sort") or main.COMMENT_SORT
+    cursor = data.get("cursor")
+    try:
+        parent_id = int(parent_id) if parent_id is not None else None
+        comments_data, next_cursor = await asyncio.to_thread(
+            in_app_context, main.comment_cache.page, room, name, parent_id=parent_id, sort=sort, cursor=cursor
+        )
+    except (ValueError, CommentPageError) as e:
+        print(f"Invalid load_comments request {data}: {e}")
+        return
+    await sio.emit(
+        "comments_page",
+        wire.encode(
+            {"parent_id": parent_id, "sort": sort, "cursor": cursor, "comments": comments_data, "next_cursor": next_cursor},
+            user.get("wire_format", wire.JSON),
+        ),
+        to=sid,
+    )
+
+
+@on("search")
+async def search_event(sid, data):
+    user = await sio.get_session(sid)
+    data = data if isinstance(data, dict) else {}
+    result, _ = await asyncio.to_thread(in_app_context, main.run_search, data, user)
+    result["q"] = data.get("q")
+    result["cursor"] = data.get("cursor")
+    await sio.emit("search_results", wire.encode(result, user.get("wire_format", wire.JSON)), to=sid)
+
+
+async def record_chatbot_message(db, owner, session_number, message=None, date=None):
+    """chatbot_sessions.record_message() on an AsyncSession."""
+    count, title = chatbot_sessions.record_statements(owner, session_number, message, date)
+    if not (await db.execute(count)).rowcount:
+        try:
+            async with db.begin_nested():
+                db.add(ChatbotSessions(owner=owner, session=session_number))
+        except IntegrityError:
+            pass
+        await db.execute(count)
+    if title is not None:
+        await db.execute(title)
+
+
+# Acknowledges a message to the chatbot with the same message
+@on("chatbot_req")
+async def chatbot_req(sid, data):
+    user = await sio.get_session(sid)
+    name = user.get("name")
+    session_id = data["session"]
+    message = data["message"]
+    now = datetime.now()
+    async with Session() as db:
+        db.add(ChatbotMessages(name=name, owner=name, session=session_id, message=message, date=now, user_type=user.get("user_type")))
+        await record_chatbot_message(db, name, session_id, message, now)
+        await db.commit()
+        if chatbot_jobs.QUEUE_ENABLED:
+            in_progress = (
+                await db.execute(
+                    select(func.count(ChatbotJobs.id)).where(ChatbotJobs.status.in_((chatbot_jobs.QUEUED, chatbot_jobs.RUNNING)))
+                )
+            ).scalar()
+        else:
+            in_progress = chatbot_requests_in_progress
+    await sio.emit(
+        "chatbot_ack",
+        wire.encode(
+            {
+                "name": name,
+                "session": session_id,
+                "message": message,
+                "date": wire.timestamp(),
+                "requests_in_progress": in_progress,
+            },
+            user.get("wire_format", wire.JSON),
+        ),
+        to=sid,
+    )
+
+
+async def chatbot_reply(sid, name, session_id, prompt, wire_format, cancel):
+    global chatbot_requests_in_progress
+    chatbot_requests_in_progress += 1
+    start_time = time()
+    try:
+        async with Session() as db:
+            rows = (
+                await db.execute(
+                    select(ChatbotMessages)
+                    .filter_by(owner=name, session=session_id)
+                    .order_by(ChatbotMessages.date, ChatbotMessages.id)
+                )
+            ).scalars()
+            chatbot_history = [{"name": row.name, "message": row.message} for row in rows]
+        history = main.chatbot_prompt_messages(chatbot_history or None, prompt)
+        print(f"Sending {name}'s request to chatbot api: {prompt}")
+        try:
+            response = await main.llm_router.achat(history, client=http_client, cancel=cancel)
+        except LLMCancelledError as e:
+            main.inflight_prompts.record_saved(e.tokens_saved)
+            print(f"Cancelled {name}'s chatbot request ({e.reason}), saving about {e.tokens_saved} tokens")
+            return
+        except LLMUnavailableError as e:
+            print("No LLM backend available: ", e)
+            response = main.chatbot_apology(prompt, e)
+        except Exception as e:
+            print("Exception occured: ", e)
+            response = main.chatbot_apology(prompt, e)
+        if cancel.cancelled:
+            # Answered just as it was cancelled
+            return
+        now = datetime.now()
+        async with Session() as db:
+            db.add(ChatbotMessages(name="Chatbot", owner=name, session=session_id, message=response, date=now, user_type="Administrator"))
+            await record_chatbot_message(db, name, session_id, date=now)
+            await db.commit()
+        await sio.emit(
+            "chatbot_response",
+            wire.encode(main.chatbot_response(session_id, response), wire_format),
+            to=sid,
+        )
+    finally:
+        main.inflight_prompts.finish(sid, cancel)
+        chatbot_requests_in_progress -= 1
+    print(f"Time taken to finish chatbot request: {time() - start_time} seconds")
+
+
+async def cancel_chatbot_prompts(sid, user, reason, session_number=None, keep_session=None):
+    """main.cancel_chatbot_prompts() for the AsyncServer."""
+    if chatbot_jobs.QUEUE_ENABLED:
+        async with Session() as db:
+            cancelled = 0
+            for statement in chatbot_jobs.cancel_statements(sid, reason, session_number, keep_session):
+                cancelled += (await db.execute(statement)).rowcount
+            await db.commit()
+        main.inflight_prompts.record_cancelled(reason, cancelled)
+    else:
+        cancelled = main.inflight_prompts.cancel(sid, reason, session_number, keep_session)
+    if cancelled:
+        print(f"Cancelled {cancelled} chatbot prompts of {user.get('name')} ({reason})")
+    return cancelled
+
+
+# Responds to a message to the chatbot with a reply from an LLM
+@on("chatbot_prompt")
+async def chatbot_prompt(sid, data):
+    user = await sio.get_session(sid)
+    # The user moved on from the prompts of other sessions
+    await cancel_chatbot_prompts(sid, user, chatbot_inflight.SWITCH, keep_session=data["session"])
+    if chatbot_jobs.QUEUE_ENABLED:
+        # Answered by llm_worker.py, which sends chatbot_response through the message queue
+        async with Session() as db:
+            db.add(chatbot_jobs.new_job(user.get("name"), data["session"], data["message"], sid, user.get("wire_format", wire.JSON)))
+            if engine.dialect.name == "postgresql":
+                await db.execute(text(chatbot_jobs.NOTIFY))
+            await db.commit()
+        return
+    cancel = main.inflight_prompts.start(sid, data["session"])
+    start_background_task(
+        chatbot_reply, sid, user.get("name"), data["session"], data["message"], user.get("wire_format", wire.JSON), cancel
+    )
+
+
+# Stops waiting for the chatbot: cancels the user's prompts (of the given
+# session, or all) and confirms with chatbot_cancelled
+@on("chatbot_cancel")
+async def chatbot_cancel(sid, data=None):
+    user = await sio.get_session(sid)
+    session_id = (data or {}).get("session")
+    cancelled = await cancel_chatbot_prompts(sid, user, chatbot_inflight.USER, session_id)
+    await sio.emit(
+        "chatbot_cancelled",
+        wire.encode({"session": session_id, "cancelled": cancelled}, user.get("wire_format", wire.JSON)),
+        to=sid,
+    )
+
+
+@on("heartbeat")
+async def heartbeat(sid, data):
+    main.last_heartbeat[(data["room"], data["name"])] = datetime.now()
+
+
+async def startup():
+    global http_client
+    import httpx
+
+    fanout.loop = asyncio.get_running_loop()
+    http_client = httpx.AsyncClient()
+    # Log what blocks the event loop (see loop_watch.py)
+    main.watchdog.start_asyncio()
+
+
+async def shutdown():
+    await http_client.aclose()
+    await engine.dispose()
+
+
+app = socketio.ASGIApp(sio, other_asgi_app=WSGIMiddleware(flask_app), on_startup=startup, on_shutdown=shutdown)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", 8080)))
@@ -0,0 +1,88 @@
+# Fingerprinted static assets. Running
+#   python assets.py
+# copies each file in ASSETS to static/dist/<name>.<hash>.<ext>, writes .br/.gz
+# variants next to it (served by compression.precompressed_static) and records
+# the mapping in static/dist/manifest.json. Templates link assets through
+# asset_url(); fingerprinted files never change, so they are served with
+# immutable cache headers and repeat page loads skip them entirely.
+# Without a build, or when a source changed after the last build, asset_url()
+# falls back to the plain static file.
+import hashlib
+import json
+import os
+import shutil
+
+from flask import request, url_for
+
+from compression import precompress
+
+ASSETS = ["js/room.js", "css/style.css"]
+DIST = "dist"
+MANIFEST = "manifest.json"
+
+
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+
+def build(static_folder="static"):
+    """Write fingerprinted, precompressed copies of ASSETS and the manifest."""
+    dist = os.path.join(static_folder, DIST)
+    if os.path.isdir(dist):
+        shutil.rmtree(dist)
+    os.makedirs(dist)
+    manifest = {}
+    for asset in ASSETS:
+        source = os.path.join(static_folder, asset)
+        digest = file_hash(source)
+        stem, ext = os.path.splitext(asset)
+        fingerprinted = f"{DIST}/{stem}.{digest}{ext}"
+        target = os.path.join(static_folder, fingerprinted)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(source, target)
+        precompress(target)
+        manifest[asset] = {"path": fingerprinted, "hash": digest}
+    with open(os.path.join(dist, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_manifest(static_folder):
+    """Manifest entries whose source file still matches the build."""
+    try:
+        with open(os.path.join(static_folder, DIST, MANIFEST)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {}
+    current = {}
+    for asset, entry in manifest.items():
+        source = os.path.join(static_folder, asset)
+        if os.path.isfile(source) and file_hash(source) == entry["hash"]:
+            current[asset] = entry["path"]
+        else:
+            print(f"Static asset {asset} changed since the last build; serving it unversioned (run python assets.py)")
+    return current
+
+
+def init_assets(app):
+    manifest = load_manifest(app.static_folder)
+    dist_prefix = f"{app.static_url_path}/{DIST}/"
+
+    @app.context_processor
+    def asset_helpers():
+        def asset_url(asset):
+            return url_for("static", filename=manifest.get(asset, asset))
+
+        return {"asset_url": asset_url}
+
+    @app.after_request
+    def cache_fingerprinted(response):
+        if request.path.startswith(dist_prefix) and response.status_code == 200:
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+
+if __name__ == "__main__":
+    for asset, entry in build().items():
+        print(f"{asset} -> static/{entry['path']}")
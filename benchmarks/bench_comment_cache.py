@@ -0,0 +1,115 @@
+# Time to produce the comments a viewer sees when opening a room: the old
+# recursive fetch of the whole tree (queries per comment), and the first page
+# of top-level comments in each order on a comment_cache miss (a keyset query
+# plus two for the viewer's overlay) and on a hit (only the render). Also the
+# cost of opening one comment's replies.
+# Uses a generated room in SQLite by default; pass --database-url for a real
+# PostgreSQL server (the tables are created there, so use a scratch database).
+#   python -m benchmarks.bench_comment_cache --comments 2000 --viewers 50
+import argparse
+import random
+import statistics
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from comment_cache import SORTS, CommentCache, hot_score
+from main import create_app
+from models import CommentReports, Comments, CommentVotes, Rooms, db
+import wire
+
+
+def fetch_comments_with_replies(room_code, username, comment_id=None):
+    """The recursive fetch room() used before comment_cache."""
+    comments = Comments.query.filter_by(parent_id=comment_id, room_code=room_code).order_by(Comments.timestamp).all()
+    comments_data = []
+    for comment in comments:
+        replies = fetch_comments_with_replies(room_code, username, comment_id=comment.id)
+        user_vote_obj = CommentVotes.query.filter_by(comment_id=comment.id, username=username).first()
+        user_vote = user_vote_obj.vote if user_vote_obj else 0
+        reported_by_user = CommentReports.query.filter_by(comment_id=comment.id, reporter_username=username).first() is not None
+        comments_data.append({
+            "id": comment.id,
+            "text": comment.text,
+            "username": comment.username,
+            "timestamp": wire.timestamp(comment.timestamp),
+            "votes": comment.votes,
+            "userVote": user_vote,
+            "replies": replies,
+            "reportedByUser": reported_by_user,
+            "user_type": wire.user_type_code(comment.user_type),
+        })
+    return comments_data
+
+
+def build_room(room_code, comments, viewers):
+    db.session.add(Rooms(code=room_code, members=[], topic="bench"))
+    db.session.flush()
+    start = datetime(2024, 1, 1)
+    ids = []
+    for i in range(comments):
+        parent = random.choice(ids) if ids and random.random() < 0.6 else None
+        votes = random.randint(-3, 40)
+        timestamp = start + timedelta(seconds=i)
+        comment = Comments(
+            room_code=room_code, parent_id=parent, username=f"user{i % viewers}", user_type="User",
+            text=f"comment {i}", timestamp=timestamp, votes=votes, hot_score=hot_score(votes, timestamp), reply_count=0,
+        )
+        db.session.add(comment)
+        db.session.flush()
+        if parent is not None:
+            db.session.get(Comments, parent).reply_count += 1
+        ids.append(comment.id)
+    for v in range(viewers):
+        for comment_id in random.sample(ids, min(len(ids), 20)):
+            db.session.add(CommentVotes(comment_id=comment_id, username=f"user{v}", user_type="User", vote=random.choice((1, -1)), room_code=room_code))
+        db.session.add(CommentReports(comment_id=random.choice(ids), reporter_username=f"user{v}", user_type="User", reason="spam", room_code=room_code))
+    db.session.commit()
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        fn()
+        times.append(perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark loading a room's comments")
+    parser.add_argument("--comments", type=int, default=2000)
+    parser.add_argument("--viewers", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--database-url", default="sqlite://")
+    args = parser.parse_args()
+    random.seed(1)
+
+    app = create_app(database_url=args.database_url)
+    with app.app_context():
+        db.create_all()
+        build_room("BENCH", args.comments, args.viewers)
+        viewer = "user1"
+        legacy = timed(lambda: fetch_comments_with_replies("BENCH", viewer), max(1, args.repeat // 2))
+        print(f"{args.comments:,} comments, {args.viewers} viewers ({args.database_url.split(':')[0]})")
+        print(f"  whole tree, recursive fetch | {legacy:8.1f} ms per load")
+        for sort in SORTS:
+            miss = timed(lambda: CommentCache(0).page("BENCH", viewer, sort=sort), args.repeat)
+            cache = CommentCache()
+            cache.page("BENCH", viewer, sort=sort)
+            hit = timed(lambda: cache.page("BENCH", viewer, sort=sort), args.repeat)
+            print(f"  first page, {sort:3}             | {miss:8.1f} ms on a miss | {hit:6.2f} ms on a hit")
+
+        # Opening the replies of the comment with the most of them
+        busiest = Comments.query.filter_by(room_code="BENCH").order_by(Comments.reply_count.desc()).first()
+        replies = timed(lambda: CommentCache(0).page("BENCH", viewer, parent_id=busiest.id, sort="top"), args.repeat)
+        print(f"  replies of a comment with {busiest.reply_count} of them | {replies:8.1f} ms")
+
+        # A room load by each viewer in turn, as when everyone opens the room
+        cache = CommentCache()
+        start = perf_counter()
+        for v in range(args.viewers):
+            cache.page("BENCH", f"user{v}")
+        first_round = (perf_counter() - start) * 1000 / args.viewers
+        stats = cache.stats()
+        print(f"  every viewer loading once: {first_round:.1f} ms per load, hit rate {stats['hit_rate']:.0%}")
+        db.drop_all()
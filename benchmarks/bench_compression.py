@@ -0,0 +1,160 @@
+# Bytes on the wire and server CPU per /room page load (rendered room.html plus
+# style.css) with and without response compression, and for a stream of chat
+# events over a websocket with permessage-deflate at different thresholds.
+# Uses synthetic room history, so no database is needed.
+#   python -m benchmarks.bench_compression --messages 500 --comments 200
+import argparse
+import os
+import random
+import zlib
+from datetime import datetime, timedelta
+from time import process_time
+
+from flask import render_template
+from socketio import packet
+
+import compression
+import wire
+from main import create_app
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Vocabulary for the synthetic messages, taken from the README so the text
+# compresses roughly like real chat rather than like a repeated phrase
+with open(os.path.join(REPO, "README.md"), encoding="utf-8") as f:
+    WORDS = sorted({w.strip(".,:;()`*#[]\"'") for w in f.read().split() if w.isascii()} - {""})
+
+
+def sentence(n=12):
+    return " ".join(random.choice(WORDS) for _ in range(n))
+
+
+def room_context(messages, comments):
+    now = datetime.now()
+    names = [f"user{i}" for i in range(30)]
+    comment_list = []
+    for i in range(comments):
+        comment = {
+            "id": i + 1,
+            "text": sentence(),
+            "username": random.choice(names),
+            "timestamp": wire.timestamp(now - timedelta(minutes=comments - i)),
+            "votes": random.randint(-2, 10),
+            "userVote": 0,
+            "reportedByUser": False,
+            "user_type": random.randint(0, 3),
+            "parent_id": None,
+            "reply_count": 0,
+            "replies": [],
+        }
+        # Replies are not sent with the page, only counted
+        if comment_list and random.random() < 0.5:
+            random.choice(comment_list)["reply_count"] += 1
+        else:
+            comment_list.append(comment)
+    state = {
+        "code": "ABCDEF",
+        "name": "user0",
+        "user_type": "Moderator",
+        "user_types": wire.USER_TYPES,
+        "messages": [
+            {"id": i + 1, "name": random.choice(names), "message": sentence(), "date": wire.timestamp(now), "user_type": random.randint(0, 3)}
+            for i in range(messages)
+        ],
+        "has_older_messages": False,
+        "message_page_size": 100,
+        "chatbot_messages": [
+            {"name": "Chatbot", "session": 1, "owner": "user0", "message": sentence(40), "user_type": 3, "date": wire.timestamp(now)}
+            for _ in range(20)
+        ],
+        "chatbot_cursor": None,
+        # First page of top-level comments, newest first
+        "comments": comment_list[::-1][:50],
+        "comments_cursor": str(comment_list[-50]["id"]) if len(comment_list) > 50 else None,
+        "comment_sort": "new",
+        "comment_sorts": ["new", "top", "hot"],
+        "comment_reports": [
+            {"comment_id": i + 1, "reporter_username": "user1", "reason": sentence(6), "date_reported": wire.timestamp(now)}
+            for i in range(20)
+        ],
+    }
+    return {
+        "code": "ABCDEF",
+        "room_state": state,
+        "wire_formats": wire.FORMATS,
+        "name": "user0",
+        "topic": "Library rumor",
+        "user_type": "Moderator",
+        "max_session": 1,
+        "latest_announcement": None,
+    }
+
+
+def page_load(html, css, css_precompressed, encoding, gzip_level, brotli_quality):
+    start = process_time()
+    if encoding is None:
+        body = html
+    else:
+        body = compression.compress(html, encoding, gzip_level, brotli_quality)
+    cpu = process_time() - start
+    static = css if encoding is None else css_precompressed[encoding]
+    return len(body) + len(static), cpu
+
+
+def event_stream(count):
+    now = wire.timestamp()
+    for i in range(count):
+        if i % 3 == 0:
+            payload = ["update_vote", {"comment_id": i, "votes": 3, "userVote": 1}]
+        else:
+            payload = ["message", {"name": f"user{i % 30}", "message": sentence(random.randint(3, 40)), "date": now, "user_type": 0}]
+        yield ("4" + packet.Packet(packet.EVENT, data=payload).encode()).encode()
+
+
+def websocket(frames, threshold, enabled=True, level=zlib.Z_DEFAULT_COMPRESSION):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    total = 0
+    start = process_time()
+    for frame in frames:
+        if enabled and len(frame) >= threshold:
+            frame = compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            frame = frame[:-4]
+        # 2-4 byte websocket frame header
+        total += len(frame) + (2 if len(frame) < 126 else 4)
+    return total, process_time() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark page and websocket compression")
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--comments", type=int, default=200)
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--loads", type=int, default=20, help="Page loads to average CPU over")
+    args = parser.parse_args()
+    random.seed(1)
+
+    app = create_app(database_url="sqlite://")
+    with app.test_request_context("/room"):
+        html = render_template("room.html", **room_context(args.messages, args.comments)).encode()
+    with open(os.path.join(REPO, "static", "css", "style.css"), "rb") as f:
+        css = f.read()
+    css_precompressed = {e: compression.compress(css, e, 9, 11) for e in compression.available_encodings()}
+
+    print(f"/room page load: {len(html):,} B of HTML ({args.messages} messages, {args.comments} comments) + {len(css):,} B of CSS")
+    configs = [("identity", None, 0, 0)]
+    configs += [(f"gzip -{level}", "gzip", level, 0) for level in (1, 6, 9)]
+    if compression.brotli is not None:
+        configs += [(f"brotli q{quality}", "br", 0, quality) for quality in (4, 5, 11)]
+    for label, encoding, level, quality in configs:
+        cpu = 0.0
+        for _ in range(args.loads):
+            size, load_cpu = page_load(html, css, css_precompressed, encoding, level, quality)
+            cpu += load_cpu
+        print(f"  {label:11} | {size:9,} B per load | {cpu / args.loads * 1000:6.2f} ms CPU per load")
+
+    frames = list(event_stream(args.events))
+    raw = sum(len(f) for f in frames)
+    print(f"\nwebsocket: {args.events:,} chat events, {raw:,} B of Socket.IO packets")
+    runs = [("no deflate", 0, False)] + [(f"deflate >= {t} B", t, True) for t in (0, 64, 128, 256, 512)]
+    for label, threshold, enabled in runs:
+        total, cpu = websocket(frames, threshold, enabled)
+        print(f"  {label:16} | {total:9,} B ({total / args.events:5.1f} B/event) | {cpu * 1000:7.1f} ms CPU")
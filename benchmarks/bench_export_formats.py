@@ -0,0 +1,88 @@
+# Compares loading exported messages from CSV (what the research notebooks do
+# today) with the Parquet export, both in full and for a single room.
+#   python -m benchmarks.bench_export_formats --rows 1000000 --rooms 200
+import argparse
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta
+from time import perf_counter
+
+import pandas as pd
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, create_engine, insert
+
+from export_engine import TableProgress, export_table
+from export_parquet import export_table_parquet, load_parquet
+
+
+def build_database(path, rows, rooms):
+    engine = create_engine(f"sqlite:///{path}")
+    metadata = MetaData()
+    messages = Table(
+        "messages",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("room_code", String, nullable=False),
+        Column("name", String, nullable=False),
+        Column("user_type", String, nullable=False),
+        Column("message", String, nullable=False),
+        Column("date", DateTime, nullable=False),
+    )
+    metadata.create_all(engine)
+    codes = [f"R{i:05d}" for i in range(rooms)]
+    user_types = ["User", "Moderator", "Disinformer", "Administrator"]
+    start = datetime(2024, 1, 1)
+    with engine.begin() as connection:
+        for offset in range(0, rows, 50000):
+            connection.execute(
+                insert(messages),
+                [
+                    {
+                        "room_code": random.choice(codes),
+                        "name": f"user{random.randint(0, 999)}",
+                        "user_type": random.choice(user_types),
+                        "message": "lorem ipsum dolor sit amet " * random.randint(1, 6),
+                        "date": start + timedelta(seconds=offset + i),
+                    }
+                    for i in range(min(50000, rows - offset))
+                ],
+            )
+    return engine, messages, codes
+
+
+def timed(label, fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        result = fn()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{label:<40} {best * 1000:10.1f} ms  ({len(result):,} rows)")
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare CSV and Parquet load times")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--rooms", type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Generating {args.rows:,} messages over {args.rooms} rooms...")
+        engine, messages, codes = build_database(os.path.join(tmp, "bench.db"), args.rows, args.rooms)
+
+        csv_path = os.path.join(tmp, "messages.csv.gz")
+        export_table(engine, messages, csv_path, TableProgress("messages"), use_copy=False)
+        export_table_parquet(engine, messages, os.path.join(tmp, "messages.parquet"))
+        print(f"CSV size:     {os.path.getsize(csv_path) / 1e6:8.1f} MB")
+        print(f"Parquet size: {os.path.getsize(os.path.join(tmp, 'messages.parquet')) / 1e6:8.1f} MB")
+
+        room = codes[0]
+        csv_full = timed("CSV (gzip) full load", lambda: pd.read_csv(csv_path, parse_dates=["date"]))
+        timed(
+            "CSV (gzip) one room",
+            lambda: (lambda df: df[df.room_code == room])(pd.read_csv(csv_path, parse_dates=["date"])),
+        )
+        parquet_full = timed("Parquet full load", lambda: load_parquet("messages", data_dir=tmp))
+        parquet_room = timed("Parquet one room (push-down)", lambda: load_parquet("messages", room, data_dir=tmp))
+        print(f"Full load speed-up: {csv_full / parquet_full:.1f}x, one room: {csv_full / parquet_room:.1f}x")
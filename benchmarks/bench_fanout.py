@@ -0,0 +1,109 @@
+# Compares per-event fan-out with per-room micro-batching (fanout.py) for one
+# busy room under bursty traffic. A stand-in for Flask-SocketIO encodes every
+# emitted frame as a Socket.IO packet once and writes it to each client over a
+# real socket pair, which is what dominates the server's cost in a big room.
+#   python -m benchmarks.bench_fanout --clients 300 --bursts 200 --windows 0,5,20
+import argparse
+import json
+import random
+import selectors
+import socket
+import threading
+from time import perf_counter, sleep, thread_time
+
+from fanout import RoomFanout
+
+EVENTS = ["message", "new_comment", "update_vote"]
+
+
+class FakeRoomServer:
+    def __init__(self, clients):
+        self.pairs = [socket.socketpair() for _ in range(clients)]
+        self.lock = threading.Lock()
+        self.packets = 0
+        self.cpu = 0.0
+        self.latencies = []
+        self.running = True
+        self.drainer = threading.Thread(target=self._drain, daemon=True)
+        self.drainer.start()
+
+    def _drain(self):
+        # Plays the clients: just read and discard whatever arrives
+        selector = selectors.DefaultSelector()
+        for _, reader in self.pairs:
+            reader.setblocking(False)
+            selector.register(reader, selectors.EVENT_READ)
+        while self.running:
+            for key, _ in selector.select(timeout=0.05):
+                try:
+                    key.fileobj.recv(1 << 16)
+                except BlockingIOError:
+                    pass
+
+    def emit(self, event, payload, to=None):
+        start_cpu = thread_time()
+        now = perf_counter()
+        events = payload if event == "batch" else [[event, payload]]
+        # Socket.IO EVENT packet ("42" + JSON), encoded once per frame
+        frame = ("42" + json.dumps([event, payload])).encode()
+        with self.lock:
+            for writer, _ in self.pairs:
+                writer.sendall(frame)
+            self.packets += len(self.pairs)
+            self.latencies.extend(now - e[1]["sent_at"] for e in events)
+            self.cpu += thread_time() - start_cpu
+
+    def start_background_task(self, target, *args):
+        threading.Thread(target=target, args=args, daemon=True).start()
+
+    def sleep(self, seconds):
+        sleep(seconds)
+
+    def close(self):
+        self.running = False
+        self.drainer.join()
+        for writer, reader in self.pairs:
+            writer.close()
+            reader.close()
+
+
+def run(clients, bursts, window_ms, seed=1):
+    random.seed(seed)
+    server = FakeRoomServer(clients)
+    fanout = RoomFanout(server, window_ms=window_ms, batched_events=EVENTS)
+    start = perf_counter()
+    for _ in range(bursts):
+        for i in range(random.randint(5, 30)):
+            payload = {
+                "name": f"user{i}",
+                "message": "lorem ipsum dolor sit amet",
+                "date": "2024-01-01 12:00:00",
+                "user_type": "User",
+                "sent_at": perf_counter(),
+            }
+            fanout.emit(random.choice(EVENTS), payload, "ROOM")
+        sleep(random.uniform(0, 0.02))
+    fanout.flush("ROOM")
+    sleep(window_ms / 1000.0 + 0.05)
+    elapsed = perf_counter() - start
+    server.close()
+    latencies = sorted(server.latencies)
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(
+        f"window {window_ms:>5.1f} ms | {fanout.events:6,} events in {fanout.frames:6,} frames | "
+        f"{server.packets:9,} packets ({server.packets / elapsed:10,.0f}/s) | "
+        f"server CPU {server.cpu * 1000:8.1f} ms | latency p50 {p50:5.1f} ms p99 {p99:5.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark per-room fan-out batching")
+    parser.add_argument("--clients", type=int, default=300)
+    parser.add_argument("--bursts", type=int, default=200)
+    parser.add_argument("--windows", default="0,5,20", help="Comma separated batching windows in ms (0 = off)")
+    args = parser.parse_args()
+
+    print(f"{args.clients} clients in one room, {args.bursts} bursts of 5-30 events")
+    for window in args.windows.split(","):
+        run(args.clients, args.bursts, float(window))
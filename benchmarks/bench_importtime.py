@@ -0,0 +1,51 @@
+# Measures cold-start import cost of the server and the CLI tools with
+# `python -X importtime`, and lists the most expensive imports of each.
+#   python -m benchmarks.bench_importtime
+#   python -m benchmarks.bench_importtime main models --top 15
+import argparse
+import os
+import subprocess
+import sys
+from time import perf_counter
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MODULES = ["main", "models", "export_to_csv", "export_engine", "email_zip_to", "mass_infer"]
+
+
+def importtime(module):
+    start = perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO,
+        capture_output=True,
+        text=True,
+    )
+    wall = perf_counter() - start
+    entries = []
+    for line in result.stderr.splitlines():
+        # "import time:      self [us] |  cumulative | imported package"
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        fields = line.split(":", 1)[1].split("|")
+        # Nested imports are indented by two extra spaces per level
+        entries.append((int(fields[1]), int(fields[0]), fields[2][1:].rstrip()))
+    if result.returncode != 0:
+        print(result.stderr.strip().splitlines()[-1])
+    return wall, entries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report cold-start import times")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--top", type=int, default=8, help="Slowest top-level imports to list")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        wall, entries = importtime(module)
+        # Top-level imports are the ones without indentation in the package column
+        top_level = [e for e in entries if not e[2].startswith("  ")]
+        total = sum(e[0] for e in top_level)
+        print(f"\n{module}: {total / 1000:.1f} ms of imports, {wall * 1000:.0f} ms wall-clock incl. interpreter start")
+        for cumulative, _, name in sorted(entries, reverse=True)[: args.top]:
+            print(f"  {cumulative / 1000:8.1f} ms  {name.strip()}")
@@ -0,0 +1,53 @@
+# Bytes transferred for a first and a repeat /room load, with the client code
+# inlined in the page (as room.html used to do) and as fingerprinted bundles
+# (assets.py) that the browser caches as immutable. Uses the synthetic room
+# from bench_compression; sizes are after brotli (or gzip) compression.
+#   python -m benchmarks.bench_page_load --messages 100 --comments 50
+import argparse
+import os
+import random
+
+from flask import render_template
+
+import compression
+from benchmarks.bench_compression import REPO, room_context
+from main import create_app
+
+
+def read(path):
+    with open(os.path.join(REPO, path), "rb") as f:
+        return f.read()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark first and repeat page loads")
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--comments", type=int, default=50)
+    args = parser.parse_args()
+    random.seed(1)
+
+    app = create_app(database_url="sqlite://")
+    with app.test_request_context("/room"):
+        html = render_template("room.html", **room_context(args.messages, args.comments)).encode()
+    js = read("static/js/room.js")
+    css = read("static/css/style.css")
+
+    encoding = compression.available_encodings()[0]
+    page = len(compression.compress(html, encoding))
+    # Static files are precompressed at the highest level by the build
+    js_size = len(compression.compress(js, encoding, 9, 11))
+    css_size = len(compression.compress(css, encoding, 9, 11))
+    # Inlined, the script is part of every (dynamically compressed) page
+    inline_page = len(compression.compress(html + js, encoding))
+
+    print(f"{args.messages} messages, {args.comments} comments, {encoding} encoded")
+    print(f"  page {page:,} B | room.js {js_size:,} B | style.css {css_size:,} B")
+    # Before, style.css was revalidated with a conditional request (no body);
+    # fingerprinted bundles are not requested again at all
+    rows = [
+        ("inline JS", inline_page + css_size, inline_page),
+        ("bundled JS", page + js_size + css_size, page),
+    ]
+    for label, first, repeat in rows:
+        print(f"  {label:10} | first load {first:8,} B | repeat load {repeat:8,} B")
+    print(f"  repeat load transfers {rows[1][2] / rows[0][2]:.0%} of the inline version")
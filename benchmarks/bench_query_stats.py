@@ -0,0 +1,76 @@
+# What query_stats.py's accounting adds to every SQL statement: the same
+# primary key lookups timed with its cursor events removed and installed.
+# Uses SQLite in memory by default (the worst case, statements there are the
+# cheapest); pass --database-url for a real PostgreSQL server (the tables are
+# created there, so use a scratch database).
+#   python -m benchmarks.bench_query_stats --queries 5000
+import argparse
+import statistics
+from time import perf_counter
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import main
+from main import create_app
+from models import Rooms, db
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        fn()
+        times.append(perf_counter() - start)
+    return statistics.median(times)
+
+
+def set_listeners(installed):
+    stats = main.query_stats
+    for name, listener in (
+        ("before_cursor_execute", stats.before_cursor_execute),
+        ("after_cursor_execute", stats.after_cursor_execute),
+    ):
+        if installed and not event.contains(Engine, name, listener):
+            event.listen(Engine, name, listener)
+        elif not installed and event.contains(Engine, name, listener):
+            event.remove(Engine, name, listener)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the per-statement cost of query accounting")
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--database-url", default="sqlite://")
+    args = parser.parse_args()
+
+    # Every lookup repeats one statement; keep the log quiet
+    main.query_stats.slow_ms = float("inf")
+    main.query_stats.n_plus_one = float("inf")
+    app = create_app(database_url=args.database_url)
+    with app.app_context():
+        db.create_all()
+        db.session.add(Rooms(code="BENCH", members="[]", topic="bench"))
+        db.session.commit()
+
+    def lookups():
+        with app.app_context():
+            for _ in range(args.queries):
+                Rooms.query.filter_by(code="BENCH").first()
+                db.session.expunge_all()
+
+    print(f"{args.queries:,} lookups ({args.database_url.split(':')[0]}), median of {args.repeat}")
+    lookups()  # warm up
+    # Alternated, so that noise on the machine weighs on both alike
+    times = {"without": [], "query_stats": []}
+    for _ in range(args.repeat):
+        for label, installed in (("without", False), ("query_stats", True)):
+            set_listeners(installed)
+            times[label].append(timed(lookups, 1))
+    results = {}
+    for label, samples in times.items():
+        results[label] = statistics.median(samples) / args.queries * 1e6
+        print(f"  {label:12} | {results[label]:7.1f} us per statement")
+    print(f"  overhead     | {results['query_stats'] - results['without']:7.1f} us per statement")
+    with app.app_context():
+        db.drop_all()
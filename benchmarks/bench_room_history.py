@@ -0,0 +1,84 @@
+# Time to get the chat history pages of a busy room: the newest page (what
+# /room is rendered with) and the older pages a client scrolls through, read
+# with a keyset query versus from room_history's ring buffer. Also the memory
+# the buffers take for --rooms such rooms.
+# Uses a generated room in SQLite by default; pass --database-url for a real
+# PostgreSQL server (the tables are created there, so use a scratch database).
+#   python -m benchmarks.bench_room_history --messages 20000 --rooms 1000
+import argparse
+import random
+import statistics
+from datetime import datetime, timedelta
+from time import perf_counter
+
+import main
+from main import create_app, message_page
+from models import Messages, Rooms, db
+from room_history import HistoryRecord, RoomBuffer, RoomHistory
+
+
+def build_room(room_code, messages):
+    db.session.add(Rooms(code=room_code, members="[]", topic="bench"))
+    start = datetime(2024, 1, 1)
+    db.session.add_all(
+        Messages(
+            room_code=room_code, name=f"user{i % 50}", message=f"message {i} " + "x" * random.randint(5, 120),
+            user_type="User", date=start + timedelta(seconds=i),
+        )
+        for i in range(messages)
+    )
+    db.session.commit()
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        fn()
+        times.append(perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def pages(before_ids, page_size):
+    before_id = None
+    for _ in range(before_ids):
+        page, _ = message_page("BENCH", before_id, page_size)
+        before_id = page[0]["id"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark serving a room's chat history from memory")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--capacity", type=int, default=300, help="ROOM_HISTORY_SIZE")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--rooms", type=int, default=1000, help="Rooms to size the buffers for")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--database-url", default="sqlite://")
+    args = parser.parse_args()
+    random.seed(1)
+
+    app = create_app(database_url=args.database_url)
+    with app.app_context():
+        db.create_all()
+        build_room("BENCH", args.messages)
+        in_memory = args.capacity // args.page_size
+        print(
+            f"{args.messages:,} messages in the room, pages of {args.page_size}, {args.capacity} kept in memory"
+            f" ({args.database_url.split(':')[0]})"
+        )
+        for label, history in (("database", RoomHistory(capacity=0)), ("room_history", RoomHistory(args.capacity))):
+            main.room_history = history
+            message_page("BENCH", limit=args.page_size)  # loads the buffer
+            newest = timed(lambda: message_page("BENCH", limit=args.page_size), args.repeat)
+            scroll = timed(lambda: pages(in_memory, args.page_size), args.repeat)
+            print(f"  {label:12} | newest page {newest:7.3f} ms | newest {in_memory} pages {scroll:7.3f} ms")
+        stats = main.room_history.stats()
+        print(f"  room_history hit rate {stats['hit_rate']:.0%}, {stats['bytes'] / 1024:.0f} KiB for the room")
+
+        # Memory for many busy rooms with full buffers
+        rows = Messages.query.filter_by(room_code="BENCH").order_by(Messages.id.desc()).limit(args.capacity).all()
+        records = [HistoryRecord.from_message(row) for row in reversed(rows)]
+        per_room = RoomBuffer(args.capacity, records).size
+        total = per_room * args.rooms
+        print(f"  {args.rooms} full rooms: {total / 2**20:.1f} MiB (ROOM_HISTORY_MB to cap it)")
+        db.drop_all()
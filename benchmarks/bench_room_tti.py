@@ -0,0 +1,99 @@
+# Time until the /room page is interactive (room.js has rendered the history
+# it was served with, window.roomReady) and the number of DOM nodes it ends up
+# with, for rooms with long histories. Compares the windowed rendering of chat
+# messages in static/js/room.js (HISTORY_PAGE_SIZE at a time) against rendering
+# them all; comments always arrive a page at a time. Pass --baseline with
+# another build of room.js to compare against it instead, e.g.
+#   git show <rev>:static/js/room.js > /tmp/room_old.js
+# Uses the synthetic room from bench_compression in headless Chromium; needs
+#   pip install playwright && playwright install chromium
+#   python -m benchmarks.bench_room_tti --messages 1000 5000 20000
+import argparse
+import json
+import os
+import random
+import statistics
+
+from flask import render_template
+
+from benchmarks.bench_compression import REPO, room_context
+from main import create_app
+
+try:
+    from playwright.sync_api import sync_playwright
+except ImportError:  # optional; only this benchmark needs it
+    sync_playwright = None
+
+# Socket.IO and msgpack come from CDNs; the page only needs io() to exist
+IO_STUB = "window.io = () => ({ on() {}, emit() {}, listeners() { return []; } });"
+
+
+def read(path):
+    with open(os.path.join(REPO, path), "rb") as f:
+        return f.read()
+
+
+def render(app, messages, comments, render_all):
+    context = room_context(messages, comments)
+    state = context["room_state"]
+    if render_all:
+        state["message_page_size"] = len(state["messages"]) or 1
+    with app.test_request_context("/room"):
+        return render_template("room.html", **context)
+
+
+def measure(browser, html, script, runs):
+    def handle(route):
+        path = route.request.url.split("//", 1)[1].split("/", 1)[1].split("?")[0]
+        if path == "room":
+            route.fulfill(body=html, content_type="text/html")
+        elif path.startswith("static/js/room"):
+            route.fulfill(body=script, content_type="text/javascript")
+        elif path.startswith("static/"):
+            route.fulfill(body=read(path), content_type="text/css" if path.endswith(".css") else None)
+        elif path == "get_sessions":
+            route.fulfill(body=json.dumps({"sessions": [1]}), content_type="application/json")
+        elif path.startswith("identicon/"):
+            route.fulfill(status=204)
+        else:
+            route.fulfill(body="", content_type="text/javascript")
+
+    times, nodes = [], 0
+    for _ in range(runs):
+        page = browser.new_page()
+        page.add_init_script(IO_STUB)
+        page.route("**/*", handle)
+        page.goto("http://room.test/room", wait_until="load")
+        page.wait_for_function("window.roomReady !== undefined")
+        times.append(page.evaluate("window.roomReady"))
+        nodes = page.evaluate("document.getElementsByTagName('*').length")
+        page.close()
+    return statistics.median(times), nodes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark time to interactive of long rooms")
+    parser.add_argument("--messages", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--comments-ratio", type=float, default=0.5, help="Comments per message")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--baseline", help="Another room.js to compare against (rendered with all history)")
+    args = parser.parse_args()
+    if sync_playwright is None:
+        print("playwright is not installed; pip install playwright && playwright install chromium")
+        raise SystemExit(0)
+
+    app = create_app(database_url="sqlite://")
+    script = read("static/js/room.js")
+    baseline = open(args.baseline, "rb").read() if args.baseline else script
+    with sync_playwright() as p:
+        browser = p.chromium.launch()
+        for count in args.messages:
+            comments = int(count * args.comments_ratio)
+            random.seed(1)
+            windowed = measure(browser, render(app, count, comments, False), script, args.runs)
+            random.seed(1)
+            full = measure(browser, render(app, count, comments, True), baseline, args.runs)
+            print(f"{count:,} messages, {comments:,} comments")
+            for label, (ready, nodes) in (("render all", full), ("windowed", windowed)):
+                print(f"  {label:10} | interactive after {ready:8.1f} ms | {nodes:7,} DOM nodes")
+        browser.close()
@@ -0,0 +1,169 @@
+# Full-text search (search.py) on a generated corpus of room messages, compared
+# with scanning the text the way grepping an export does (ILIKE). Builds the
+# corpus server-side in a scratch PostgreSQL database, which is dropped again
+# unless --keep is given. Also reports what the generated search_vector column
+# costs on the write path.
+#   python -m benchmarks.bench_search --rows 1000000 --rooms 200
+#   (uses DATABASE_URL's server by default; --database-url to point elsewhere)
+import argparse
+import os
+import statistics
+from time import perf_counter
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+
+import manage
+import search
+from benchmarks.bench_compression import WORDS
+from models import get_database_url
+
+
+# label, search query, substring for the ILIKE comparison
+QUERIES = [
+    ("rare", "zyzzyva", "zyzzyva"),
+    ("medium", "chat", "chat"),
+    ("common", "room", "room"),
+    ("phrase", '"python main"', "python main"),
+]
+
+
+def build_corpus(engine, rows, rooms):
+    with engine.begin() as connection:
+        connection.execute(
+            text("INSERT INTO rooms (code, topic, members) SELECT 'R' || lpad(g::text, 5, '0'), 'topic', '[]' FROM generate_series(1, :rooms) g"),
+            {"rooms": rooms},
+        )
+        # Sentences of 4-30 words drawn from the README vocabulary; the g > 0
+        # makes the sub-select run once per row instead of once overall
+        connection.execute(
+            text("""
+                INSERT INTO messages (room_code, name, user_type, message, date)
+                SELECT 'R' || lpad((1 + g % :rooms)::text, 5, '0'), 'user' || (g % 500), 'User',
+                       array_to_string(ARRAY(
+                           SELECT (CAST(:words AS text[]))[1 + floor(random() * :nwords)::int]
+                           FROM generate_series(1, 4 + (g * 7) % 27) WHERE g > 0
+                       ), ' '),
+                       now() - make_interval(secs => :rows - g)
+                FROM generate_series(1, :rows) g
+            """),
+            {"rooms": rooms, "rows": rows, "words": WORDS, "nwords": len(WORDS)},
+        )
+        # A term that is actually rare; every vocabulary word is in thousands of rows
+        connection.execute(text("UPDATE messages SET message = message || ' zyzzyva' WHERE id % 20000 = 0"))
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("VACUUM ANALYZE messages"))
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        result = fn()
+        times.append(perf_counter() - start)
+    return statistics.median(times) * 1000, result
+
+
+def write_cost(engine, rows):
+    """Insert rows into messages and into a copy of it without search_vector."""
+    insert = """
+        INSERT INTO {table} (room_code, name, user_type, message, date)
+        SELECT room_code, name, user_type, message, date FROM messages ORDER BY id LIMIT :rows
+    """
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE messages_plain (LIKE messages INCLUDING DEFAULTS)"))
+        connection.execute(text("ALTER TABLE messages_plain DROP COLUMN search_vector"))
+    costs = {}
+    for table in ("messages_plain", "messages"):
+        with engine.begin() as connection:
+            start = perf_counter()
+            connection.execute(text(insert.format(table=table)), {"rows": rows})
+            costs[table] = perf_counter() - start
+    return costs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark full-text search over messages")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--rooms", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--pages", type=int, default=10, help="Pages to walk for the keyset vs OFFSET comparison")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL") or get_database_url())
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch database")
+    args = parser.parse_args()
+
+    from sqlalchemy_utils import create_database, database_exists, drop_database
+
+    url = make_url(args.database_url).set(database="rumorchat_bench_search")
+    if database_exists(url):
+        drop_database(url)
+    create_database(url)
+    engine = create_engine(url)
+    try:
+        manage.create_db(engine)
+        start = perf_counter()
+        build_corpus(engine, args.rows, args.rooms)
+        print(f"Built {args.rows:,} messages in {args.rooms} rooms in {perf_counter() - start:.1f} s")
+
+        room = "R00001"
+        print(f"\nranked first page ({search.SEARCH_PAGE_SIZE} results) in one room, and all matches as grepping an export finds them")
+        with engine.connect() as connection:
+            for label, query, term in QUERIES:
+                matches = connection.execute(
+                    text("SELECT count(*) FROM messages WHERE search_vector @@ websearch_to_tsquery('english', :q)"), {"q": query}
+                ).scalar()
+                ranked, _ = timed(lambda: search.search(connection, query, "messages", room), args.repeat)
+                scan_room, _ = timed(
+                    lambda: connection.execute(
+                        text("SELECT id, message FROM messages WHERE room_code = :r AND message ILIKE :p"), {"r": room, "p": f"%{term}%"}
+                    ).all(),
+                    args.repeat,
+                )
+                count, _ = timed(
+                    lambda: connection.execute(
+                        text("SELECT count(*) FROM messages WHERE search_vector @@ websearch_to_tsquery('english', :q)"), {"q": query}
+                    ).scalar(),
+                    args.repeat,
+                )
+                scan, _ = timed(
+                    lambda: connection.execute(text("SELECT count(*) FROM messages WHERE message ILIKE :p"), {"p": f"%{term}%"}).scalar(),
+                    args.repeat,
+                )
+                print(
+                    f"  {label:6} {query!r:15} {matches:8,} rows | ranked page {ranked:7.1f} ms | ILIKE room {scan_room:7.1f} ms"
+                    f" | all rooms: @@ {count:7.1f} ms, ILIKE {scan:7.1f} ms"
+                )
+
+            print(f"\nwalking {args.pages} pages of 'room' in {room}: keyset cursor vs OFFSET")
+            cursor = None
+            keyset = []
+            for _ in range(args.pages):
+                elapsed, (_, cursor) = timed(lambda: search.search(connection, "room", "messages", room, cursor=cursor), 1)
+                keyset.append(elapsed)
+                if cursor is None:
+                    break
+            offset = []
+            for page in range(len(keyset)):
+                elapsed, _ = timed(
+                    lambda: connection.execute(
+                        text("""
+                            SELECT id, ts_headline('english', message, q, :o), ts_rank(search_vector, q) AS rank
+                            FROM messages, websearch_to_tsquery('english', 'room') q
+                            WHERE search_vector @@ q AND room_code = :r
+                            ORDER BY rank DESC, id DESC OFFSET :off LIMIT :n
+                        """),
+                        {"r": room, "o": search.HEADLINE_OPTIONS, "off": page * search.SEARCH_PAGE_SIZE, "n": search.SEARCH_PAGE_SIZE},
+                    ).all(),
+                    1,
+                )
+                offset.append(elapsed)
+            print(f"  keyset cursor {sum(keyset):7.1f} ms total | OFFSET {sum(offset):7.1f} ms total")
+
+        inserted = min(args.rows, 100000)
+        costs = write_cost(engine, inserted)
+        plain, indexed = costs["messages_plain"], costs["messages"]
+        print(f"\nwrite path, {inserted:,} inserts: {plain * 1e6 / inserted:.1f} us/row without, {indexed * 1e6 / inserted:.1f} us/row with search_vector + GIN index")
+    finally:
+        engine.dispose()
+        if not args.keep:
+            drop_database(url)
@@ -0,0 +1,199 @@
+# The same workload against each way of serving the app, side by side:
+#   eventlet   python main.py (Flask-SocketIO on eventlet green threads)
+#   gevent     ASYNC_MODE=gevent python main.py
+#   threading  ASYNC_MODE=threading python main.py (OS threads)
+#   asgi       uvicorn asgi:app (AsyncServer, asyncpg, httpx)
+# Modes whose packages are missing (see concurrency.py) fail to start and
+# are skipped.
+# For each, a server is started on a scratch PostgreSQL database and
+#   - fan-out: --clients users join one room and one of them sends --messages
+#     chat messages; latency is from sending to each member receiving it
+#   - chatbot: every user sends a prompt at once to a fake LLM backend with
+#     --llm-latency seconds per reply; throughput is prompts answered per second
+# Clients are python-socketio's AsyncClient in this process, so they need
+#   pip install aiohttp uvicorn asyncpg httpx sqlalchemy_utils
+#   python -m benchmarks.bench_servers --clients 50 --messages 200
+#   (uses DATABASE_URL's server by default; --database-url to point elsewhere)
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+from time import perf_counter, sleep
+
+import httpx
+import socketio
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+
+import concurrency
+import manage
+from benchmarks.bench_compression import REPO
+from fake_llm_backend import start_fake_backend
+from models import get_database_url
+
+# main.py's startup, on a given port and without the debugger and reloader
+MAIN = """
+import concurrency; concurrency.patch()
+import sys, main
+app = main.create_app()
+main.start_watchdog()
+main.socketio.run(app, port=int(sys.argv[1]), log_output=False, allow_unsafe_werkzeug=True)
+"""
+
+# Command line of each server, given its port; main.py's run with ASYNC_MODE set to the key
+SERVERS = {
+    "eventlet": lambda port: [sys.executable, "-c", MAIN, str(port)],
+    "gevent": lambda port: [sys.executable, "-c", MAIN, str(port)],
+    "threading": lambda port: [sys.executable, "-c", MAIN, str(port)],
+    "asgi": lambda port: [sys.executable, "-m", "uvicorn", "asgi:app", "--port", str(port), "--log-level", "warning"],
+}
+
+
+def start_server(mode, port, env):
+    # The servers print every message; keep their output out of the results
+    if mode in concurrency.ASYNC_MODES:
+        env = dict(env, ASYNC_MODE=mode)
+    proc = subprocess.Popen(SERVERS[mode](port), cwd=REPO, env=env, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return proc
+        except httpx.TransportError:
+            if proc.poll() is not None:
+                break
+            sleep(0.1)
+    proc.terminate()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def login(base_url, name, code=None, topic=None):
+    """Session cookie header for a user who joined a room, or created one on
+    the given topic."""
+    form = {"name": name, "user_type": "User"}
+    form.update({"code": code, "join": "1"} if code else {"code": "", "create": "1", "topic": topic})
+    with httpx.Client(base_url=base_url) as client:
+        client.post("/", data=form)
+        return "; ".join(f"{key}={value}" for key, value in client.cookies.items())
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000 if values else float("nan")
+
+
+async def run(base_url, cookies, messages, interval):
+    received = {}  # message number -> receive times
+    replies = {}  # user -> reply time
+    sent = {}
+    clients = []
+    for i, cookie in enumerate(cookies):
+        client = socketio.AsyncClient()
+
+        async def on_message(data):
+            text_ = data.get("message", "")
+            if text_.startswith("bench "):
+                received.setdefault(int(text_[6:]), []).append(perf_counter())
+
+        async def on_response(data, i=i):
+            replies[i] = perf_counter()
+
+        client.on("message", on_message)
+        client.on("chatbot_response", on_response)
+        await client.connect(base_url, headers={"Cookie": cookie}, transports=["websocket"])
+        clients.append(client)
+    await asyncio.sleep(0.5)
+
+    for n in range(messages):
+        sent[n] = perf_counter()
+        await clients[0].emit("message", {"data": f"bench {n}"})
+        await asyncio.sleep(interval)
+    expected = messages * len(clients)
+    deadline = perf_counter() + 10
+    while sum(map(len, received.values())) < expected and perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    latencies = [t - sent[n] for n, times in received.items() for t in times]
+
+    start = perf_counter()
+    await asyncio.gather(*(client.emit("chatbot_prompt", {"session": 1, "message": "hi"}) for client in clients))
+    deadline = start + 60
+    while len(replies) < len(clients) and perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    chatbot = [t - start for t in replies.values()]
+
+    await asyncio.gather(*(client.disconnect() for client in clients))
+    return latencies, expected, chatbot
+
+
+def bench(mode, args, env, engine):
+    """Run the workload --repeat times against one server; percentiles are
+    over every round's samples, throughput is the median round's."""
+    port = args.port
+    base_url = f"http://127.0.0.1:{port}"
+    latencies, expected, throughputs, chatbot = [], 0, [], []
+    try:
+        proc = start_server(mode, port, env)
+    except RuntimeError as e:
+        print(f"  {mode:9} | {e}")
+        return
+    try:
+        for n in range(args.repeat):
+            # Each round gets a fresh room and users
+            topic = f"{mode} {n}"
+            first = login(base_url, f"{mode}{n}user0", topic=topic)
+            with engine.connect() as connection:
+                code = connection.execute(text("SELECT code FROM rooms WHERE topic = :topic"), {"topic": topic}).scalar()
+            cookies = [first] + [login(base_url, f"{mode}{n}user{i}", code) for i in range(1, args.clients)]
+            round_latencies, round_expected, round_chatbot = asyncio.run(
+                run(base_url, cookies, args.messages, args.interval / 1000)
+            )
+            latencies += round_latencies
+            expected += round_expected
+            chatbot += round_chatbot
+            throughputs.append(len(round_chatbot) / max(round_chatbot) if round_chatbot else 0)
+    finally:
+        proc.terminate()
+        proc.wait()
+    prompts = args.clients * args.repeat
+    print(
+        f"  {mode:9} | fan-out p50 {percentile(latencies, 0.5):7.1f} ms, p99 {percentile(latencies, 0.99):7.1f} ms,"
+        f" {len(latencies):,}/{expected:,} delivered | chatbot {len(chatbot)}/{prompts} answered,"
+        f" {statistics.median(throughputs):6.1f}/s, p50 {percentile(chatbot, 0.5):7.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark each concurrency backend side by side")
+    parser.add_argument("--modes", nargs="+", choices=list(SERVERS), default=list(SERVERS))
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=10, help="Milliseconds between messages")
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL") or get_database_url())
+    args = parser.parse_args()
+
+    from sqlalchemy_utils import create_database, database_exists, drop_database
+
+    url = make_url(args.database_url).set(database="rumorchat_bench_servers")
+    if database_exists(url):
+        drop_database(url)
+    create_database(url)
+    engine = create_engine(url)
+    _, llm_url = start_fake_backend(latency=args.llm_latency)
+    env = dict(
+        os.environ,
+        DATABASE_URL=url.render_as_string(hide_password=False),
+        SECRET_KEY=os.getenv("SECRET_KEY") or "bench",
+        LLM_BACKENDS=f'[{{"name": "fake", "url": "{llm_url}"}}]',
+    )
+    try:
+        manage.create_db(engine)
+        print(f"{args.clients} clients in one room, {args.messages} messages {args.interval:g} ms apart, LLM replies in {args.llm_latency:g} s")
+        for mode in args.modes:
+            bench(mode, args, env, engine)
+    finally:
+        engine.dispose()
+        drop_database(url)
@@ -0,0 +1,105 @@
+# Bytes and time to open a long chatbot session (/get_session_history): the
+# whole transcript, fetched twice as the endpoint used to, against the latest
+# page (chatbot_sessions.history_page) and against walking back through every
+# page. Replies are a few KB each, like real LLM answers.
+# Uses a generated session in SQLite by default; pass --database-url for a real
+# PostgreSQL server (the tables are created there, so use a scratch database).
+#   python -m benchmarks.bench_session_history --messages 1000
+import argparse
+import gzip
+import json
+import random
+import statistics
+from datetime import datetime, timedelta
+from time import perf_counter
+
+import chatbot_sessions
+import wire
+from benchmarks.bench_compression import sentence
+from main import create_app
+from models import ChatbotMessages, db
+
+
+def legacy_history(owner, session_number):
+    """What get_session_history returned before paging, with its two queries."""
+    messages = ChatbotMessages.query.filter_by(owner=owner, session=session_number).all()
+    messages_data = [
+        {"name": m.name, "owner": m.owner, "message": m.message, "date": wire.timestamp(m.date)}
+        for m in messages
+    ]
+    ChatbotMessages.query.filter_by(owner=owner, session=session_number).all()
+    return {"messages": messages_data}
+
+
+def build_session(owner, messages, other_sessions):
+    start = datetime(2024, 1, 1)
+    rows = []
+    # Other sessions of the same user, so the index has something to skip
+    for session_number in range(1, other_sessions + 2):
+        count = messages if session_number == 1 else messages // 10
+        for i in range(count):
+            bot = i % 2 == 1
+            rows.append(
+                ChatbotMessages(
+                    name="Chatbot" if bot else owner, owner=owner, session=session_number,
+                    user_type="Administrator" if bot else "User",
+                    message=sentence(random.randint(300, 700)) if bot else sentence(random.randint(5, 30)),
+                    date=start + timedelta(seconds=i),
+                )
+            )
+    db.session.add_all(rows)
+    db.session.commit()
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        result = fn()
+        times.append(perf_counter() - start)
+    return statistics.median(times) * 1000, result
+
+
+def sizes(payload):
+    body = json.dumps(payload).encode()
+    return len(body), len(gzip.compress(body, 6))
+
+
+def walk(owner, session_number):
+    cursor, pages, total = None, 0, 0
+    while True:
+        messages, cursor = chatbot_sessions.history_page(owner, session_number, cursor)
+        pages += 1
+        total += len(messages)
+        if cursor is None:
+            return pages, total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark opening a long chatbot session")
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--other-sessions", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--database-url", default="sqlite://")
+    args = parser.parse_args()
+    random.seed(1)
+
+    app = create_app(database_url=args.database_url)
+    with app.app_context():
+        db.create_all()
+        build_session("bench", args.messages, args.other_sessions)
+        full_ms, full = timed(lambda: legacy_history("bench", 1), args.repeat)
+        page_ms, page = timed(lambda: chatbot_sessions.history_page("bench", 1), args.repeat)
+        cursor = page[1]
+        older_ms, _ = timed(lambda: chatbot_sessions.history_page("bench", 1, cursor), args.repeat)
+        walk_ms, (pages, total) = timed(lambda: walk("bench", 1), 1)
+        assert total == args.messages
+
+        full_size, full_gzip = sizes(full)
+        page_size, page_gzip = sizes({"messages": page[0], "next_cursor": page[1]})
+        print(f"{args.messages:,} messages in the session ({args.database_url.split(':')[0]}), {chatbot_sessions.HISTORY_PAGE_SIZE} per page")
+        print(f"  whole transcript | {full_ms:8.1f} ms | {full_size / 1024:8.1f} KB, {full_gzip / 1024:7.1f} KB gzipped")
+        print(f"  latest page      | {page_ms:8.1f} ms | {page_size / 1024:8.1f} KB, {page_gzip / 1024:7.1f} KB gzipped")
+        print(f"  an older page    | {older_ms:8.1f} ms")
+        print(f"  every page       | {walk_ms:8.1f} ms in {pages} requests")
+        db.drop_all()
@@ -0,0 +1,75 @@
+# Bytes per event and serialization CPU for the old chat event payloads
+# (date strings, user type strings, inline base64 profile pictures) against
+# the compact wire format in wire.py, as JSON and as msgpack. Sizes are the
+# Socket.IO packets as written to a websocket (binary attachments included).
+#   python -m benchmarks.bench_wire --events 100000
+import argparse
+import base64
+from datetime import datetime
+from time import process_time
+
+from socketio import packet
+
+import wire
+
+# A real 16x16 identicon from main.generate_identicon is ~215 bytes of PNG
+PROFILE_PICTURE = base64.b64encode(bytes(215)).decode()
+TEXT = "Did you see the announcement? Apparently the vote is happening tonight"
+
+
+def old_events(now):
+    date = now.strftime("%Y-%m-%d %H:%M:%S")
+    return [
+        ("message", {"name": "alice", "message": TEXT, "date": date, "user_type": "Moderator", "profile_picture": PROFILE_PICTURE}),
+        ("new_comment", {"id": 1234, "text": TEXT, "username": "bob", "timestamp": date, "votes": 3,
+                         "user_type": "User", "profile_picture": PROFILE_PICTURE, "parent_id": 1200}),
+        ("update_vote", {"comment_id": 1234, "votes": 4, "userVote": 1}),
+        ("chatbot_response", {"name": "Chatbot", "session": 2, "message": TEXT * 4, "profile_picture": PROFILE_PICTURE, "date": date}),
+    ]
+
+
+def new_events(now):
+    ts = wire.timestamp(now)
+    return [
+        ("message", {"name": "alice", "message": TEXT, "date": ts, "user_type": wire.user_type_code("Moderator")}),
+        ("new_comment", {"id": 1234, "text": TEXT, "username": "bob", "timestamp": ts, "votes": 3,
+                         "user_type": wire.user_type_code("User"), "parent_id": 1200}),
+        ("update_vote", {"comment_id": 1234, "votes": 4, "userVote": 1}),
+        ("chatbot_response", {"name": "Chatbot", "session": 2, "message": TEXT * 4, "date": ts}),
+    ]
+
+
+def packet_size(encoded):
+    # Text packets get a one byte Engine.IO prefix; attachments go as-is
+    if isinstance(encoded, list):
+        return len(encoded[0].encode()) + 1 + sum(len(a) for a in encoded[1:])
+    return len(encoded.encode()) + 1
+
+
+def run(label, build, wire_format, count):
+    now = datetime.now()
+    sizes = {event: packet_size(packet.Packet(packet.EVENT, data=[event, wire.encode(payload, wire_format)]).encode())
+             for event, payload in build(now)}
+    start = process_time()
+    for _ in range(count // len(sizes)):
+        for event, payload in build(now):
+            packet.Packet(packet.EVENT, data=[event, wire.encode(payload, wire_format)]).encode()
+    cpu = process_time() - start
+    print(
+        f"{label:15} | " + " | ".join(f"{event} {size:4} B" for event, size in sizes.items())
+        + f" | {cpu / count * 1e6:5.1f} us/event"
+    )
+    return sizes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark chat event wire formats")
+    parser.add_argument("--events", type=int, default=100000)
+    args = parser.parse_args()
+
+    run("old JSON", old_events, wire.JSON, args.events)
+    run("compact JSON", new_events, wire.JSON, args.events)
+    if wire.msgpack is not None:
+        run("compact msgpack", new_events, wire.MSGPACK, args.events)
+    else:
+        print("msgpack is not installed; skipping the msgpack run")
@@ -0,0 +1,82 @@
+# Chatbot prompts being answered in this process, by the client (Socket.IO
+# sid) waiting for them, so the LLM request can be cancelled when nobody
+# will see the reply: the client disconnected, sent chatbot_cancel, or sent
+# a prompt to another session. Cancelling is cooperative: the prompt's
+# CancelToken aborts its upstream HTTP requests (see llm_router.py) and the
+# background task then skips saving and sending the reply. llm_worker.py
+# keeps its jobs here by job id instead, and counts the tokens it saves in
+# the database (chatbot_jobs.discard()). The counters (prompts cancelled by
+# reason, completion tokens saved) are in stats().
+import threading
+from collections import Counter
+
+from llm_router import CancelToken
+
+DISCONNECT = "disconnect"
+USER = "user"
+SWITCH = "session switch"
+
+
+class InFlightPrompts:
+    def __init__(self):
+        self.prompts = {}  # sid -> {CancelToken: chatbot session number}
+        self.cancelled = Counter()  # reason -> prompts cancelled
+        self.tokens_saved = 0
+        self.lock = threading.Lock()
+
+    def start(self, sid, session_number):
+        """Registers a prompt of the client; returns its CancelToken, to pass
+        to llm_router and to finish() once answered."""
+        token = CancelToken()
+        with self.lock:
+            self.prompts.setdefault(sid, {})[token] = session_number
+        return token
+
+    def finish(self, sid, token):
+        with self.lock:
+            prompts = self.prompts.get(sid)
+            if prompts is not None:
+                prompts.pop(token, None)
+                if not prompts:
+                    del self.prompts[sid]
+
+    def cancel(self, sid, reason, session_number=None, keep_session=None):
+        """Cancels the client's prompts (those of session_number only, or all
+        but keep_session's); returns how many were cancelled."""
+        with self.lock:
+            prompts = self.prompts.get(sid, {})
+            tokens = [
+                token
+                for token, number in prompts.items()
+                if (session_number is None or number == session_number) and number != keep_session
+            ]
+        cancelled = sum(token.cancel(reason) for token in tokens)
+        self.record_cancelled(reason, cancelled)
+        return cancelled
+
+    def keys(self):
+        with self.lock:
+            return list(self.prompts)
+
+    def record_cancelled(self, reason, count=1):
+        """Counts prompts cancelled elsewhere (queued ones, in chatbot_jobs)."""
+        if count:
+            with self.lock:
+                self.cancelled[reason] += count
+
+    def record_saved(self, tokens):
+        """Adds a cancelled prompt's LLMCancelledError.tokens_saved."""
+        with self.lock:
+            self.tokens_saved += tokens
+
+    def __len__(self):
+        with self.lock:
+            return sum(map(len, self.prompts.values()))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "in_flight": sum(map(len, self.prompts.values())),
+                "cancelled": dict(self.cancelled),
+                "tokens_saved": self.tokens_saved,
+            }
@@ -0,0 +1,278 @@
+# Durable queue of chatbot prompts, enabled with CHATBOT_QUEUE=1. Instead of
+# a background task in the web server, each prompt becomes a ChatbotJobs row
+# answered by separate worker processes:
+#   python llm_worker.py --processes 2 --threads 8
+# Workers claim the oldest queued job (FOR UPDATE SKIP LOCKED on PostgreSQL,
+# so they never wait on each other's rows; SQLite has a single writer
+# anyway), ask the LLM, and save the reply and delete the job in one
+# transaction. The reply reaches the client through the Socket.IO message
+# queue (SOCKETIO_MESSAGE_QUEUE, e.g. redis://localhost:6379/0), which every
+# web server subscribes to, so web servers and workers scale separately.
+# Queued jobs survive restarts of either; a job whose LLM request failed is
+# queued again at once, and one whose worker died after CHATBOT_JOB_TIMEOUT
+# seconds, up to MAX_ATTEMPTS times. A job that failed its last attempt is
+# answered with an apology.
+# On PostgreSQL enqueueing also NOTIFYs the workers, so an idle worker picks
+# a job up at once rather than at its next poll.
+# Jobs of a client that disconnects or cancels are deleted if still queued,
+# and marked cancelled if running; the worker notices within POLL_INTERVAL
+# and aborts the LLM request (see chatbot_inflight.py). The completion tokens
+# that saved are added up in ChatbotJobTotals, for the web servers' stats.
+import os
+import select
+from datetime import datetime, timedelta
+from time import sleep
+
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import text
+
+import chatbot_sessions
+import wire
+from models import ChatbotJobs, ChatbotJobTotals, ChatbotMessages, db
+
+QUEUE_ENABLED = os.getenv("CHATBOT_QUEUE", "0") == "1"
+# Seconds an idle worker waits between looking for jobs (without NOTIFY)
+POLL_INTERVAL = float(os.getenv("CHATBOT_QUEUE_POLL", 2))
+# Seconds after which a running job is assumed lost with its worker; keep it
+# above the LLM router's deadline (120 s) or slow replies are answered twice
+JOB_TIMEOUT = float(os.getenv("CHATBOT_JOB_TIMEOUT", 300))
+MAX_ATTEMPTS = 3
+
+QUEUED = "queued"
+RUNNING = "running"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# ChatbotJobTotals counters
+TOKENS_SAVED = "tokens_saved"
+
+CHANNEL = "chatbot_jobs"
+NOTIFY = f"NOTIFY {CHANNEL}"
+
+
+def new_job(owner, session_number, prompt, sid=None, wire_format=wire.JSON):
+    return ChatbotJobs(
+        owner=owner, session=session_number, prompt=prompt, sid=sid, wire_format=wire_format,
+        status=QUEUED, attempts=0, created=datetime.now(),
+    )
+
+
+def enqueue(owner, session_number, prompt, sid=None, wire_format=wire.JSON):
+    """Queue a prompt and commit; sid is the client to send the reply to."""
+    job = new_job(owner, session_number, prompt, sid, wire_format)
+    db.session.add(job)
+    if db.session.get_bind().dialect.name == "postgresql":
+        # Delivered to the listening workers when the job is committed
+        db.session.execute(text(NOTIFY))
+    db.session.commit()
+    return job
+
+
+def pending():
+    """Number of jobs queued or being answered."""
+    return ChatbotJobs.query.filter(ChatbotJobs.status.in_((QUEUED, RUNNING))).count()
+
+
+def cancel_statements(sid, reason, session_number=None, keep_session=None):
+    """Statements cancelling the client's jobs (those of session_number only,
+    or all but keep_session's); the sum of their rowcounts is the number
+    cancelled. Shared with asgi.py, which runs them on an AsyncSession."""
+    jobs = [ChatbotJobs.sid == sid]
+    if session_number is not None:
+        jobs.append(ChatbotJobs.session == session_number)
+    if keep_session is not None:
+        jobs.append(ChatbotJobs.session != keep_session)
+    return (
+        delete(ChatbotJobs).where(*jobs, ChatbotJobs.status == QUEUED).execution_options(synchronize_session=False),
+        update(ChatbotJobs)
+        .where(*jobs, ChatbotJobs.status == RUNNING)
+        .values(status=CANCELLED, error=reason)
+        .execution_options(synchronize_session=False),
+    )
+
+
+def cancel(sid, reason, session_number=None, keep_session=None):
+    """Cancel the client's jobs and commit; returns how many were cancelled."""
+    cancelled = sum(
+        db.session.execute(statement).rowcount
+        for statement in cancel_statements(sid, reason, session_number, keep_session)
+    )
+    db.session.commit()
+    return cancelled
+
+
+def cancelled(job_ids):
+    """{job id: reason} of those of the jobs that were cancelled."""
+    rows = (
+        db.session.query(ChatbotJobs.id, ChatbotJobs.error)
+        .filter(ChatbotJobs.id.in_(job_ids), ChatbotJobs.status == CANCELLED)
+        .all()
+    )
+    db.session.commit()
+    return dict(rows)
+
+
+def discard(job_id, tokens_saved=0):
+    """Delete a cancelled job, once its worker has stopped answering it, and
+    add the completion tokens aborting it saved to the totals."""
+    db.session.rollback()
+    db.session.execute(delete(ChatbotJobs).where(ChatbotJobs.id == job_id))
+    if tokens_saved:
+        add_to_total(TOKENS_SAVED, tokens_saved)
+    db.session.commit()
+
+
+def add_to_total(name, amount):
+    """Add to a ChatbotJobTotals counter, creating it on first use (in the
+    caller's transaction)."""
+    increment = (
+        update(ChatbotJobTotals)
+        .where(ChatbotJobTotals.name == name)
+        .values(value=ChatbotJobTotals.value + amount)
+        .execution_options(synchronize_session=False)
+    )
+    if db.session.execute(increment).rowcount:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(ChatbotJobTotals(name=name, value=amount))
+    except IntegrityError:
+        # Another worker created it meanwhile
+        db.session.execute(increment)
+
+
+def totals():
+    """{counter name: value} of the workers' ChatbotJobTotals."""
+    return dict(db.session.query(ChatbotJobTotals.name, ChatbotJobTotals.value).all())
+
+
+def claim(worker):
+    """Mark the oldest queued job as taken by the worker and commit; returns
+    it, or None if the queue is empty."""
+    oldest = (
+        db.session.query(ChatbotJobs.id)
+        .filter(ChatbotJobs.status == QUEUED)
+        .order_by(ChatbotJobs.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    job_id = db.session.execute(
+        update(ChatbotJobs)
+        .where(ChatbotJobs.id == oldest)
+        .values(status=RUNNING, worker=worker, started=datetime.now(), attempts=ChatbotJobs.attempts + 1)
+        .returning(ChatbotJobs.id)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    db.session.commit()
+    return db.session.get(ChatbotJobs, job_id) if job_id is not None else None
+
+
+def complete(job_id, worker, owner, session_number, reply):
+    """Save the chatbot's reply to the session and delete the job, together.
+    False (and nothing saved) if the job is no longer the worker's: it was
+    cancelled, or ran past JOB_TIMEOUT and was queued again."""
+    deleted = db.session.execute(
+        delete(ChatbotJobs).where(*owned(job_id, worker)).execution_options(synchronize_session=False)
+    ).rowcount
+    if not deleted:
+        db.session.rollback()
+        return False
+    save_reply(owner, session_number, reply)
+    db.session.commit()
+    return True
+
+
+def owned(job_id, worker):
+    """Filters matching the job while the worker is still answering it."""
+    return ChatbotJobs.id == job_id, ChatbotJobs.worker == worker, ChatbotJobs.status == RUNNING
+
+
+def save_reply(owner, session_number, reply):
+    now = datetime.now()
+    db.session.add(
+        ChatbotMessages(name="Chatbot", owner=owner, session=session_number, message=reply, date=now, user_type="Administrator")
+    )
+    chatbot_sessions.record_message(owner, session_number, date=now)
+
+
+def fail(job_id, worker, owner, session_number, error, apology):
+    """After an error, queue the job again; once it has used up MAX_ATTEMPTS,
+    mark it failed and save apology as the chatbot's reply, together.
+    Returns QUEUED or FAILED, or None (and nothing changed) if the job is no
+    longer the worker's: it was cancelled, or queued again by
+    requeue_stale()."""
+    db.session.rollback()
+    error = str(error)[:1000]
+    requeued = db.session.execute(
+        update(ChatbotJobs)
+        .where(*owned(job_id, worker), ChatbotJobs.attempts < MAX_ATTEMPTS)
+        .values(status=QUEUED, worker=None, error=error)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if requeued:
+        if db.session.get_bind().dialect.name == "postgresql":
+            db.session.execute(text(NOTIFY))
+        db.session.commit()
+        return QUEUED
+    failed = db.session.execute(
+        update(ChatbotJobs)
+        .where(*owned(job_id, worker))
+        .values(status=FAILED, worker=None, error=error)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not failed:
+        db.session.rollback()
+        return None
+    save_reply(owner, session_number, apology)
+    db.session.commit()
+    return FAILED
+
+
+def requeue_stale():
+    """Queue again jobs left running longer than JOB_TIMEOUT (their worker
+    died or was killed); fail those that have used up their attempts, and
+    delete cancelled ones."""
+    started_before = ChatbotJobs.started < datetime.now() - timedelta(seconds=JOB_TIMEOUT)
+    db.session.execute(delete(ChatbotJobs).where(ChatbotJobs.status == CANCELLED, started_before))
+    stale = (ChatbotJobs.status == RUNNING, started_before)
+    db.session.execute(
+        update(ChatbotJobs)
+        .where(*stale, ChatbotJobs.attempts >= MAX_ATTEMPTS)
+        .values(status=FAILED, error="Worker timed out")
+        .execution_options(synchronize_session=False)
+    )
+    requeued = db.session.execute(
+        update(ChatbotJobs).where(*stale).values(status=QUEUED, worker=None).execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return requeued
+
+
+class JobWaiter:
+    """Lets an idle worker sleep until a job may be queued: a NOTIFY on
+    PostgreSQL (or the poll interval, whichever comes first), else the poll
+    interval."""
+
+    def __init__(self, engine, poll_interval=POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self.raw = None
+        if engine.dialect.name == "postgresql":
+            # A connection of its own, kept out of the pool while listening
+            self.raw = engine.raw_connection()
+            self.connection = self.raw.dbapi_connection
+            self.connection.autocommit = True
+            self.connection.cursor().execute(f"LISTEN {CHANNEL}")
+
+    def wait(self):
+        if self.raw is None:
+            sleep(self.poll_interval)
+            return
+        if select.select([self.connection], [], [], self.poll_interval)[0]:
+            self.connection.poll()
+            self.connection.notifies.clear()
+
+    def close(self):
+        if self.raw is not None:
+            self.raw.invalidate()
@@ -0,0 +1,177 @@
+# A user's chatbot sessions, one ChatbotSessions row each, so listing them,
+# finding the latest one and creating the next one are lookups on the
+# (owner, session) unique index instead of scans of their ChatbotMessages.
+# Session numbers are allocated as max + 1 under a per-user advisory lock on
+# PostgreSQL, so two tabs creating a session at once get different numbers;
+# elsewhere the unique index rejects a number another request took first and
+# the next one is tried.
+# Each message sent in a session bumps its message_count and last_activity
+# (record_message()); the first prompt becomes its title.
+# A session's transcript is read a page at a time, newest first (history_page()),
+# by keyset on (date, id) over the (owner, session, date, id) index, so
+# switching to a long session only ships its latest replies.
+# Existing databases are backfilled from chatbot_messages by
+#   python manage.py migrate
+# which also deletes the "Started new session: N" rows that used to mark
+# sessions.
+import os
+from datetime import datetime
+
+from sqlalchemy import tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import text
+
+import wire
+from models import ChatbotMessages, ChatbotSessions, db
+
+TITLE_LENGTH = 60
+# Chatbot messages per get_session_history request; replies can be several KB
+HISTORY_PAGE_SIZE = int(os.getenv("CHATBOT_HISTORY_PAGE_SIZE", 20))
+# Attempts at taking the next session number before giving up
+ALLOCATE_ATTEMPTS = 5
+
+
+class HistoryCursorError(ValueError):
+    pass
+
+
+def migrations():
+    """DDL backfilling chatbot_sessions from existing chatbot messages, and the
+    index history_page() reads transcripts by."""
+    marker = "name = 'Chatbot' AND message = 'Started new session: ' || session"
+    return [
+        "CREATE INDEX IF NOT EXISTS ix_chatbot_messages_owner_session_date_id "
+        "ON chatbot_messages (owner, session, date, id)",
+        "INSERT INTO chatbot_sessions (owner, session, message_count, created, last_activity) "
+        f"SELECT owner, session, count(*) FILTER (WHERE NOT ({marker})), min(date), max(date) "
+        "FROM chatbot_messages GROUP BY owner, session "
+        "ON CONFLICT (owner, session) DO NOTHING",
+        f"UPDATE chatbot_sessions s SET title = left(m.message, {TITLE_LENGTH}) FROM ("
+        "SELECT DISTINCT ON (owner, session) owner, session, message FROM chatbot_messages "
+        "WHERE name <> 'Chatbot' ORDER BY owner, session, id"
+        ") m WHERE s.title IS NULL AND s.owner = m.owner AND s.session = m.session",
+        f"DELETE FROM chatbot_messages WHERE {marker}",
+    ]
+
+
+def session_info(row):
+    return {
+        "session": row.session,
+        "title": row.title,
+        "message_count": row.message_count,
+        "last_activity": wire.timestamp(row.last_activity),
+    }
+
+
+def list_sessions(owner):
+    """A user's sessions, oldest first."""
+    return ChatbotSessions.query.filter_by(owner=owner).order_by(ChatbotSessions.session).all()
+
+
+def latest_session(owner):
+    """Number of the user's newest session, or None if they have none."""
+    return (
+        db.session.query(ChatbotSessions.session)
+        .filter_by(owner=owner)
+        .order_by(ChatbotSessions.session.desc())
+        .limit(1)
+        .scalar()
+    )
+
+
+def _insert(owner, session_number):
+    """Insert a session row; False if the user already has that number."""
+    try:
+        with db.session.begin_nested():
+            db.session.add(ChatbotSessions(owner=owner, session=session_number))
+    except IntegrityError:
+        return False
+    return True
+
+
+def ensure_session(owner, session_number=1):
+    """Make sure the user has the given session (e.g. session 1 on joining)."""
+    if ChatbotSessions.query.filter_by(owner=owner, session=session_number).first() is None:
+        _insert(owner, session_number)
+    db.session.commit()
+
+
+def _lock_owner(owner):
+    """Serialise session allocation for one user until the transaction ends."""
+    if db.session.get_bind().dialect.name == "postgresql":
+        db.session.execute(
+            text("SELECT pg_advisory_xact_lock(hashtext('chatbot_sessions'), hashtext(:owner))"), {"owner": owner}
+        )
+
+
+def create_session(owner):
+    """Allocate and commit the user's next session; returns its number."""
+    _lock_owner(owner)
+    for _ in range(ALLOCATE_ATTEMPTS):
+        session_number = (latest_session(owner) or 0) + 1
+        if _insert(owner, session_number):
+            db.session.commit()
+            return session_number
+    raise RuntimeError(f"Could not allocate a chatbot session for {owner}")
+
+
+def record_statements(owner, session_number, message=None, date=None):
+    """The UPDATEs record_message() runs: one counting the message and, for a
+    prompt, one titling the session if it has no title yet (else None)."""
+    where = [ChatbotSessions.owner == owner, ChatbotSessions.session == session_number]
+    count = (
+        update(ChatbotSessions)
+        .where(*where)
+        .values(message_count=ChatbotSessions.message_count + 1, last_activity=date or datetime.now())
+    )
+    title = None
+    if message:
+        title = update(ChatbotSessions).where(*where, ChatbotSessions.title.is_(None)).values(title=message[:TITLE_LENGTH])
+    return count, title
+
+
+def record_message(owner, session_number, message=None, date=None):
+    """Count a message in a session, creating the session if it is new.
+    Pass the message text for prompts by the user; the first becomes the
+    session's title. Does not commit."""
+    count, title = record_statements(owner, session_number, message, date)
+    if not db.session.execute(count).rowcount:
+        _insert(owner, session_number)
+        db.session.execute(count)
+    if title is not None:
+        db.session.execute(title)
+
+
+def encode_cursor(message):
+    return f"{message.date.isoformat()},{message.id}"
+
+
+def decode_cursor(cursor):
+    try:
+        date, _, message_id = cursor.rpartition(",")
+        return datetime.fromisoformat(date), int(message_id)
+    except (AttributeError, ValueError):
+        raise HistoryCursorError(f"Invalid cursor: {cursor}")
+
+
+def history_page(owner, session_number, cursor=None, limit=HISTORY_PAGE_SIZE):
+    """Up to limit messages of a session older than the cursor (the latest
+    ones without one), oldest first, and the cursor of the page before them
+    (None if there is none)."""
+    query = ChatbotMessages.query.filter_by(owner=owner, session=session_number)
+    if cursor:
+        query = query.filter(tuple_(ChatbotMessages.date, ChatbotMessages.id) < decode_cursor(cursor))
+    rows = query.order_by(ChatbotMessages.date.desc(), ChatbotMessages.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    messages = [
+        {
+            "name": message.name,
+            "session": message.session,
+            "owner": message.owner,
+            "message": message.message,
+            "user_type": wire.user_type_code(message.user_type),
+            "date": wire.timestamp(message.date),
+        }
+        for message in reversed(rows[:limit])
+    ]
+    return messages, next_cursor
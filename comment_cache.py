@@ -0,0 +1,305 @@
+# Comment threads, one level at a time. A room's top-level comments, or the
+# replies to one comment, are read a page at a time in one of three orders:
+#   new  newest first
+#   top  most votes first
+#   hot  votes weighed against age (hot_score())
+# Each order has its own index and pages are keyset queries, so a request
+# costs the same however big the thread is; replies are only loaded when the
+# viewer opens them (the load_comments event).
+# The first page of each level and order is shared by everyone in the room and
+# kept in an LRU of COMMENT_CACHE_ROOMS rooms, updated in place by
+# handle_comment, handle_vote and submit_report. What differs per viewer, their
+# votes and reports, is a small map per user in the room's entry that is merged
+# in when a page is rendered for them.
+# The cache lives in the server process and only sees the comments, votes
+# and reports sent to this process, so it is off when SOCKETIO_MESSAGE_QUEUE
+# spreads a room over several servers (other servers would serve stale pages
+# and vote counts), unless COMMENT_CACHE_ROOMS is set; 0 turns it off.
+import math
+import os
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+from time import perf_counter
+
+from sqlalchemy import tuple_
+
+import wire
+from models import CommentReports, Comments, CommentVotes, db
+
+SORTS = ["new", "top", "hot"]
+COMMENT_PAGE_SIZE = int(os.getenv("COMMENT_PAGE_SIZE", 50))
+# Age, in seconds, that is worth ten times the votes in the hot order
+HOT_DECAY_SECONDS = 45000
+EPOCH = datetime(1970, 1, 1)
+# Loads of a viewer's overlay are tracked under (room, OVERLAY, username)
+OVERLAY = "overlay"
+
+
+class CommentPageError(ValueError):
+    pass
+
+
+def hot_score(votes, timestamp):
+    votes = votes or 0
+    sign = 1 if votes > 0 else -1 if votes < 0 else 0
+    # Naive timestamps are taken as UTC, as extract(epoch) does in migrations()
+    return sign * math.log10(max(abs(votes), 1)) + (timestamp - EPOCH).total_seconds() / HOT_DECAY_SECONDS
+
+
+def migrations():
+    """DDL adding the sort columns and indexes to an existing comments table."""
+    return [
+        "ALTER TABLE comments ADD COLUMN IF NOT EXISTS hot_score double precision",
+        "ALTER TABLE comments ADD COLUMN IF NOT EXISTS reply_count integer",
+        "UPDATE comments SET votes = 0 WHERE votes IS NULL",
+        "UPDATE comments SET hot_score = sign(votes) * log(greatest(abs(votes), 1)) "
+        f"+ extract(epoch FROM timestamp) / {HOT_DECAY_SECONDS} WHERE hot_score IS NULL",
+        "UPDATE comments c SET reply_count = (SELECT count(*) FROM comments r WHERE r.parent_id = c.id) "
+        "WHERE reply_count IS NULL",
+        "CREATE INDEX IF NOT EXISTS ix_comments_thread_new ON comments (room_code, parent_id, id)",
+        "CREATE INDEX IF NOT EXISTS ix_comments_thread_top ON comments (room_code, parent_id, votes, id)",
+        "CREATE INDEX IF NOT EXISTS ix_comments_thread_hot ON comments (room_code, parent_id, hot_score, id)",
+    ]
+
+
+def comment_node(comment):
+    """Shared (viewer independent) part of a comment as sent to the page."""
+    return {
+        "id": comment.id,
+        "parent_id": comment.parent_id,
+        "text": comment.text,
+        "username": comment.username,
+        "timestamp": wire.timestamp(comment.timestamp),
+        "votes": comment.votes or 0,
+        "reply_count": comment.reply_count or 0,
+        "user_type": wire.user_type_code(comment.user_type),
+    }
+
+
+def sort_key(sort):
+    return {"top": Comments.votes, "hot": Comments.hot_score}.get(sort)
+
+
+def encode_cursor(comment, sort):
+    if sort == "new":
+        return str(comment.id)
+    return f"{getattr(comment, sort_key(sort).key)!r}:{comment.id}"
+
+
+def comment_page(room_code, parent_id=None, sort="new", cursor=None, limit=COMMENT_PAGE_SIZE):
+    """One page of a room's top-level comments (parent_id None) or of the
+    replies to parent_id, and the cursor of the next page (None if last)."""
+    if sort not in SORTS:
+        raise CommentPageError(f"Unknown sort: {sort}")
+    key = sort_key(sort)
+    query = Comments.query.filter_by(room_code=room_code, parent_id=parent_id)
+    if cursor:
+        try:
+            if key is None:
+                query = query.filter(Comments.id < int(cursor))
+            else:
+                value, comment_id = cursor.split(":")
+                value = int(value) if sort == "top" else float(value)
+                query = query.filter(tuple_(key, Comments.id) < (value, int(comment_id)))
+        except ValueError:
+            raise CommentPageError(f"Invalid cursor: {cursor}")
+    order = [Comments.id.desc()] if key is None else [key.desc(), Comments.id.desc()]
+    comments = query.order_by(*order).limit(limit + 1).all()
+    next_cursor = encode_cursor(comments[limit - 1], sort) if len(comments) > limit else None
+    return [comment_node(comment) for comment in comments[:limit]], next_cursor
+
+
+def load_overlay(room_code, username):
+    """A user's votes ({comment id: vote}) and reported comment ids in a room."""
+    votes = dict(
+        db.session.query(CommentVotes.comment_id, CommentVotes.vote).filter_by(room_code=room_code, username=username)
+    )
+    reported = {
+        row.comment_id
+        for row in db.session.query(CommentReports.comment_id).filter_by(room_code=room_code, reporter_username=username)
+    }
+    return votes, reported
+
+
+def render(nodes, votes, reported):
+    return [
+        dict(node, userVote=votes.get(node["id"], 0), reportedByUser=node["id"] in reported, replies=[])
+        for node in nodes
+    ]
+
+
+class RoomComments:
+    def __init__(self):
+        # (parent_id, sort) -> [nodes, next_cursor] of the first page
+        self.pages = {}
+        # username -> (votes, reported), loaded on the user's first render
+        self.overlays = {}
+
+
+class CommentCache:
+    def __init__(self, max_rooms=256, page_size=COMMENT_PAGE_SIZE):
+        self.max_rooms = max_rooms
+        self.page_size = page_size
+        self.rooms = OrderedDict()
+        # Keys being loaded from the database -> whether the room was written
+        # to meanwhile; such a load may have missed the write and is not kept
+        self.loading = {}
+        self.lock = Lock()
+        # Counters for stats()
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.rebuild_time = 0.0
+        self.max_rebuild_time = 0.0
+
+    def page(self, room_code, username, parent_id=None, sort="new", cursor=None):
+        """A page of comments (see comment_page()) as the given user sees it."""
+        if sort not in SORTS:
+            raise CommentPageError(f"Unknown sort: {sort}")
+        entry = self._entry(room_code)
+        if cursor:
+            # Later pages are read straight from the index
+            nodes, next_cursor = comment_page(room_code, parent_id, sort, cursor, self.page_size)
+        else:
+            with self.lock:
+                page = entry.pages.get((parent_id, sort))
+                if page is not None:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            if page is None:
+                page = self._load_page(room_code, entry, parent_id, sort)
+            nodes, next_cursor = page
+        overlay = entry.overlays.get(username)
+        if overlay is None:
+            key = (room_code, OVERLAY, username)
+            self._start_load(key)
+            overlay = load_overlay(room_code, username)
+            if self._finish_load(key):
+                entry.overlays[username] = overlay
+        return render(nodes, *overlay), next_cursor
+
+    def _entry(self, room_code):
+        with self.lock:
+            entry = self.rooms.get(room_code)
+            if entry is not None:
+                self.rooms.move_to_end(room_code)
+                return entry
+            entry = RoomComments()
+            if self.max_rooms > 0:
+                self.rooms[room_code] = entry
+                while len(self.rooms) > self.max_rooms:
+                    self.rooms.popitem(last=False)
+            return entry
+
+    def _load_page(self, room_code, entry, parent_id, sort):
+        key = (room_code, parent_id, sort)
+        self._start_load(key)
+        start = perf_counter()
+        page = list(comment_page(room_code, parent_id, sort, None, self.page_size))
+        elapsed = perf_counter() - start
+        keep = self._finish_load(key)
+        with self.lock:
+            self.rebuilds += 1
+            self.rebuild_time += elapsed
+            self.max_rebuild_time = max(self.max_rebuild_time, elapsed)
+            if keep:
+                entry.pages[(parent_id, sort)] = page
+        return page
+
+    def _start_load(self, key):
+        with self.lock:
+            self.loading[key] = False
+
+    def _finish_load(self, key):
+        with self.lock:
+            return not self.loading.pop(key, True)
+
+    def _written(self, room_code, username=None):
+        for key in self.loading:
+            if key[0] == room_code and (key[1] != OVERLAY or key[2] == username):
+                self.loading[key] = True
+
+    def add_comment(self, comment):
+        """A comment was committed."""
+        with self.lock:
+            self._written(comment.room_code)
+            entry = self.rooms.get(comment.room_code)
+            if entry is None:
+                return
+            for (parent_id, sort), page in list(entry.pages.items()):
+                for node in page[0]:
+                    if node["id"] == comment.parent_id:
+                        node["reply_count"] += 1
+                if parent_id != comment.parent_id:
+                    continue
+                if sort == "new" and not page[0]:
+                    page[0] = [comment_node(comment)]
+                elif sort == "new":
+                    # Newest first, so it goes on top; the page's last comment
+                    # moves to the next page
+                    page[0] = [comment_node(comment)] + page[0]
+                    if len(page[0]) > self.page_size:
+                        page[0].pop()
+                        page[1] = str(page[0][-1]["id"])
+                else:
+                    del entry.pages[(parent_id, sort)]
+
+    def set_vote(self, room_code, comment_id, parent_id, votes, username, user_vote):
+        """A vote was committed: the comment's total and the user's own vote."""
+        with self.lock:
+            self._written(room_code, username)
+            entry = self.rooms.get(room_code)
+            if entry is None:
+                return
+            for (page_parent, sort), page in list(entry.pages.items()):
+                if page_parent != parent_id:
+                    continue
+                if sort == "new":
+                    for node in page[0]:
+                        if node["id"] == comment_id:
+                            node["votes"] = votes
+                else:
+                    # The comment may move within or into the page
+                    del entry.pages[(page_parent, sort)]
+            overlay = entry.overlays.get(username)
+            if overlay is not None:
+                if user_vote:
+                    overlay[0][comment_id] = user_vote
+                else:
+                    overlay[0].pop(comment_id, None)
+
+    def add_report(self, room_code, comment_id, username):
+        with self.lock:
+            self._written(room_code, username)
+            entry = self.rooms.get(room_code)
+            overlay = entry.overlays.get(username) if entry is not None else None
+            if overlay is not None:
+                overlay[1].add(comment_id)
+
+    def invalidate(self, room_code):
+        with self.lock:
+            self._written(room_code)
+            self.rooms.pop(room_code, None)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "rooms": len(self.rooms),
+                "max_rooms": self.max_rooms,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "rebuilds": self.rebuilds,
+                "avg_rebuild_ms": self.rebuild_time * 1000 / self.rebuilds if self.rebuilds else 0.0,
+                "max_rebuild_ms": self.max_rebuild_time * 1000,
+            }
+
+
+def comment_cache_from_env(shared=False):
+    """shared: whether rooms span several servers (a Socket.IO message queue);
+    off then, unless COMMENT_CACHE_ROOMS is set."""
+    rooms = os.getenv("COMMENT_CACHE_ROOMS")
+    return CommentCache(max_rooms=int(rooms) if rooms else 0 if shared else 256)
@@ -0,0 +1,208 @@
+# Response compression for remote participants on slow links.
+#  - HTML and JSON responses (and any other COMPRESS_MIMETYPES) of at least
+#    COMPRESS_MIN_SIZE bytes are brotli or gzip encoded, depending on what the
+#    browser accepts. Brotli needs `pip install brotli`; gzip is always there.
+#  - Static files are served from precompressed .br/.gz siblings when they
+#    exist, so they cost no CPU per request. Create them with:
+#      python compression.py static
+#  - Socket.IO: eventlet negotiates WebSocket permessage-deflate on its own but
+#    compresses every frame. Here frames under WS_COMPRESS_MIN_SIZE bytes are
+#    sent as-is and WS_DEFLATE=0 turns it off. Long-polling responses use
+#    Engine.IO's http_compression / compression_threshold (socketio_options()).
+import gzip
+import mimetypes
+import os
+import sys
+import zlib
+
+from flask import current_app, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # optional; gzip only without it
+    brotli = None
+
+COMPRESS_MIMETYPES = {
+    "text/html",
+    "text/css",
+    "text/plain",
+    "application/json",
+    "application/javascript",
+    "text/javascript",
+    "image/svg+xml",
+}
+
+# Static files worth precompressing
+PRECOMPRESS_EXTENSIONS = (".css", ".js", ".html", ".svg", ".json", ".map")
+
+
+def compression_config():
+    """Compression knobs, read from the environment."""
+    return {
+        "COMPRESS_MIN_SIZE": int(os.getenv("COMPRESS_MIN_SIZE", 1024)),
+        "COMPRESS_GZIP_LEVEL": int(os.getenv("COMPRESS_GZIP_LEVEL", 6)),
+        "COMPRESS_BROTLI_QUALITY": int(os.getenv("COMPRESS_BROTLI_QUALITY", 5)),
+        "WS_DEFLATE": os.getenv("WS_DEFLATE", "1") == "1",
+        # Frames share one deflate context, so even short chat events shrink a
+        # lot; only pings and similar few-byte frames are worth skipping
+        "WS_COMPRESS_MIN_SIZE": int(os.getenv("WS_COMPRESS_MIN_SIZE", 16)),
+        "WS_COMPRESS_LEVEL": int(os.getenv("WS_COMPRESS_LEVEL", zlib.Z_DEFAULT_COMPRESSION)),
+    }
+
+
+def available_encodings():
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def compress(data, encoding, gzip_level=6, brotli_quality=5):
+    if encoding == "br":
+        return brotli.compress(data, quality=brotli_quality)
+    # mtime=0 keeps the output stable for the same input
+    return gzip.compress(data, compresslevel=gzip_level, mtime=0)
+
+
+def init_compression(app):
+    """Compress dynamic responses and serve precompressed static files."""
+    for key, value in compression_config().items():
+        app.config.setdefault(key, value)
+    app.after_request(compress_response)
+    app.view_functions["static"] = precompressed_static
+
+
+def _add_vary(response):
+    vary = {v.strip() for v in response.headers.get("Vary", "").split(",") if v.strip()}
+    if "Accept-Encoding" not in vary:
+        response.headers.add("Vary", "Accept-Encoding")
+
+
+def compress_response(response):
+    config = current_app.config
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code >= 300
+        or response.mimetype not in COMPRESS_MIMETYPES
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+    _add_vary(response)
+    data = response.get_data()
+    if len(data) < config["COMPRESS_MIN_SIZE"]:
+        return response
+    encoding = request.accept_encodings.best_match(available_encodings())
+    if encoding is None:
+        return response
+
+    response.set_data(compress(data, encoding, config["COMPRESS_GZIP_LEVEL"], config["COMPRESS_BROTLI_QUALITY"]))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def precompressed_static(filename):
+    """Replacement for Flask's static view that prefers .br/.gz siblings."""
+    static_folder = current_app.static_folder
+    encoding = request.accept_encodings.best_match(available_encodings())
+    suffix = {"br": ".br", "gzip": ".gz"}.get(encoding)
+    if suffix and os.path.isfile(os.path.join(static_folder, filename + suffix)):
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        response = send_from_directory(static_folder, filename + suffix, mimetype=mimetype)
+        # send_file would otherwise label the .gz as application/gzip
+        response.headers["Content-Encoding"] = encoding
+    else:
+        response = send_from_directory(static_folder, filename)
+    _add_vary(response)
+    return response
+
+
+def precompress(path, gzip_level=9, brotli_quality=11, min_size=256):
+    """Write .gz (and .br) files next to path; returns the files written."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < min_size:
+        return []
+    written = []
+    for encoding in available_encodings():
+        compressed = compress(data, encoding, gzip_level, brotli_quality)
+        if len(compressed) >= len(data):
+            continue
+        target = path + (".br" if encoding == "br" else ".gz")
+        with open(target, "wb") as f:
+            f.write(compressed)
+        written.append(target)
+    return written
+
+
+def precompress_folder(folder):
+    written = []
+    for root, _, files in os.walk(folder):
+        for name in files:
+            if name.endswith(PRECOMPRESS_EXTENSIONS):
+                written.extend(precompress(os.path.join(root, name)))
+    return written
+
+
+def socketio_options():
+    """Engine.IO options for long-polling responses."""
+    return {
+        "http_compression": True,
+        "compression_threshold": compression_config()["COMPRESS_MIN_SIZE"],
+    }
+
+
+def init_websocket_compression(socketio):
+    """Apply the WS_* knobs to permessage-deflate (eventlet async mode only)."""
+    eio = socketio.server.eio
+    if eio.async_mode != "eventlet":
+        return
+    from engineio.async_drivers.eventlet import WebSocketWSGI
+    from eventlet.websocket import RFC6455WebSocket
+
+    config = compression_config()
+
+    class ThresholdDeflateWebSocket(RFC6455WebSocket):
+        _skip_deflate = False
+
+        def _pack_message(self, message, **kw):
+            # Deflating a tiny frame costs CPU and saves nothing; with RFC 7692
+            # every message decides for itself whether it is compressed
+            self._skip_deflate = len(message) < config["WS_COMPRESS_MIN_SIZE"]
+            return super()._pack_message(message, **kw)
+
+        def _get_permessage_deflate_enc(self):
+            options = self.extensions.get("permessage-deflate")
+            if options is None or self._skip_deflate:
+                return None
+
+            def _make():
+                return zlib.compressobj(
+                    config["WS_COMPRESS_LEVEL"],
+                    zlib.DEFLATED,
+                    -options.get("client_max_window_bits" if self.client else "server_max_window_bits", zlib.MAX_WBITS),
+                )
+
+            if options.get("client_no_context_takeover" if self.client else "server_no_context_takeover"):
+                return _make()
+            if self._deflate_enc is None:
+                self._deflate_enc = _make()
+            return self._deflate_enc
+
+    class DeflateWebSocketWSGI(WebSocketWSGI):
+        def _negotiate_permessage_deflate(self, extensions):
+            if not config["WS_DEFLATE"]:
+                return None
+            return super()._negotiate_permessage_deflate(extensions)
+
+        def _handle_hybi_request(self, environ):
+            ws = super()._handle_hybi_request(environ)
+            # eventlet builds the socket object itself; swap in the subclass
+            ws.__class__ = ThresholdDeflateWebSocket
+            return ws
+
+    eio._async = dict(eio._async, websocket=DeflateWebSocketWSGI)
+
+
+if __name__ == "__main__":
+    folder = sys.argv[1] if len(sys.argv) > 1 else "static"
+    for path in precompress_folder(folder):
+        print(f"Wrote {path} ({os.path.getsize(path):,} bytes)")
@@ -0,0 +1,78 @@
+# The concurrency model the Socket.IO server runs on, chosen at startup with
+#   ASYNC_MODE=eventlet   green threads, the default
+#   ASYNC_MODE=gevent     green threads (pip install gevent gevent-websocket,
+#                         and psycogreen so database queries yield too)
+#   ASYNC_MODE=threading  OS threads on Werkzeug's threaded server
+#                         (pip install simple-websocket for WebSocket)
+# patch() monkey patches the standard library for the green modes, so it has
+# to run before anything else imports socket or threading; main.py does so
+# when run as a script, and this module imports nothing at load time for
+# that reason. lock() and the Socket.IO server's start_background_task() and
+# sleep() then match the chosen mode; original() reaches past the patching,
+# for code that must keep running while the green threads are blocked.
+# asgi.py patches nothing; it runs on asyncio. See
+# `python -m benchmarks.bench_servers` to compare them.
+import importlib
+import os
+
+ASYNC_MODES = ("eventlet", "gevent", "threading")
+
+
+def async_mode_from_env():
+    mode = os.getenv("ASYNC_MODE", "eventlet").strip().lower()
+    if mode not in ASYNC_MODES:
+        raise ValueError(f"ASYNC_MODE must be one of {', '.join(ASYNC_MODES)}, not {mode!r}")
+    return mode
+
+
+ASYNC_MODE = async_mode_from_env()
+
+
+def patch(mode=ASYNC_MODE):
+    """Make blocking calls (sockets, sleeps, locks, psycopg2 queries) yield to
+    the other green threads. Nothing to do for threading."""
+    if mode == "eventlet":
+        import eventlet
+
+        # Patches psycopg2 as well when it is installed
+        eventlet.monkey_patch()
+    elif mode == "gevent":
+        from gevent import monkey
+
+        monkey.patch_all()
+        try:
+            from psycogreen.gevent import patch_psycopg
+        except ImportError:
+            print("psycogreen is not installed; database queries will block every other request under gevent")
+        else:
+            patch_psycopg()
+
+
+def lock(mode=ASYNC_MODE):
+    """A lock for state shared between Socket.IO handlers and background tasks
+    (e.g. main.chatbot_lock)."""
+    if mode == "eventlet":
+        from eventlet.semaphore import Semaphore
+
+        return Semaphore()
+    if mode == "gevent":
+        from gevent.lock import Semaphore
+
+        return Semaphore()
+    from threading import Lock
+
+    return Lock()
+
+
+def original(module, name, mode=ASYNC_MODE):
+    """The standard library's module.name as it was before patch(), e.g. a
+    real OS thread's start_new_thread and sleep for loop_watch.py."""
+    if mode == "eventlet":
+        from eventlet.patcher import original
+
+        return getattr(original(module), name)
+    if mode == "gevent":
+        from gevent import monkey
+
+        return monkey.get_original(module, name)
+    return getattr(importlib.import_module(module), name)
@@ -1,49 +1,151 @@
+import base64
 import smtplib
 import sys
 import os
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
+import uuid
+from email.utils import formatdate, make_msgid
 from dotenv import load_dotenv
 
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
 load_dotenv()
 
 EMAIL_ADDRESS = os.getenv("SENDER_EMAIL_ADDRESS")
 EMAIL_PASSWORD = os.getenv("SENDER_EMAIL_PASSWORD")
 
-def send_email(recipient_email, subject, body, attachment_path):
-    print(f"Preparing to send email to {recipient_email}...")
+# Defaults to Gmail; point these at a local stand-in for testing, e.g.
+#   python -m aiosmtpd -n -l localhost:8025
+#   SMTP_HOST=localhost SMTP_PORT=8025 SMTP_SSL=0 python email_zip_to.py someone@example.com
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", 465))
+SMTP_SSL = os.getenv("SMTP_SSL", "1") not in ("0", "false", "False")
+
+# Gmail rejects messages over 25MB *after* base64 encoding (+33%), so archives
+# bigger than this are split into numbered parts, one email each
+MAX_PART_SIZE = int(os.getenv("EMAIL_MAX_PART_SIZE", 18 * 1024 * 1024))
+
+# 57 raw bytes encode to one 76 character base64 line; read 1024 lines at a time
+CHUNK_SIZE = 57 * 1024
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _stuff(text):
+    # SMTP dot-stuffing and CRLF line endings for the text parts we write ourselves
+    lines = text.replace("\r\n", "\n").split("\n")
+    return "\r\n".join("." + line if line.startswith(".") else line for line in lines)
+
+
+def _send_attachment(server, file, length):
+    # Base64 lines never start with ".", so no dot-stuffing is needed here
+    remaining = length
+    while remaining > 0:
+        chunk = file.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        encoded = base64.b64encode(chunk)
+        lines = [encoded[i : i + 76] for i in range(0, len(encoded), 76)]
+        server.send(b"\r\n".join(lines) + b"\r\n")
+
 
-    # Create a multipart email
-    msg = MIMEMultipart()
-    msg['From'] = EMAIL_ADDRESS
-    msg['To'] = recipient_email
-    msg['Subject'] = subject
-    msg.attach(MIMEText(body, 'plain'))
-
-    # Attach the file
-    with open(attachment_path, 'rb') as file:
-        print(f"Attaching {attachment_path} to the email...")
-        part = MIMEBase('application', 'octet-stream')
-        part.set_payload(file.read())
-        encoders.encode_base64(part)
-        part.add_header('Content-Disposition', f"attachment; filename= {os.path.basename(attachment_path)}")
-        msg.attach(part)
-
-    # Send the email
-    with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
+def _send_streamed(server, recipient_email, subject, body, file, length, filename):
+    boundary = f"=============={uuid.uuid4().hex}=="
+    head = (
+        f"From: {EMAIL_ADDRESS}\n"
+        f"To: {recipient_email}\n"
+        f"Subject: {subject}\n"
+        f"Date: {formatdate(localtime=True)}\n"
+        f"Message-ID: {make_msgid()}\n"
+        "MIME-Version: 1.0\n"
+        f'Content-Type: multipart/mixed; boundary="{boundary}"\n'
+        "\n"
+        f"--{boundary}\n"
+        'Content-Type: text/plain; charset="utf-8"\n'
+        "Content-Transfer-Encoding: 8bit\n"
+        "\n"
+        f"{body}\n"
+        f"--{boundary}\n"
+        "Content-Type: application/octet-stream\n"
+        "Content-Transfer-Encoding: base64\n"
+        f'Content-Disposition: attachment; filename="{filename}"\n'
+        "\n"
+    )
+    tail = f"--{boundary}--\n"
+
+    server.ehlo_or_helo_if_needed()
+    code, response = server.mail(EMAIL_ADDRESS or "")
+    if code != 250:
+        raise smtplib.SMTPSenderRefused(code, response, EMAIL_ADDRESS)
+    code, response = server.rcpt(recipient_email)
+    if code not in (250, 251):
+        raise smtplib.SMTPRecipientsRefused({recipient_email: (code, response)})
+    code, response = server.docmd("data")
+    if code != 354:
+        raise smtplib.SMTPDataError(code, response)
+
+    # The message is written to the socket piece by piece instead of being
+    # built in memory, so memory use does not depend on the archive size
+    server.send(_stuff(head).encode("utf-8"))
+    _send_attachment(server, file, length)
+    server.send(_stuff(tail).encode("utf-8") + b".\r\n")
+    code, response = server.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, response)
+
+
+def _connect():
+    if SMTP_SSL:
+        server = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT)
+    else:
+        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT)
+    if EMAIL_ADDRESS and EMAIL_PASSWORD:
         print("Logging into the SMTP server...")
         server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-        print("Sending the email...")
-        server.sendmail(EMAIL_ADDRESS, recipient_email, msg.as_string())
+    return server
+
+
+def send_email(recipient_email, subject, body, attachment_path, max_part_size=MAX_PART_SIZE):
+    print(f"Preparing to send email to {recipient_email}...")
+
+    size = os.path.getsize(attachment_path)
+    parts = max(1, -(-size // max_part_size))  # ceiling division
+    basename = os.path.basename(attachment_path)
+
+    with open(attachment_path, "rb") as file, _connect() as server:
+        for part in range(1, parts + 1):
+            length = min(max_part_size, size - (part - 1) * max_part_size)
+            if parts == 1:
+                part_subject, part_body, filename = subject, body, basename
+            else:
+                # Numbered parts; rejoin with e.g. `cat data.zip.0* > data.zip`
+                part_subject = f"{subject} (part {part} of {parts})"
+                part_body = (
+                    f"{body}\n\nThis is part {part} of {parts} of {basename}. "
+                    f"Save all parts and join them in order to restore {basename}."
+                )
+                filename = f"{basename}.{part:03d}"
+            print(f"Sending {filename} ({length / (1024 * 1024):.1f} MB)...")
+            _send_streamed(server, recipient_email, part_subject, part_body, file, length, filename)
 
     print(f"Email sent successfully to {recipient_email}!")
+    peak = peak_rss_mb()
+    if peak is not None:
+        print(f"Peak RSS: {peak:.1f} MB for a {size / (1024 * 1024):.1f} MB attachment")
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("Usage: python script_name.py recipient_email_address")
         sys.exit(1)
-        
+
     recipient = sys.argv[1]
-    send_email(recipient, "Data Zip File", "Here's the data zip file you requested.", "data.zip")
\ No newline at end of file
+    send_email(recipient, "Data Zip File", "Here's the data zip file you requested.", "data.zip")
@@ -0,0 +1,381 @@
+# Streams tables out of the database into gzip-compressed CSV files without
+# materialising ORM objects. Each table is exported on its own connection
+# (in parallel), using COPY TO STDOUT on PostgreSQL and a server-side cursor
+# (yield_per) elsewhere. A progress line with rows/sec is printed per table.
+#
+# In incremental mode only rows above each table's high-watermark (max id) are
+# exported, into dated partition files under output_dir/<table>/. Ids below
+# the watermark that were missing when it was taken (rows of transactions
+# still open then, or rolled back) are looked for again on later runs, as
+# long as they are within GAP_WINDOW ids of the newest watermark.
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from time import time
+
+from sqlalchemy import func, select
+
+WATERMARK_FILE = "export_watermarks.json"
+# How far below the watermark missing ids are looked for again
+GAP_WINDOW = 1000
+
+
+class TableProgress:
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0
+        self.start_time = None
+        self.end_time = None
+        self.error = None
+
+    def rate(self):
+        if self.start_time is None:
+            return 0.0
+        elapsed = (self.end_time or time()) - self.start_time
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self):
+        if self.error is not None:
+            state = f"failed: {self.error}"
+        elif self.end_time is not None:
+            state = f"done in {self.end_time - self.start_time:.1f}s"
+        elif self.start_time is not None:
+            state = "running"
+        else:
+            state = "waiting"
+        return f"{self.name}: {self.rows:,} rows ({self.rate():,.0f} rows/s) {state}"
+
+
+class _LineCounter:
+    # File wrapper that counts newlines written by COPY (one per row, unless
+    # a quoted field itself contains a newline, so the count is approximate)
+    def __init__(self, fileobj, progress):
+        self.fileobj = fileobj
+        self.progress = progress
+
+    def write(self, data):
+        self.progress.rows += data.count(b"\n")
+        return self.fileobj.write(data)
+
+
+def _copy_table(engine, table, fileobj, progress, where=None):
+    query = select(table).order_by(*table.primary_key.columns)
+    if where is not None:
+        query = query.where(where)
+    query = query.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True})
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.copy_expert(
+            f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)",
+            _LineCounter(fileobj, progress),
+        )
+        # The header line is counted too
+        progress.rows = max(progress.rows - 1, 0)
+        raw.commit()
+    finally:
+        raw.close()
+
+
+def _stream_table(engine, table, fileobj, progress, batch_size, where=None):
+    text = io.TextIOWrapper(fileobj, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+    writer.writerow(table.columns.keys())
+    query = select(table).order_by(*table.primary_key.columns)
+    if where is not None:
+        query = query.where(where)
+    with engine.connect() as connection:
+        result = connection.execution_options(
+            stream_results=True, yield_per=batch_size
+        ).execute(query)
+        for rows in result.partitions():
+            writer.writerows(rows)
+            progress.rows += len(rows)
+    text.flush()
+    text.detach()
+
+
+def export_table(engine, table, path, progress, batch_size=10000, use_copy=None, where=None):
+    """Writes one table to a gzip-compressed CSV file at path.
+
+    where is an optional SQLAlchemy filter expression on the table.
+    """
+    if use_copy is None:
+        use_copy = engine.dialect.name == "postgresql"
+    progress.start_time = time()
+    tmp_path = path + ".part"
+    try:
+        with gzip.open(tmp_path, "wb", compresslevel=6) as fileobj:
+            if use_copy:
+                _copy_table(engine, table, fileobj, progress, where)
+            else:
+                _stream_table(engine, table, fileobj, progress, batch_size, where)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        progress.error = e
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        progress.end_time = time()
+    return path
+
+
+def _report_progress(progresses, stop_event, interval):
+    while not stop_event.wait(interval):
+        print(" | ".join(str(p) for p in progresses))
+
+
+def export_tables(
+    engine,
+    tables,
+    output_dir="data",
+    workers=4,
+    batch_size=10000,
+    use_copy=None,
+    progress_interval=2.0,
+):
+    """Exports tables (SQLAlchemy Table objects) in parallel to output_dir/<table>.csv.gz."""
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = [(table, os.path.join(output_dir, f"{table.name}.csv.gz"), None) for table in tables]
+    return _run_exports(engine, jobs, workers, batch_size, use_copy, progress_interval)
+
+
+def _run_exports(engine, jobs, workers, batch_size, use_copy, progress_interval):
+    # jobs is a list of (table, path, where) tuples
+    progresses = [TableProgress(table.name) for table, _, _ in jobs]
+    stop_event = threading.Event()
+    reporter = threading.Thread(
+        target=_report_progress, args=(progresses, stop_event, progress_interval), daemon=True
+    )
+    reporter.start()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [
+                executor.submit(
+                    export_table, engine, table, path, progress, batch_size, use_copy, where
+                )
+                for (table, path, where), progress in zip(jobs, progresses)
+            ]
+            paths = [future.result() for future in futures]
+    finally:
+        stop_event.set()
+        reporter.join()
+        for progress in progresses:
+            print(progress)
+    return paths
+
+
+###### Incremental export ########
+def watermark_column(table):
+    # Tables with an integer "id" primary key only ever grow upwards; anything
+    # else (e.g. rooms, keyed by code) is exported as a full snapshot each run
+    column = table.columns.get("id")
+    if column is not None and column.primary_key:
+        return column
+    return None
+
+
+def load_watermarks(output_dir="data"):
+    """Table name -> {"id": highest id exported, "gaps": missing ids below it}."""
+    path = os.path.join(output_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        watermarks = json.load(f)
+    # Files written before gaps were tracked hold just the id
+    return {
+        name: mark if isinstance(mark, dict) else {"id": mark, "gaps": []}
+        for name, mark in watermarks.items()
+    }
+
+
+def save_watermarks(watermarks, output_dir="data"):
+    path = os.path.join(output_dir, WATERMARK_FILE)
+    with open(path + ".part", "w", encoding="utf-8") as f:
+        json.dump(watermarks, f, indent=2, sort_keys=True)
+    os.replace(path + ".part", path)
+
+
+def reset_watermarks(tables, output_dir="data"):
+    """Starts incremental exports over, for a database whose tables were
+    recreated (ids start again at 1). The watermarks and partitions of the old
+    tables are moved to output_dir/before-reset-<timestamp>/."""
+    moved_dir = os.path.join(output_dir, "before-reset-" + datetime.now().strftime("%Y%m%d-%H%M%S-%f"))
+    paths = [os.path.join(output_dir, WATERMARK_FILE)]
+    paths += [os.path.join(output_dir, table.name) for table in tables]
+    for path in paths:
+        if os.path.exists(path):
+            os.makedirs(moved_dir, exist_ok=True)
+            shutil.move(path, moved_dir)
+    if os.path.isdir(moved_dir):
+        print(f"Moved the previous incremental exports to {moved_dir}")
+
+
+def _missing_ids(connection, column, low, high):
+    """The ids in (low, high] that no row has (yet)."""
+    present = connection.execute(select(column).where((column > low) & (column <= high))).scalars()
+    return sorted(set(range(low + 1, high + 1)) - set(present))
+
+
+def export_incremental(
+    engine,
+    tables,
+    output_dir="data",
+    workers=4,
+    batch_size=10000,
+    use_copy=None,
+    progress_interval=2.0,
+):
+    """Exports rows added since the last run into output_dir/<table>/<table>-<timestamp>.csv.gz.
+
+    The watermarks are only advanced once every table has been written, so a
+    failed run is simply repeated in full next time. Raises ValueError if a
+    table's ids are below its watermark (the table was recreated; see
+    reset_watermarks()).
+    """
+    watermarks = load_watermarks(output_dir)
+    new_watermarks = dict(watermarks)
+    # Microseconds, so that two runs within a second get partitions of their own
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    jobs = []
+    with engine.connect() as connection:
+        for table in tables:
+            column = watermark_column(table)
+            where = None
+            if column is not None:
+                mark = watermarks.get(table.name, {"id": 0, "gaps": []})
+                low, gaps = mark["id"], mark["gaps"]
+                # Pin the upper bound first so rows inserted mid-export land in the next run
+                high = connection.execute(select(func.max(column))).scalar() or 0
+                if 0 < high < low:
+                    raise ValueError(
+                        f"{table.name}: the highest id is {high} but rows up to id {low} were already "
+                        "exported; if the table was recreated, run `python export_to_csv.py "
+                        "reset-watermarks` to start the incremental exports over"
+                    )
+                # Rows that took an id below the watermark but committed after it was taken
+                filled = []
+                if gaps:
+                    filled = connection.execute(select(column).where(column.in_(gaps))).scalars().all()
+                if high <= low and not filled:
+                    print(f"{table.name}: no new rows since id {low}")
+                    continue
+                where = (column > low) & (column <= high)
+                if filled:
+                    where = where | column.in_(filled)
+                high = max(high, low)
+                # Ids missing now may be rows of transactions still open. Taken
+                # before the export, so a row committing in between is exported
+                # twice rather than never
+                missing = _missing_ids(connection, column, max(low, high - GAP_WINDOW), high)
+                gaps = [i for i in gaps if i > high - GAP_WINDOW and i not in filled]
+                new_watermarks[table.name] = {"id": high, "gaps": sorted(set(gaps + missing))}
+            partition_dir = os.path.join(output_dir, table.name)
+            os.makedirs(partition_dir, exist_ok=True)
+            path = os.path.join(partition_dir, f"{table.name}-{stamp}.csv.gz")
+            if os.path.exists(path):
+                raise FileExistsError(f"{path} already exists")
+            jobs.append((table, path, where))
+
+    paths = _run_exports(engine, jobs, workers, batch_size, use_copy, progress_interval)
+    save_watermarks(new_watermarks, output_dir)
+    return paths
+
+
+def compact_partitions(tables, output_dir="data"):
+    """Merges each table's partition files into one, keeping a single header.
+
+    Snapshot tables (no watermark) only keep their newest partition.
+    """
+    merged = []
+    for table in tables:
+        partition_dir = os.path.join(output_dir, table.name)
+        if not os.path.isdir(partition_dir):
+            continue
+        partitions = sorted(
+            os.path.join(partition_dir, name)
+            for name in os.listdir(partition_dir)
+            if name.endswith(".csv.gz")
+        )
+        if len(partitions) <= 1:
+            continue
+        if watermark_column(table) is None:
+            for path in partitions[:-1]:
+                os.remove(path)
+            print(f"{table.name}: kept latest snapshot, removed {len(partitions) - 1} old ones")
+            continue
+
+        # Name the result after the newest partition so ordering by name still holds
+        target = partitions[-1][: -len(".csv.gz")] + "-compacted.csv.gz"
+        with gzip.open(target + ".part", "wb") as out:
+            for i, path in enumerate(partitions):
+                with gzip.open(path, "rb") as part:
+                    header = part.readline()
+                    if i == 0:
+                        out.write(header)
+                    shutil.copyfileobj(part, out)
+        os.replace(target + ".part", target)
+        for path in partitions:
+            os.remove(path)
+        print(f"{table.name}: compacted {len(partitions)} partitions into {target}")
+        merged.append(target)
+    return merged
+
+
+def _add_to_archive(archive, path, base_dir):
+    # Already-compressed exports are stored as-is rather than deflated again
+    compression = zipfile.ZIP_STORED if path.endswith((".gz", ".parquet")) else zipfile.ZIP_DEFLATED
+    archive.write(path, arcname=os.path.relpath(path, base_dir), compress_type=compression)
+
+
+def bundle_archive(paths, archive_path="data.zip", base_dir="data"):
+    """Puts already-compressed exports into a zip without compressing them again."""
+    tmp_path = archive_path + ".part"
+    with zipfile.ZipFile(tmp_path, "w", allowZip64=True) as archive:
+        for path in paths:
+            _add_to_archive(archive, path, base_dir)
+    os.replace(tmp_path, archive_path)
+    return archive_path
+
+
+def sync_archive(base_dir="data", archive_path="data.zip"):
+    """Brings archive_path up to date with base_dir, appending only new files.
+
+    Export partitions are never modified once written, so an existing archive
+    is only rebuilt when one of its files changed or disappeared (e.g. after
+    compaction). The watermark file is bookkeeping and is left out.
+    """
+    on_disk = {}
+    for root, _, names in os.walk(base_dir):
+        for name in names:
+            if name == WATERMARK_FILE or name.endswith(".part"):
+                continue
+            path = os.path.join(root, name)
+            on_disk[os.path.relpath(path, base_dir).replace(os.sep, "/")] = path
+
+    if os.path.exists(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            archived = {info.filename: info.file_size for info in archive.infolist()}
+        stale = any(
+            name not in on_disk or os.path.getsize(on_disk[name]) != size
+            for name, size in archived.items()
+        )
+        if not stale:
+            new_paths = [path for name, path in sorted(on_disk.items()) if name not in archived]
+            with zipfile.ZipFile(archive_path, "a", allowZip64=True) as archive:
+                for path in new_paths:
+                    _add_to_archive(archive, path, base_dir)
+            print(f"Appended {len(new_paths)} new files to {archive_path}")
+            return archive_path
+
+    bundle_archive([path for _, path in sorted(on_disk.items())], archive_path, base_dir)
+    print(f"Rebuilt {archive_path} with {len(on_disk)} files")
+    return archive_path
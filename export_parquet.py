@@ -0,0 +1,159 @@
+# Columnar export for research analysis. Tables are streamed from the database
+# in batches into typed, zstd-compressed Parquet files (data/<table>.parquet).
+# Rows are ordered by room and every row group holds a single room, so readers
+# can memory-map a file and let the row-group statistics skip every other room:
+#
+#   from export_parquet import load_parquet
+#   df = load_parquet("messages", room_code="ABC123")
+#
+# Requires pyarrow (pip install pyarrow); the CSV exports work without it.
+import json
+import os
+from time import time
+
+from sqlalchemy import JSON, Boolean, DateTime, Float, Integer, select
+
+# Imported on first use: pyarrow is optional and slow to import
+pa = None
+pq = None
+
+# Column used to group rows into row groups, per table; tables that are not
+# listed are only split by size
+PARTITION_COLUMNS = {
+    "rooms": "code",
+    "messages": "room_code",
+    "comments": "room_code",
+    "comment_votes": "room_code",
+    "comment_reports": "room_code",
+    "annoucements": "room_code",
+    "chatbot_messages": "owner",
+    "chatbot_sessions": "owner",
+}
+
+
+def _require_pyarrow():
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow")
+        pa, pq = pyarrow, pyarrow.parquet
+
+
+def _members_type():
+    return pa.list_(pa.struct([("name", pa.string()), ("user_type", pa.string())]))
+
+
+def arrow_type(column):
+    if isinstance(column.type, JSON):
+        # Rooms.members is the only JSON column: a list of {"name", "user_type"}
+        return _members_type()
+    if isinstance(column.type, Boolean):
+        return pa.bool_()
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    if isinstance(column.type, Float):
+        return pa.float64()
+    if isinstance(column.type, DateTime):
+        return pa.timestamp("us")
+    return pa.string()
+
+
+def arrow_schema(table):
+    _require_pyarrow()
+    return pa.schema(
+        [pa.field(c.name, arrow_type(c), nullable=c.nullable) for c in table.columns]
+    )
+
+
+def _convert(column, value):
+    if isinstance(column.type, JSON):
+        # members is written with json.dumps, so it comes back as a string
+        if isinstance(value, str):
+            value = json.loads(value) if value else []
+        return value or []
+    return value
+
+
+def _row_group(schema, table, rows):
+    columns = list(table.columns)
+    arrays = [
+        pa.array([_convert(column, row[i]) for row in rows], type=schema.field(i).type)
+        for i, column in enumerate(columns)
+    ]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def export_table_parquet(engine, table, path, batch_size=50000, compression="zstd"):
+    """Streams one table into a Parquet file with one partition value per row group."""
+    _require_pyarrow()
+    schema = arrow_schema(table)
+    partition_name = PARTITION_COLUMNS.get(table.name)
+    partition = table.columns.get(partition_name) if partition_name else None
+    order_by = ([partition] if partition is not None else []) + list(table.primary_key.columns)
+    key_index = list(table.columns).index(partition) if partition is not None else None
+
+    start_time = time()
+    total = 0
+    tmp_path = path + ".part"
+    writer = pq.ParquetWriter(tmp_path, schema, compression=compression, write_statistics=True)
+    try:
+        with engine.connect() as connection:
+            result = connection.execution_options(
+                stream_results=True, yield_per=batch_size
+            ).execute(select(table).order_by(*order_by))
+            pending = []
+            for rows in result.partitions():
+                for row in rows:
+                    # Start a new row group whenever the room changes (or it gets too big)
+                    if pending and (
+                        len(pending) >= batch_size
+                        or (key_index is not None and row[key_index] != pending[-1][key_index])
+                    ):
+                        writer.write_table(_row_group(schema, table, pending))
+                        total += len(pending)
+                        pending = []
+                    pending.append(row)
+            if pending:
+                writer.write_table(_row_group(schema, table, pending))
+                total += len(pending)
+        writer.close()
+        os.replace(tmp_path, path)
+    except Exception:
+        writer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    elapsed = time() - start_time
+    print(f"{table.name}: {total:,} rows to {path} in {elapsed:.1f}s")
+    return path
+
+
+def export_parquet(engine, tables, output_dir="data", batch_size=50000):
+    os.makedirs(output_dir, exist_ok=True)
+    return [
+        export_table_parquet(engine, table, os.path.join(output_dir, f"{table.name}.parquet"), batch_size)
+        for table in tables
+    ]
+
+
+def load_parquet(table_name, room_code=None, columns=None, data_dir="data"):
+    """Loads an exported table into pandas, optionally only one room's rows
+    (for chatbot_messages, room_code is matched against the owner instead).
+
+    The file is memory-mapped and the room filter is pushed down to the row
+    groups, so other rooms are never read or decoded.
+    """
+    _require_pyarrow()
+    filters = None
+    if room_code is not None:
+        filters = [(PARTITION_COLUMNS.get(table_name, "room_code"), "=", room_code)]
+    table = pq.read_table(
+        os.path.join(data_dir, f"{table_name}.parquet"),
+        columns=columns,
+        filters=filters,
+        memory_map=True,
+    )
+    return table.to_pandas()
@@ -0,0 +1,91 @@
+# A tiny OpenAI-compatible chat completions server for trying out the LLM
+# router without a GPU or an API key. Latency and error rate are configurable
+# so failover and hedging can be exercised locally, e.g.:
+#   python fake_llm_backend.py --port 6001 --latency 0.2
+#   python fake_llm_backend.py --port 6002 --latency 3 --error-rate 0.5
+#   LLM_BACKENDS='[{"name": "fast", "url": "http://127.0.0.1:6001/v1/chat/completions"},
+#                  {"name": "slow", "url": "http://127.0.0.1:6002/v1/chat/completions"}]' python main.py
+import argparse
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep, time
+
+
+def make_handler(latency=0.0, jitter=0.0, error_rate=0.0, reply=None):
+    class FakeLLMHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            sleep(max(0.0, latency + random.uniform(-jitter, jitter)))
+
+            if random.random() < error_rate:
+                self.send_response(503)
+                self.end_headers()
+                return
+
+            messages = body.get("messages", [])
+            prompt = messages[-1]["content"] if messages else ""
+            content = reply if reply is not None else f"Echo: {prompt}"
+            payload = json.dumps(
+                {
+                    "id": f"fake-{int(time() * 1000)}",
+                    "object": "chat.completion",
+                    "model": body.get("model", "fake"),
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": {
+                        "prompt_tokens": len(prompt.split()),
+                        "completion_tokens": len(content.split()),
+                        "total_tokens": len(prompt.split()) + len(content.split()),
+                    },
+                }
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakeLLMHandler
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    # socketserver's default listen backlog of 5 drops connections when many
+    # chatbot requests arrive at once, and the retries add a second to each
+    request_queue_size = 128
+
+
+def start_fake_backend(host="127.0.0.1", port=0, **options):
+    """Starts a fake backend in a daemon thread; returns (server, chat completions url)."""
+    server = FakeLLMServer((host, port), make_handler(**options))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://{host}:{server.server_address[1]}/v1/chat/completions"
+    return server, url
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake OpenAI-compatible LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6001)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds per reply")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of 503 replies")
+    parser.add_argument("--reply", default=None, help="Fixed reply instead of echoing the prompt")
+    args = parser.parse_args()
+
+    server = FakeLLMServer(
+        (args.host, args.port),
+        make_handler(args.latency, args.jitter, args.error_rate, args.reply),
+    )
+    print(f"Fake LLM backend listening on http://{args.host}:{args.port}/v1/chat/completions")
+    server.serve_forever()
@@ -0,0 +1,152 @@
+# Optional per-room micro-batching of outbound events. Instead of one
+# serialize-and-write per event per client, events for a room are buffered for
+# a few milliseconds and sent as a single "batch" frame:
+#   ["batch", [[event, payload], [event, payload], ...]]
+# which room.html unpacks and dispatches to the normal handlers. Latency
+# sensitive events bypass the buffer (after flushing it, to keep ordering).
+# Every frame is also encoded once for each binary wire format that has
+# members in the room (see wire.py). AsyncRoomFanout does the same on
+# python-socketio's AsyncServer (asgi.py).
+import asyncio
+import os
+from collections import Counter, defaultdict
+from threading import Lock
+
+import wire
+
+
+class RoomFanout:
+    def __init__(self, socketio, window_ms=0, batched_events=(), max_batch=100):
+        self.socketio = socketio
+        self.window = window_ms / 1000.0
+        self.batched_events = set(batched_events)
+        self.max_batch = max_batch
+        self.buffers = {}
+        self.lock = Lock()
+        # room -> {wire format: number of connected clients using it}
+        self.format_members = defaultdict(Counter)
+        # Counters for the benchmark / debugging
+        self.events = 0
+        self.frames = 0
+
+    def join(self, room, wire_format):
+        if wire_format != wire.JSON:
+            with self.lock:
+                self.format_members[room][wire_format] += 1
+
+    def leave(self, room, wire_format):
+        if wire_format != wire.JSON:
+            with self.lock:
+                counts = self.format_members[room]
+                counts[wire_format] -= 1
+                if counts[wire_format] <= 0:
+                    del counts[wire_format]
+                if not counts:
+                    del self.format_members[room]
+
+    def enabled_for(self, event):
+        return self.window > 0 and event in self.batched_events
+
+    def emit(self, event, payload, room):
+        self.events += 1
+        if not self.enabled_for(event):
+            # Anything already buffered for the room has to go out first
+            self.flush(room)
+            self._emit(event, payload, room)
+            return
+
+        with self.lock:
+            buffer = self.buffers.setdefault(room, [])
+            buffer.append([event, payload])
+            size = len(buffer)
+        if size == 1:
+            self.socketio.start_background_task(self._flush_later, room)
+        elif size >= self.max_batch:
+            self.flush(room)
+
+    def _flush_later(self, room):
+        self.socketio.sleep(self.window)
+        self.flush(room)
+
+    def flush(self, room):
+        with self.lock:
+            buffer = self.buffers.pop(room, None)
+        if not buffer:
+            return
+        if len(buffer) == 1:
+            # No point wrapping a single event
+            self._emit(buffer[0][0], buffer[0][1], room)
+        else:
+            self._emit("batch", buffer, room)
+
+    def _emit(self, event, payload, room):
+        self.frames += 1
+        self.socketio.emit(event, payload, to=room)
+        with self.lock:
+            formats = list(self.format_members.get(room, ()))
+        for wire_format in formats:
+            self.socketio.emit(event, wire.encode(payload, wire_format), to=wire.format_room(room, wire_format))
+
+
+class AsyncRoomFanout(RoomFanout):
+    """RoomFanout for an AsyncServer: emit(), flush() and _emit() are
+    coroutines. emit_threadsafe() is for code running outside the event loop,
+    such as Flask views served from the WSGI thread pool."""
+
+    def __init__(self, socketio, *args, **kwargs):
+        super().__init__(socketio, *args, **kwargs)
+        self.loop = None
+
+    async def emit(self, event, payload, room):
+        self.loop = asyncio.get_running_loop()
+        self.events += 1
+        if not self.enabled_for(event):
+            await self.flush(room)
+            await self._emit(event, payload, room)
+            return
+
+        with self.lock:
+            buffer = self.buffers.setdefault(room, [])
+            buffer.append([event, payload])
+            size = len(buffer)
+        if size == 1:
+            self.socketio.start_background_task(self._flush_later, room)
+        elif size >= self.max_batch:
+            await self.flush(room)
+
+    def emit_threadsafe(self, event, payload, room):
+        asyncio.run_coroutine_threadsafe(self.emit(event, payload, room), self.loop).result()
+
+    async def _flush_later(self, room):
+        await self.socketio.sleep(self.window)
+        await self.flush(room)
+
+    async def flush(self, room):
+        with self.lock:
+            buffer = self.buffers.pop(room, None)
+        if not buffer:
+            return
+        if len(buffer) == 1:
+            await self._emit(buffer[0][0], buffer[0][1], room)
+        else:
+            await self._emit("batch", buffer, room)
+
+    async def _emit(self, event, payload, room):
+        self.frames += 1
+        await self.socketio.emit(event, payload, to=room)
+        with self.lock:
+            formats = list(self.format_members.get(room, ()))
+        for wire_format in formats:
+            await self.socketio.emit(event, wire.encode(payload, wire_format), to=wire.format_room(room, wire_format))
+
+
+def fanout_from_env(socketio, cls=RoomFanout):
+    # FANOUT_WINDOW_MS=0 (the default) disables batching entirely
+    window_ms = float(os.getenv("FANOUT_WINDOW_MS", 0))
+    events = os.getenv("FANOUT_EVENTS", "message,new_comment,update_vote")
+    return cls(
+        socketio,
+        window_ms=window_ms,
+        batched_events=[e.strip() for e in events.split(",") if e.strip()],
+        max_batch=int(os.getenv("FANOUT_MAX_BATCH", 100)),
+    )
@@ -0,0 +1,512 @@
+# Routes chat completion requests across several OpenAI-compatible backends
+# (Together, the local text-generation server, ...). Each backend keeps an
+# EWMA of its latency and error rate; requests go to the fastest healthy
+# backend and are hedged onto the next one if the first is slow to answer.
+# chat() blocks the calling (green) thread; achat() is the same for asyncio
+# servers (asgi.py), over an httpx.AsyncClient. Either takes a CancelToken, so
+# a request nobody waits for any more (the user left, or cancelled it) is
+# aborted upstream instead of using up paid LLM capacity.
+import asyncio
+import json
+import os
+import queue
+import socket
+import threading
+from time import time
+
+
+class LLMUnavailableError(Exception):
+    """Raised when no backend managed to answer a request."""
+
+
+class LLMCancelledError(Exception):
+    """Raised when a request is cancelled before any backend answered.
+    tokens_saved estimates the completion tokens the aborted attempts would
+    still have generated."""
+
+    def __init__(self, reason=None, tokens_saved=0):
+        super().__init__(f"Chat request cancelled ({reason})" if reason else "Chat request cancelled")
+        self.reason = reason
+        self.tokens_saved = tokens_saved
+
+
+class CancelToken:
+    """Cancels a chat request from another (green) thread or coroutine:
+    cancel() marks it cancelled and runs the callbacks registered with
+    on_cancel(), which abort the upstream HTTP requests."""
+
+    def __init__(self):
+        self.cancelled = False
+        self.reason = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def on_cancel(self, callback):
+        """Run callback on cancel(), or right away if already cancelled."""
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self, reason=None):
+        """Returns False if it was cancelled already."""
+        with self._lock:
+            if self.cancelled:
+                return False
+            self.cancelled = True
+            self.reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Cancelling a chat request failed: {e}")
+        return True
+
+
+def _shutdown(connection):
+    sock = getattr(connection, "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except (OSError, ValueError):
+            pass
+
+
+def cancellable_session(cancel):
+    """A requests session whose connections cancel.cancel() shuts down, so a
+    request blocked waiting for the reply fails at once and the backend sees
+    the client go away (servers that check stop generating)."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+
+    def watched(pool_class):
+        class WatchedPool(pool_class):
+            def _new_conn(self):
+                connection = super()._new_conn()
+                cancel.on_cancel(lambda: _shutdown(connection))
+                return connection
+
+        return WatchedPool
+
+    class CancellableAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                "http": watched(HTTPConnectionPool),
+                "https": watched(HTTPSConnectionPool),
+            }
+
+    session = requests.Session()
+    adapter = CancellableAdapter()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def completion_tokens(body):
+    usage = body.get("usage") if isinstance(body, dict) else None
+    return usage.get("completion_tokens") if isinstance(usage, dict) else None
+
+
+class LLMBackend:
+    def __init__(
+        self,
+        name,
+        url,
+        weight=1.0,
+        model=None,
+        headers=None,
+        params=None,
+        timeout=120,
+    ):
+        self.name = name
+        self.url = url
+        self.weight = float(weight)
+        self.model = model
+        self.headers = headers or {}
+        # Backend specific request fields (e.g. "mode" for text-generation-webui)
+        self.params = params or {}
+        self.timeout = timeout
+
+        self.ewma_latency = None  # seconds, None until the first success
+        self.ewma_error_rate = 0.0
+        # Reply length, for estimating the tokens saved by aborting a request
+        self.ewma_completion_tokens = None
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.aborted = 0
+        self.tokens_saved = 0
+
+    def is_healthy(self, now=None):
+        return (now or time()) >= self.down_until
+
+    def expected_latency(self, default):
+        latency = self.ewma_latency if self.ewma_latency is not None else default
+        # Penalise flaky backends: every error costs a retry on average
+        return latency * (1.0 + self.ewma_error_rate) / self.weight
+
+    def build_payload(self, messages, params):
+        payload = dict(self.params)
+        payload.update(params)
+        payload["messages"] = messages
+        if self.model:
+            payload["model"] = self.model
+        return payload
+
+    def post(self, messages, params, timeout=None, session=None, cancel=None):
+        # requests is imported on first use to keep it off the startup path
+        import requests
+
+        if cancel is not None:
+            # A session of its own, whose connection cancel() shuts down
+            with cancellable_session(cancel) as http:
+                return self.post(messages, params, timeout, http)
+        http = session or requests
+        response = http.post(
+            self.url,
+            json=self.build_payload(messages, params),
+            headers=self.headers,
+            timeout=timeout or self.timeout,
+        )
+        if response.status_code != 200:
+            raise LLMUnavailableError(
+                f"{self.name} returned status code {response.status_code}"
+            )
+        return response.json()
+
+    async def apost(self, messages, params, client, timeout=None):
+        response = await client.post(
+            self.url,
+            json=self.build_payload(messages, params),
+            headers=self.headers,
+            timeout=timeout or self.timeout,
+        )
+        if response.status_code != 200:
+            raise LLMUnavailableError(
+                f"{self.name} returned status code {response.status_code}"
+            )
+        return response.json()
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "url": self.url,
+            "weight": self.weight,
+            "healthy": self.is_healthy(),
+            "ewma_latency": self.ewma_latency,
+            "ewma_error_rate": round(self.ewma_error_rate, 4),
+            "requests": self.requests,
+            "failures": self.failures,
+            "aborted": self.aborted,
+            "tokens_saved": self.tokens_saved,
+        }
+
+
+class LLMRouter:
+    def __init__(
+        self,
+        backends,
+        alpha=0.3,
+        hedge_after=None,
+        min_hedge_after=2.0,
+        max_error_rate=0.5,
+        cooldown=30.0,
+        timeout=120.0,
+    ):
+        if not backends:
+            raise ValueError("LLMRouter needs at least one backend")
+        self.backends = list(backends)
+        self.alpha = alpha
+        # Fixed hedge delay in seconds; when None it is derived from the
+        # primary backend's EWMA latency (2x, but at least min_hedge_after),
+        # or is min_hedge_after while either backend is still unmeasured
+        self.hedge_after = hedge_after
+        self.min_hedge_after = min_hedge_after
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self.timeout = timeout
+        self.lock = threading.Lock()
+
+    ###### Health bookkeeping ########
+    def record_success(self, backend, latency, completion_tokens=None):
+        with self.lock:
+            backend.requests += 1
+            if backend.ewma_latency is None:
+                backend.ewma_latency = latency
+            else:
+                backend.ewma_latency += self.alpha * (latency - backend.ewma_latency)
+            if completion_tokens is not None:
+                if backend.ewma_completion_tokens is None:
+                    backend.ewma_completion_tokens = float(completion_tokens)
+                else:
+                    backend.ewma_completion_tokens += self.alpha * (completion_tokens - backend.ewma_completion_tokens)
+            backend.ewma_error_rate *= 1.0 - self.alpha
+            backend.consecutive_failures = 0
+            backend.down_until = 0.0
+
+    def record_failure(self, backend):
+        with self.lock:
+            backend.requests += 1
+            backend.failures += 1
+            backend.ewma_error_rate += self.alpha * (1.0 - backend.ewma_error_rate)
+            backend.consecutive_failures += 1
+            if (
+                backend.ewma_error_rate >= self.max_error_rate
+                or backend.consecutive_failures >= 3
+            ):
+                # Back off exponentially, but keep probing now and then
+                backoff = self.cooldown * 2 ** min(backend.consecutive_failures - 1, 4)
+                backend.down_until = time() + backoff
+
+    def record_abort(self, backend, elapsed):
+        """Counts an attempt aborted before it answered (cancelled, or the
+        loser of a hedge); returns the completion tokens it would probably
+        still have generated, going by the backend's usual reply length and
+        latency."""
+        with self.lock:
+            backend.aborted += 1
+            saved = 0
+            if backend.ewma_completion_tokens is not None and backend.ewma_latency:
+                saved = round(backend.ewma_completion_tokens * max(0.0, 1.0 - elapsed / backend.ewma_latency))
+            backend.tokens_saved += saved
+            # It takes at least this long: a backend that keeps losing hedges
+            # gets an estimate too, and stops being tried first as unmeasured
+            if backend.ewma_latency is None:
+                backend.ewma_latency = elapsed
+            elif elapsed > backend.ewma_latency:
+                backend.ewma_latency += self.alpha * (elapsed - backend.ewma_latency)
+        return saved
+
+    def ranked_backends(self):
+        now = time()
+        with self.lock:
+            # Backends without a measurement yet go first, so that each one is
+            # tried once; otherwise the first to answer, however slow, would
+            # keep all the traffic
+            healthy = [b for b in self.backends if b.is_healthy(now)]
+            unhealthy = [b for b in self.backends if not b.is_healthy(now)]
+            healthy.sort(key=lambda b: (b.ewma_latency is not None, b.expected_latency(1.0)))
+            # Unhealthy backends are only tried as a last resort, soonest-back first
+            unhealthy.sort(key=lambda b: b.down_until)
+        return healthy + unhealthy
+
+    def hedge_delay(self, backend, next_backend=None):
+        """How long to wait for backend before also asking next_backend."""
+        if self.hedge_after is not None:
+            return self.hedge_after
+        if backend.ewma_latency is None or (next_backend is not None and next_backend.ewma_latency is None):
+            return self.min_hedge_after
+        return max(self.min_hedge_after, 2 * backend.ewma_latency)
+
+    ###### Requests ########
+    def _attempt(self, backend, messages, params, results, aborted):
+        start_time = time()
+        try:
+            body = backend.post(messages, params, timeout=min(backend.timeout, self.timeout), cancel=aborted)
+            reply = body["choices"][0]["message"]["content"]
+        except Exception as e:
+            # An aborted attempt's error is its connection being shut down
+            if not aborted.cancelled:
+                self.record_failure(backend)
+                results.put((backend, None, e))
+            return
+        if not aborted.cancelled:
+            self.record_success(backend, time() - start_time, completion_tokens(body))
+            results.put((backend, reply, None))
+
+    def chat(self, messages, cancel=None, **params):
+        """Returns the first successful reply, hedging onto slower backends.
+        Cancelling the CancelToken passed as cancel raises LLMCancelledError
+        at once and closes the attempts' connections."""
+        if cancel is not None and cancel.cancelled:
+            raise LLMCancelledError(cancel.reason)
+        candidates = self.ranked_backends()
+        results = queue.Queue()
+        deadline = time() + self.timeout
+        started = {}  # backend -> start time, of the attempts in flight
+        # Shuts down the connections of the attempts left when chat() returns
+        aborted = CancelToken()
+        last_error = None
+        if cancel is not None:
+            # Wakes up the wait below
+            cancel.on_cancel(lambda: results.put(None))
+
+        def launch():
+            backend = candidates.pop(0)
+            started[backend] = time()
+            threading.Thread(
+                target=self._attempt,
+                args=(backend, messages, params, results, aborted),
+                daemon=True,
+            ).start()
+            return backend
+
+        current = launch()
+        try:
+            while started:
+                wait = deadline - time()
+                if candidates:
+                    wait = min(wait, self.hedge_delay(current, candidates[0]))
+                if wait <= 0:
+                    break
+                try:
+                    result = results.get(timeout=wait)
+                except queue.Empty:
+                    # Timed out waiting; hedge onto the next backend if there is one
+                    if candidates:
+                        current = launch()
+                        continue
+                    break
+                if result is None:
+                    break
+                backend, reply, error = result
+                del started[backend]
+                if error is None:
+                    return reply
+                print(f"LLM backend {backend.name} failed: {error}")
+                last_error = error
+                if candidates:
+                    current = launch()
+        finally:
+            # Abort the attempts still running: the losers of a hedge, or all
+            # of them when the request was cancelled or ran out of time
+            now = time()
+            tokens_saved = sum(self.record_abort(backend, now - start) for backend, start in started.items())
+            aborted.cancel()
+
+        if cancel is not None and cancel.cancelled:
+            raise LLMCancelledError(cancel.reason, tokens_saved)
+        raise LLMUnavailableError(
+            f"No LLM backend answered in time (last error: {last_error})"
+        )
+
+    async def _aattempt(self, backend, messages, params, client):
+        start_time = time()
+        try:
+            body = await backend.apost(messages, params, client, timeout=min(backend.timeout, self.timeout))
+            reply = body["choices"][0]["message"]["content"]
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.record_failure(backend)
+            return backend, None, e
+        self.record_success(backend, time() - start_time, completion_tokens(body))
+        return backend, reply, None
+
+    async def achat(self, messages, client=None, cancel=None, **params):
+        """chat() for asyncio: attempts are tasks on the running loop and the
+        losers of a hedge are cancelled, closing their connections, as are all
+        of them when cancel (a CancelToken) is. Pass a shared
+        httpx.AsyncClient to reuse its connections."""
+        if client is None:
+            import httpx
+
+            async with httpx.AsyncClient() as client:
+                return await self.achat(messages, client, cancel, **params)
+        if cancel is not None and cancel.cancelled:
+            raise LLMCancelledError(cancel.reason)
+        loop = asyncio.get_running_loop()
+        candidates = self.ranked_backends()
+        deadline = loop.time() + self.timeout
+        in_flight = {}  # task -> (backend, start time)
+        last_error = None
+        cancelled = loop.create_future()
+        if cancel is not None:
+            cancel.on_cancel(
+                lambda: loop.call_soon_threadsafe(lambda: cancelled.done() or cancelled.set_result(None))
+            )
+
+        def launch():
+            backend = candidates.pop(0)
+            task = asyncio.ensure_future(self._aattempt(backend, messages, params, client))
+            in_flight[task] = (backend, time())
+            return backend
+
+        current = launch()
+        try:
+            while in_flight:
+                wait = deadline - loop.time()
+                if candidates:
+                    wait = min(wait, self.hedge_delay(current, candidates[0]))
+                if wait <= 0:
+                    break
+                done, _ = await asyncio.wait(
+                    [*in_flight, cancelled], timeout=wait, return_when=asyncio.FIRST_COMPLETED
+                )
+                if cancelled in done:
+                    break
+                if not done:
+                    # Timed out waiting; hedge onto the next backend if there is one
+                    if candidates:
+                        current = launch()
+                        continue
+                    break
+                for task in done:
+                    del in_flight[task]
+                    backend, reply, error = task.result()
+                    if error is None:
+                        return reply
+                    print(f"LLM backend {backend.name} failed: {error}")
+                    last_error = error
+                    if candidates:
+                        current = launch()
+        finally:
+            now = time()
+            tokens_saved = 0
+            for task, (backend, start) in in_flight.items():
+                task.cancel()
+                tokens_saved += self.record_abort(backend, now - start)
+            cancelled.cancel()
+
+        if cancel is not None and cancel.cancelled:
+            raise LLMCancelledError(cancel.reason, tokens_saved)
+        raise LLMUnavailableError(
+            f"No LLM backend answered in time (last error: {last_error})"
+        )
+
+    def stats(self):
+        with self.lock:
+            return [backend.stats() for backend in self.backends]
+
+
+def backends_from_config(config):
+    """Builds backends from a list of dicts as found in the LLM_BACKENDS env var.
+
+    Keys: name, url, weight, model, params, timeout, and api_key_env (the name
+    of the env var holding a bearer token for that backend).
+    """
+    backends = []
+    for i, entry in enumerate(config):
+        headers = dict(entry.get("headers", {}))
+        api_key_env = entry.get("api_key_env")
+        if api_key_env and os.getenv(api_key_env):
+            headers["Authorization"] = f"Bearer {os.getenv(api_key_env)}"
+        backends.append(
+            LLMBackend(
+                name=entry.get("name", f"backend{i}"),
+                url=entry["url"],
+                weight=entry.get("weight", 1.0),
+                model=entry.get("model"),
+                headers=headers,
+                params=entry.get("params"),
+                timeout=entry.get("timeout", 120),
+            )
+        )
+    return backends
+
+
+def router_from_env(default_config):
+    """Creates a router from LLM_BACKENDS (JSON list), falling back to default_config."""
+    raw = os.getenv("LLM_BACKENDS")
+    config = json.loads(raw) if raw else default_config
+    hedge_after = os.getenv("LLM_HEDGE_AFTER")
+    return LLMRouter(
+        backends_from_config(config),
+        hedge_after=float(hedge_after) if hedge_after else None,
+        timeout=float(os.getenv("LLM_TIMEOUT", 120)),
+    )
@@ -0,0 +1,139 @@
+# Worker processes answering the chatbot job queue (chatbot_jobs.py), for web
+# servers running with CHATBOT_QUEUE=1:
+#   SOCKETIO_MESSAGE_QUEUE=redis://localhost:6379/0 python llm_worker.py --processes 2 --threads 8
+# Each thread answers one job at a time with main.ask_chatbot(), saves the
+# reply and sends chatbot_response to the client through the Socket.IO
+# message queue, whichever web server the client is connected to. LLM calls
+# mostly wait on the network, so threads give the concurrency and processes
+# spread response parsing and database writes over cores. Ctrl+C or SIGTERM
+# stops taking jobs and lets the ones in hand finish. Jobs cancelled by
+# their client meanwhile (chatbot_jobs.cancel()) are noticed within
+# CHATBOT_QUEUE_POLL seconds and their LLM requests aborted.
+import argparse
+import os
+import signal
+import socket
+import threading
+from multiprocessing import Process
+from time import time
+
+from flask_socketio import SocketIO
+
+import chatbot_inflight
+import chatbot_jobs
+import main
+import wire
+from llm_router import LLMCancelledError
+from models import db
+
+
+def answer(job, emitter, name, inflight):
+    # Plain values: ask_chatbot() closes the session the job was loaded in
+    job_id, owner, session_number, prompt = job.id, job.owner, job.session, job.prompt
+    sid, wire_format = job.sid, job.wire_format
+    start_time = time()
+    cancel = inflight.start(job_id, session_number)
+    try:
+        # LLM errors are raised, so that the job is retried
+        reply = main.ask_chatbot(owner, session_number, prompt, cancel, reraise=True)
+        if not chatbot_jobs.complete(job_id, name, owner, session_number, reply):
+            print(f"Chatbot job {job_id} was cancelled or handed to another worker; dropping its reply")
+            return
+    except LLMCancelledError as e:
+        print(f"Cancelled chatbot job {job_id} ({e.reason}), saving about {e.tokens_saved} tokens")
+        # Counted in the database: the web servers report them (/admin/stats)
+        chatbot_jobs.discard(job_id, e.tokens_saved)
+        return
+    except Exception as e:
+        reply = main.chatbot_apology(prompt, e)
+        status = chatbot_jobs.fail(job_id, name, owner, session_number, e, reply)
+        if status != chatbot_jobs.FAILED:
+            print(f"Chatbot job {job_id} failed: {e}" + (", queued again" if status == chatbot_jobs.QUEUED else ""))
+            return
+        print(f"Chatbot job {job_id} failed {chatbot_jobs.MAX_ATTEMPTS} times: {e}; answering with an apology")
+    finally:
+        inflight.finish(job_id, cancel)
+    if sid:
+        emitter.emit("chatbot_response", wire.encode(main.chatbot_response(session_number, reply), wire_format), to=sid)
+    print(f"Time taken to finish chatbot job {job_id} for {owner}: {time() - start_time} seconds")
+
+
+def work(app, emitter, name, stop, inflight):
+    with app.app_context():
+        waiter = chatbot_jobs.JobWaiter(db.engine)
+        try:
+            while not stop.is_set():
+                job = chatbot_jobs.claim(name)
+                if job is not None:
+                    answer(job, emitter, name, inflight)
+                    continue
+                # Idle: pick up the jobs of workers that died, then wait for more
+                requeued = chatbot_jobs.requeue_stale()
+                if requeued:
+                    print(f"Queued {requeued} chatbot jobs of lost workers again")
+                    continue
+                waiter.wait()
+        finally:
+            waiter.close()
+
+
+def watch_cancellations(app, stop, inflight):
+    """Aborts the LLM requests of the jobs being answered that got cancelled."""
+    with app.app_context():
+        while not stop.wait(chatbot_jobs.POLL_INTERVAL):
+            job_ids = inflight.keys()
+            if not job_ids:
+                continue
+            try:
+                for job_id, reason in chatbot_jobs.cancelled(job_ids).items():
+                    inflight.cancel(job_id, reason or chatbot_inflight.USER)
+            except Exception as e:
+                print(f"Checking for cancelled chatbot jobs failed: {e}")
+                db.session.rollback()
+
+
+def run(threads):
+    app = main.create_app(async_mode=None)
+    # Write-only: publishes to the web servers' message queue
+    emitter = SocketIO(message_queue=main.MESSAGE_QUEUE)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    # The jobs being answered, by job id
+    inflight = chatbot_inflight.InFlightPrompts()
+    workers = [
+        threading.Thread(target=work, args=(app, emitter, f"{socket.gethostname()}:{os.getpid()}:{i}", stop, inflight))
+        for i in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    threading.Thread(target=watch_cancellations, args=(app, stop, inflight), daemon=True).start()
+    print(f"LLM worker {os.getpid()} answering chatbot jobs with {threads} threads")
+    try:
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.join(0.5)
+    except KeyboardInterrupt:
+        stop.set()
+        for worker in workers:
+            worker.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer queued chatbot prompts")
+    parser.add_argument("--processes", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8, help="Jobs answered at once by each process")
+    args = parser.parse_args()
+    if main.MESSAGE_QUEUE is None:
+        raise SystemExit("Set SOCKETIO_MESSAGE_QUEUE (e.g. redis://localhost:6379/0) so replies reach the web servers")
+
+    processes = [Process(target=run, args=(args.threads,)) for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    signal.signal(signal.SIGTERM, lambda *args: [process.terminate() for process in processes])
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # The workers got the Ctrl+C too; wait for their jobs in hand
+        for process in processes:
+            process.join()
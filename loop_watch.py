@@ -0,0 +1,184 @@
+# Stalls of the server's event loop, and sampling profiles of the live server.
+# Under eventlet and gevent every room shares one OS thread (the hub), as do
+# asgi.py's coroutines (the asyncio loop): a call that blocks it without
+# yielding, a psycopg2 query that is not green or a long identicon render,
+# freezes every room until it returns.
+#   - The loop beats every tenth of a second from a background task. An OS
+#     thread (concurrency.original(), so it runs while the loop is blocked)
+#     checks the beats; when none came for STALL_THRESHOLD_MS (default 500)
+#     it logs the loop thread's stack, which is the code blocking it, and
+#     once the loop is back how long the stall lasted. Recent stalls are in
+#     stats() (/admin/stats). STALL_THRESHOLD_MS=0 turns it off.
+#   - profile() samples the stacks of all threads from an OS thread for a
+#     few seconds and returns them as collapsed stacks ("frame;frame;... n"
+#     per line, the input of flamegraph.pl, speedscope or inferno); see
+#     /admin/profile in admin.py. Nothing is sampled between profiles.
+# Idle, the cost is a beat and a check per tenth of a second.
+import asyncio
+import os
+import sys
+import time
+import traceback
+from collections import Counter
+from threading import Lock
+from time import monotonic
+
+import concurrency
+
+# Frames kept per stall stack
+STACK_DEPTH = 30
+
+# Code object -> "function (file", for frame_name()
+_names = {}
+
+
+def frame_name(frame):
+    """A frame as "function (file:line)", for collapsed stacks."""
+    code = frame.f_code
+    name = _names.get(code)
+    if name is None:
+        path = code.co_filename
+        for prefix in sorted(sys.path, key=len, reverse=True):
+            if prefix and path.startswith(prefix + os.sep):
+                path = path[len(prefix) + 1 :]
+                break
+        name = _names[code] = f"{code.co_name} ({path}"
+    return f"{name}:{frame.f_lineno})"
+
+
+def collapsed(frame):
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Watchdog:
+    def __init__(self, threshold=0.5, interval=0.1):
+        self.threshold = threshold
+        self.interval = min(interval, threshold / 4) if threshold > 0 else interval
+        self.last_beat = monotonic()
+        # OS threads: the one running the event loop, and the watchdog's own
+        self.loop_ident = None
+        self.watcher_ident = None
+        self.stalls = []  # the recent ones, replaced as a whole (read from other threads)
+        self.stall_count = 0
+        self.stalled_seconds = 0.0
+        self.longest = 0.0
+        # Where original() finds the real thread functions: asyncio patches
+        # nothing, so start_asyncio() switches to plain threading
+        self.mode = concurrency.ASYNC_MODE
+        # Held while a profile is taken; requests may come from several threads
+        self.profiling = Lock()
+
+    @property
+    def enabled(self):
+        return self.threshold > 0
+
+    def start(self, start_background_task, sleep):
+        """Watches the green threads' hub: beats from one of its background
+        tasks (the Socket.IO server's start_background_task and sleep). To be
+        called from the hub's thread."""
+        if not self.enabled:
+            return
+
+        def beat():
+            while True:
+                self.last_beat = monotonic()
+                sleep(self.interval)
+
+        start_background_task(beat)
+        self._watch()
+
+    def start_asyncio(self):
+        """Watches the running asyncio loop; to be called from inside it."""
+        if not self.enabled:
+            return
+
+        async def beat():
+            while True:
+                self.last_beat = monotonic()
+                await asyncio.sleep(self.interval)
+
+        self.mode = "threading"
+        self.beat_task = asyncio.get_running_loop().create_task(beat())
+        self._watch()
+
+    def _watch(self):
+        self.loop_ident = concurrency.original("_thread", "get_ident", self.mode)()
+        self.last_beat = monotonic()
+        self.watcher_ident = concurrency.original("_thread", "start_new_thread", self.mode)(self._run, ())
+        print(f"Stall watchdog on: event loop stalls over {self.threshold * 1000:.0f} ms are logged")
+
+    def _run(self):
+        sleep = concurrency.original("time", "sleep", self.mode)
+        stall = None
+        while True:
+            sleep(self.interval)
+            lag = monotonic() - self.last_beat
+            if lag >= self.threshold:
+                if stall is None:
+                    frame = sys._current_frames().get(self.loop_ident)
+                    stack = traceback.format_stack(frame, limit=STACK_DEPTH) if frame is not None else []
+                    stall = {"at": time.time() - lag, "ms": 0.0, "stack": [line.rstrip() for line in stack]}
+                    print(f"Stall: the event loop has not run for {lag * 1000:.0f} ms, blocked in:\n{''.join(stack)}")
+                stall["ms"] = round(lag * 1000, 1)
+            elif stall is not None:
+                seconds = stall["ms"] / 1000
+                self.stall_count += 1
+                self.stalled_seconds += seconds
+                self.longest = max(self.longest, seconds)
+                self.stalls = self.stalls[-19:] + [stall]
+                print(f"Stall over: the event loop was blocked for {stall['ms']:.0f} ms")
+                stall = None
+
+    def profile(self, seconds, interval=0.01):
+        """Samples every thread's stack each interval for seconds; returns the
+        collapsed stacks, most frequent first. Blocks the caller (a green
+        thread or a request thread) for the duration, not the loop. Raises
+        RuntimeError if a profile is already being taken."""
+        if not self.profiling.acquire(blocking=False):
+            raise RuntimeError("A profile is already being taken")
+        samples = Counter()
+        done = []
+
+        def sample():
+            own = concurrency.original("_thread", "get_ident", self.mode)()
+            skip = {own, self.watcher_ident}
+            os_sleep = concurrency.original("time", "sleep", self.mode)
+            deadline = monotonic() + seconds
+            try:
+                while monotonic() < deadline:
+                    for ident, frame in sys._current_frames().items():
+                        if ident not in skip:
+                            thread = "event loop" if ident == self.loop_ident else f"thread {ident}"
+                            samples[f"{thread};{collapsed(frame)}"] += 1
+                    os_sleep(interval)
+            finally:
+                done.append(True)
+
+        try:
+            concurrency.original("_thread", "start_new_thread", self.mode)(sample, ())
+            # Green under eventlet and gevent (patched), a plain wait otherwise
+            time.sleep(seconds)
+            while not done:
+                time.sleep(interval)
+        finally:
+            self.profiling.release()
+        return "".join(f"{stack} {count}\n" for stack, count in samples.most_common())
+
+    def stats(self):
+        return {
+            "enabled": self.enabled and self.loop_ident is not None,
+            "threshold_ms": self.threshold * 1000,
+            "stalls": self.stall_count,
+            "stalled_ms": round(self.stalled_seconds * 1000, 1),
+            "longest_ms": round(self.longest * 1000, 1),
+            "lag_ms": round((monotonic() - self.last_beat) * 1000, 1) if self.loop_ident is not None else None,
+            "recent": self.stalls,
+        }
+
+
+def watchdog_from_env():
+    return Watchdog(threshold=float(os.getenv("STALL_THRESHOLD_MS", 500)) / 1000)
@@ -0,0 +1,80 @@
+# Database management commands. The server no longer touches the schema on
+# startup, so run this once before the first `python main.py`:
+#   python manage.py create-db   # create the database (if missing) and any missing tables
+#   python manage.py reset-db    # drop and recreate all tables (DELETES all data)
+#   python manage.py migrate     # add new tables, and indexes/columns that create_all() does not add to existing ones
+import argparse
+
+from sqlalchemy import create_engine, text
+
+import chatbot_sessions
+import comment_cache
+import search
+from models import db, get_database_url
+
+
+def migrations():
+    """Idempotent PostgreSQL DDL, run after create_all() and by `migrate`."""
+    return [
+        # Room history paging (main.message_page); also declared on the model
+        "CREATE INDEX IF NOT EXISTS ix_messages_room_code_id ON messages (room_code, id)",
+    ] + chatbot_sessions.migrations() + comment_cache.migrations() + search.migrations()
+
+
+def get_engine():
+    return create_engine(get_database_url())
+
+
+def create_db(engine=None):
+    from sqlalchemy_utils import create_database, database_exists
+
+    engine = engine or get_engine()
+    # Create database if it does not exist
+    if not database_exists(engine.url):
+        print(f"Creating database {engine.url.database}...")
+        create_database(engine.url)
+    # Create all tables in the database if they don't exist
+    db.metadata.create_all(engine)
+    print("Tables created.")
+    migrate(engine)
+
+
+def migrate(engine=None):
+    engine = engine or get_engine()
+    if engine.dialect.name != "postgresql":
+        print(f"Skipping migrations: they need PostgreSQL, not {engine.dialect.name}.")
+        return
+    # Tables added since the database was created
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for statement in migrations():
+            connection.execute(text(statement))
+    print("Migrations applied.")
+
+
+def drop_db(engine=None):
+    engine = engine or get_engine()
+    db.metadata.drop_all(engine)
+    print("Tables dropped.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the RumorChat database")
+    parser.add_argument("command", choices=["create-db", "drop-db", "reset-db", "migrate"])
+    parser.add_argument("--yes", action="store_true", help="Do not ask for confirmation")
+    args = parser.parse_args()
+
+    if args.command == "create-db":
+        create_db()
+    elif args.command == "migrate":
+        migrate()
+    else:
+        if not args.yes:
+            print("WARNING: This will DELETE all data!")
+            choice = input("Are you sure you want to continue? [yes/no]: ")
+            if choice.lower() != "yes":
+                print("Aborted by the user.")
+                raise SystemExit(1)
+        drop_db()
+        if args.command == "reset-db":
+            create_db()
@@ -1,7 +1,7 @@
-import requests
 import pandas as pd
 import os
 import html
+from llm_router import LLMUnavailableError, router_from_env
 
 def main():
     INPUT_FILE = "mass_infer_data.csv"
@@ -9,6 +9,20 @@ def main():
     # CHATBOT_HOST = "127.0.0.1:6000"
     CHATBOT_HOST = "172.17.0.1:6000"
     CHATBOT_URI = f"http://{CHATBOT_HOST}/v1/chat/completions"
+    # Set LLM_BACKENDS to spread the rows over several servers (see llm_router.py)
+    llm_router = router_from_env(
+        [
+            {
+                "name": "local",
+                "url": CHATBOT_URI,
+                "params": {
+                    "auto_max_new_tokens": False,
+                    "max_tokens_second": 0,
+                    "mode": "chat-instruct",  # Valid options: 'chat', 'chat-instruct', 'instruct'
+                },
+            }
+        ]
+    )
     OUTPUT_FOLDER = "data"  # Default, should NOT be changed
 
     output_path = os.path.join(OUTPUT_FOLDER, OUTPUT_FILE)
@@ -88,17 +102,17 @@ def main():
 
 
     # Function to check server connectivity
-    def check_server_connectivity(uri):
+    def check_server_connectivity():
         try:
-            response = requests.post(CHATBOT_URI, json=dummy_request)
-            return response.status_code == 200
-        except requests.RequestException as e:
+            llm_router.chat(dummy_request["messages"], max_new_tokens=dummy_request["max_new_tokens"])
+            return True
+        except LLMUnavailableError as e:
             print(f"Error checking server connectivity: {e}")
             return False
 
 
     # Check if the LLM server can be connected to
-    if not check_server_connectivity(CHATBOT_URI):
+    if not check_server_connectivity():
         print("Cannot connect to the LLM server. Please check the server status.")
     else:
         print("LLM server is running. Starting inference process...")
@@ -172,20 +186,13 @@ def main():
             }
 
             try:
-                # Send request to the server
-                response = requests.post(CHATBOT_URI, json=request_data)
-
-                # Process the response
-                if response.status_code == 200:
-                    # results = response.json()["results"]
-                    chatbot_reply = response.json()['choices'][0]['message']['content']
-                    # Decode HTML entities in the response
-                    chatbot_reply = html.unescape(chatbot_reply)
-                else:
-                    print(f"Error with status code: {response.status_code}")
-                    chatbot_reply = "Error occurred during request."
-
-            except requests.RequestException as e:
+                # Send request to whichever backend is currently fastest
+                chatbot_reply = llm_router.chat(
+                    request_data["messages"], max_new_tokens=request_data["max_new_tokens"]
+                )
+                # Decode HTML entities in the response
+                chatbot_reply = html.unescape(chatbot_reply)
+            except LLMUnavailableError as e:
                 print(f"Request failed: {e}")
                 chatbot_reply = "Server error occurred."
             print(f"Row {index+1} response: {chatbot_reply}")
@@ -0,0 +1,217 @@
+# Memory held by the server process's own structures, for a worker whose RSS
+# creeps up over days.
+#   - Caches keyed by what clients send (identicons by name, heartbeats by
+#     room and member) are BoundedCaches: past their cap they drop the
+#     entries used the longest ago instead of growing. PROFILE_PICTURE_CACHE
+#     (default 1000) and HEARTBEAT_CACHE (default 10000) set the caps.
+#   - Every structure registered with track() is reported by /admin/memory
+#     (see admin.py) with its entry count and approximate size, along with
+#     the process's RSS and the garbage collector's object count.
+#   - tracemalloc is off, since tracing slows every allocation. start_trace()
+#     turns it on in a live server, each snapshot() then returns the source
+#     lines holding the most memory and what they allocated since the
+#     previous snapshot, and stop_trace() turns it off again.
+#     PYTHONTRACEMALLOC=1 traces from startup instead.
+# Sizing and snapshots run in the handler that asks for them and hold the
+# event loop meanwhile (a snapshot of a large heap takes a second or more).
+import gc
+import os
+import sys
+import tracemalloc
+from collections import OrderedDict, deque
+from threading import Lock
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+
+_MISSING = object()
+_CONTAINERS = (list, tuple, set, frozenset, deque)
+# Shared with the rest of the process, not held by a structure
+_SHARED = (type, ModuleType, FunctionType, BuiltinFunctionType, MethodType)
+# Nesting followed by approx_size(); the structures here are a few levels deep
+MAX_DEPTH = 8
+# Allocations of tracemalloc itself and of imports are not the server's
+_TRACE_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+class BoundedCache:
+    """A dict of at most max_entries entries; the least recently used go first."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            value = self.entries.get(key, _MISSING)
+            if value is _MISSING:
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > max(self.max_entries, 0):
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def items(self):
+        with self.lock:
+            return list(self.entries.items())
+
+
+def approx_size(obj, sample=1000):
+    """Bytes held by obj and what it references: containers and objects'
+    attributes are followed (not underscored ones, such as SQLAlchemy's
+    instance state), each object counted once. Containers of more than
+    sample entries are sized from their first sample entries."""
+    return _size(obj, 0, set(), sample)
+
+
+def _size(obj, depth, seen, sample):
+    if id(obj) in seen or isinstance(obj, _SHARED):
+        return 0
+    seen.add(id(obj))
+    total = sys.getsizeof(obj)
+    if depth >= MAX_DEPTH or isinstance(obj, (str, bytes, bytearray, int, float)):
+        return total
+    depth += 1
+    if isinstance(obj, dict):
+        # Copied at once, so that a handler changing it meanwhile is harmless
+        items = list(obj.items())
+        parts = [_size(key, depth, seen, sample) + _size(value, depth, seen, sample) for key, value in items[:sample]]
+    elif isinstance(obj, _CONTAINERS):
+        items = list(obj)
+        parts = [_size(item, depth, seen, sample) for item in items[:sample]]
+    else:
+        items = parts = [_size(value, depth, seen, sample) for value in attributes(obj)]
+    if not parts:
+        return total
+    return total + sum(parts) * len(items) // len(parts)
+
+
+def attributes(obj):
+    """The values of obj's public attributes, slots included."""
+    values = [value for name, value in list(getattr(obj, "__dict__", {}).items()) if not name.startswith("_")]
+    for cls in type(obj).__mro__:
+        slots = getattr(cls, "__slots__", ())
+        for name in (slots,) if isinstance(slots, str) else slots:
+            if not name.startswith("_"):
+                value = getattr(obj, name, _MISSING)
+                if value is not _MISSING:
+                    values.append(value)
+    return values
+
+
+def rss():
+    """Resident memory of this process in bytes, or None off Linux."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def allocation(stat):
+    return {
+        "traceback": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+        "bytes": stat.size,
+        "count": stat.count,
+    }
+
+
+class MemoryStats:
+    def __init__(self):
+        # name -> function returning the structure
+        self.structures = {}
+        # The previous tracemalloc snapshot, to diff the next one against
+        self.previous = None
+        self.lock = Lock()
+
+    def track(self, name, structure):
+        self.structures[name] = structure
+
+    def describe(self, structure):
+        if isinstance(structure, BoundedCache):
+            with structure.lock:
+                return {
+                    "entries": len(structure),
+                    "max_entries": structure.max_entries,
+                    "evictions": structure.evictions,
+                    "bytes": approx_size(structure.entries),
+                }
+        return {"entries": len(structure), "bytes": approx_size(structure)}
+
+    def report(self):
+        """The tracked structures, RSS and whether tracemalloc is tracing."""
+        traced, peak = tracemalloc.get_traced_memory()
+        return {
+            "rss_bytes": rss(),
+            "gc_objects": len(gc.get_objects()),
+            "structures": {name: self.describe(structure()) for name, structure in self.structures.items()},
+            "tracemalloc": {
+                "tracing": tracemalloc.is_tracing(),
+                "traced_bytes": traced,
+                "peak_bytes": peak,
+                "overhead_bytes": tracemalloc.get_tracemalloc_memory(),
+            },
+        }
+
+    def start_trace(self, frames=1):
+        """Starts tracemalloc, keeping frames of each allocation's stack."""
+        with self.lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+                self.previous = None
+            return {"tracing": True, "frames": tracemalloc.get_traceback_limit()}
+
+    def stop_trace(self):
+        with self.lock:
+            tracemalloc.stop()
+            self.previous = None
+            return {"tracing": False}
+
+    def snapshot(self, top=20):
+        """The top allocations by source line (by stack with more than one
+        frame) and the top changes since the previous snapshot; raises
+        RuntimeError unless tracing or if another snapshot is being taken."""
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not tracing; POST /admin/memory/trace first")
+        if not self.lock.acquire(blocking=False):
+            raise RuntimeError("a snapshot is already being taken")
+        try:
+            key = "traceback" if tracemalloc.get_traceback_limit() > 1 else "lineno"
+            snapshot = tracemalloc.take_snapshot().filter_traces(_TRACE_FILTERS)
+            previous, self.previous = self.previous, snapshot
+            result = {
+                "traced_bytes": tracemalloc.get_traced_memory()[0],
+                "top": [allocation(stat) for stat in snapshot.statistics(key)[:top]],
+                "diff": None,
+            }
+            if previous is not None:
+                result["diff"] = [
+                    dict(allocation(stat), bytes_diff=stat.size_diff, count_diff=stat.count_diff)
+                    for stat in snapshot.compare_to(previous, key)[:top]
+                ]
+            return result
+        finally:
+            self.lock.release()
+
+
+def bounded_cache_from_env(name, default):
+    """A BoundedCache of as many entries as the environment variable name
+    says; 0 keeps nothing."""
+    return BoundedCache(max_entries=int(os.getenv(name, default)))
@@ -0,0 +1,91 @@
+# Who is in which room, by the sockets they have open, so that reconnects do
+# not churn the room. A member's first socket announces them ("has joined",
+# the members list); when their last socket closes, the leave ("has left",
+# the members list) waits RECONNECT_GRACE seconds and is dropped if they
+# connect again meanwhile: a flaky mobile connection, a page reload or a
+# second tab no longer write and broadcast a leave and a join each time.
+# Reconnecting clients also resume instead of reloading the room: room.js
+# sends the id of the newest message it has (io auth last_id) and gets the
+# messages it missed in a "resume" event (main.messages_after()), or is told
+# to reload when it missed more than a page.
+# Like room_history.py this is per server process, so the grace period is
+# off when SOCKETIO_MESSAGE_QUEUE spreads a room over several servers, unless
+# RECONNECT_GRACE is set (with sticky sessions a reconnect reaches the same
+# server). Leaves still waiting when the server stops are not written.
+import os
+from collections import Counter
+from threading import Lock
+
+
+class Presence:
+    def __init__(self, grace=10):
+        self.grace = grace
+        self.sockets = Counter()  # (room, name) -> sockets open
+        self.leaving = {}  # (room, name) -> token of the pending leave
+        self.lock = Lock()
+        # Counters for stats()
+        self.joined = 0
+        self.resumed = 0
+        self.left = 0
+
+    def arrive(self, room, name):
+        """A socket of the member connected. True if they just entered the
+        room (announce it); False if they were still in it, through another
+        socket or within the grace period."""
+        key = (room, name)
+        with self.lock:
+            self.sockets[key] += 1
+            if self.leaving.pop(key, None) is not None:
+                self.resumed += 1
+                return False
+            if self.sockets[key] > 1:
+                return False
+            self.joined += 1
+            return True
+
+    def depart(self, room, name):
+        """A socket of the member disconnected. Returns a token to pass to
+        expire() after the grace period, or None if they have another."""
+        key = (room, name)
+        with self.lock:
+            self.sockets[key] -= 1
+            if self.sockets[key] > 0:
+                return None
+            del self.sockets[key]
+            token = self.leaving[key] = object()
+            return token
+
+    def expire(self, room, name, token):
+        """True if the member has not come back since depart(); the leave is
+        to be written then."""
+        key = (room, name)
+        with self.lock:
+            if self.leaving.get(key) is not token:
+                return False
+            del self.leaving[key]
+            self.left += 1
+            return True
+
+    def stats(self):
+        with self.lock:
+            return {
+                "members": len(self.sockets),
+                "leaving": len(self.leaving),
+                "joined": self.joined,
+                "resumed": self.resumed,
+                "left": self.left,
+            }
+
+
+def last_seen_id(auth):
+    """The id of the newest message a (re)connecting client has, from its
+    auth payload, or None for a client that does not resume."""
+    last_id = auth.get("last_id") if isinstance(auth, dict) else None
+    return last_id if type(last_id) is int else None
+
+
+def presence_from_env(shared=False):
+    """shared: whether rooms span several servers (a Socket.IO message queue);
+    no grace period then, unless RECONNECT_GRACE is set."""
+    grace = os.getenv("RECONNECT_GRACE")
+    return Presence(grace=float(grace) if grace else 0 if shared else 10)
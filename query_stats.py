@@ -0,0 +1,212 @@
+# Database cost per handler: every SQL statement is timed by SQLAlchemy
+# cursor events and counted against what ran it, a Flask route ("route
+# chat.room"), a Socket.IO event ("socket load_comments") or a background
+# task ("background"). For each handler there are totals (runs, queries,
+# time) and its statements, normalized (parameters and IN lists folded) so
+# that the same query with other values is counted once.
+#   - A statement slower than SLOW_QUERY_MS (default 100) is logged with its
+#     handler and kept in the recent slow queries.
+#   - A handler run that repeats one statement QUERY_N_PLUS_ONE (default 10)
+#     times or more is logged as a likely N+1 (a query per row of a list).
+# The totals are served by /admin/stats (see admin.py). Flask routes and
+# Flask-SocketIO events are attributed through their app context; asgi.py's
+# coroutines wrap themselves in tracked(). QUERY_STATS=0 turns it off.
+import os
+import re
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from threading import Lock
+from time import perf_counter
+
+from flask import g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Handler run being accounted outside a Flask app context (asgi.py)
+_current = ContextVar("query_stats", default=None)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%\(\w+\)s|\$\d+|%s|\?")
+_IN_LISTS = re.compile(r"\bIN \(\?(?:, \?)+\)", re.IGNORECASE)
+_ROWS = re.compile(r"(\((?:\?, )*\?\))(?:, \1)+")
+_SPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def normalize(statement):
+    """The statement with its values and placeholders as ?, and IN lists and
+    multi-row VALUES folded."""
+    statement = _LITERALS.sub("?", _SPACE.sub(" ", statement).strip())
+    return _ROWS.sub(r"\1, ...", _IN_LISTS.sub("IN (?, ...)", statement))
+
+
+def request_label():
+    """What the current Flask app context is running."""
+    if not has_request_context():
+        return "background"
+    socket_event = getattr(request, "event", None)  # set by Flask-SocketIO
+    if socket_event:
+        return f"socket {socket_event['message']}"
+    return f"route {request.endpoint or request.path}"
+
+
+class HandlerQueries:
+    """The statements of one handler run."""
+
+    __slots__ = ("label", "queries", "time", "statements")
+
+    def __init__(self, label):
+        self.label = label
+        self.queries = 0
+        self.time = 0.0
+        self.statements = Counter()
+
+
+class QueryStats:
+    def __init__(self, slow_ms=100, n_plus_one=10, max_statements=2000, enabled=True):
+        self.slow_ms = slow_ms
+        self.n_plus_one = n_plus_one
+        # (handler, statement) pairs tracked; the ones beyond are only totalled
+        self.max_statements = max_statements
+        self.enabled = enabled
+        self.handlers = {}  # label -> [runs, queries, seconds, most queries in a run, N+1 runs]
+        self.statements = {}  # (label, statement) -> [count, seconds, slowest]
+        self.slow = deque(maxlen=50)
+        self.repeated = deque(maxlen=50)
+        self.lock = Lock()
+        self.installed = False
+
+    def init_app(self, app):
+        """Times the statements of every engine and closes a handler run
+        when its app context ends."""
+        if not self.enabled:
+            return
+        if not self.installed:
+            event.listen(Engine, "before_cursor_execute", self.before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", self.after_cursor_execute)
+            self.installed = True
+        app.teardown_appcontext(self.teardown)
+
+    @contextmanager
+    def tracked(self, label):
+        """Counts the statements run inside against label."""
+        run = HandlerQueries(label)
+        token = _current.set(run)
+        try:
+            yield run
+        finally:
+            _current.reset(token)
+            self.finish(run)
+
+    def current(self):
+        run = _current.get()
+        if run is not None or not has_app_context():
+            return run
+        run = g.get("_query_stats")
+        if run is None:
+            run = g._query_stats = HandlerQueries(request_label())
+        return run
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._query_stats_start = perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "_query_stats_start", None)
+        if start is None:
+            return
+        elapsed = perf_counter() - start
+        sql = normalize(statement)
+        run = self.current()
+        label = run.label if run is not None else "other"
+        if run is not None:
+            run.queries += 1
+            run.time += elapsed
+            run.statements[sql] += 1
+        with self.lock:
+            totals = self.statements.get((label, sql))
+            if totals is None and len(self.statements) < self.max_statements:
+                totals = self.statements[(label, sql)] = [0, 0.0, 0.0]
+            if totals is not None:
+                totals[0] += 1
+                totals[1] += elapsed
+                totals[2] = max(totals[2], elapsed)
+            if run is None:
+                self._add_run(label, 1, elapsed)
+            slow = elapsed * 1000 >= self.slow_ms
+            if slow:
+                self.slow.append({"handler": label, "ms": round(elapsed * 1000, 1), "statement": sql})
+        if slow:
+            print(f"Slow query ({elapsed * 1000:.0f} ms) in {label}: {sql}")
+
+    def teardown(self, exc=None):
+        run = g.pop("_query_stats", None)
+        if run is not None:
+            self.finish(run)
+
+    def finish(self, run):
+        """Adds a handler run to the totals, flagging a likely N+1."""
+        if not run.queries:
+            return
+        sql, count = run.statements.most_common(1)[0]
+        repeated = count >= self.n_plus_one
+        with self.lock:
+            totals = self._add_run(run.label, run.queries, run.time)
+            totals[4] += repeated
+            if repeated:
+                self.repeated.append({"handler": run.label, "count": count, "queries": run.queries, "statement": sql})
+        if repeated:
+            print(f"Possible N+1 in {run.label}: {count} x {sql} ({run.queries} queries)")
+
+    def _add_run(self, label, queries, seconds):
+        totals = self.handlers.get(label)
+        if totals is None:
+            totals = self.handlers[label] = [0, 0, 0.0, 0, 0]
+        totals[0] += 1
+        totals[1] += queries
+        totals[2] += seconds
+        totals[3] = max(totals[3], queries)
+        return totals
+
+    def stats(self, top=50):
+        """Handlers by database time, the top statements by total time, and
+        the recent slow queries and N+1 runs."""
+        with self.lock:
+            handlers = sorted(self.handlers.items(), key=lambda item: -item[1][2])
+            statements = sorted(self.statements.items(), key=lambda item: -item[1][1])[:top]
+            return {
+                "handlers": [
+                    {
+                        "handler": label,
+                        "runs": runs,
+                        "queries": queries,
+                        "queries_per_run": queries / runs,
+                        "ms": round(seconds * 1000, 1),
+                        "ms_per_run": round(seconds * 1000 / runs, 3),
+                        "max_queries": most,
+                        "n_plus_one": repeated,
+                    }
+                    for label, (runs, queries, seconds, most, repeated) in handlers
+                ],
+                "statements": [
+                    {
+                        "handler": label,
+                        "statement": sql,
+                        "count": count,
+                        "ms": round(seconds * 1000, 1),
+                        "max_ms": round(slowest * 1000, 1),
+                    }
+                    for (label, sql), (count, seconds, slowest) in statements
+                ],
+                "slow": list(self.slow),
+                "n_plus_one": list(self.repeated),
+            }
+
+
+def query_stats_from_env():
+    return QueryStats(
+        slow_ms=float(os.getenv("SLOW_QUERY_MS", 100)),
+        n_plus_one=int(os.getenv("QUERY_N_PLUS_ONE", 10)),
+        enabled=os.getenv("QUERY_STATS", "1") != "0",
+    )
@@ -0,0 +1,243 @@
+# The newest chat messages of each active room, kept in memory so that the
+# room page and the /messages pages closest to the present are served
+# without a query, as are the messages a reconnecting client missed (see
+# presence.py). Each room has a ring buffer of its last ROOM_HISTORY_SIZE
+# messages, filled from the database on the first page load and then fed
+# by the message, connect and disconnect handlers as they save messages.
+# Older pages still come from the database (main.message_page()).
+# Rooms are kept in an LRU that holds ROOM_HISTORY_MB of messages in total;
+# the rooms idle the longest are dropped first.
+# Like comment_cache.py, this lives in the server process. It only sees the
+# messages saved by this process, so it is off when SOCKETIO_MESSAGE_QUEUE
+# spreads a room over several servers; ROOM_HISTORY_SIZE=0 turns it off.
+import os
+import sys
+from collections import OrderedDict, deque
+from itertools import islice
+from threading import Lock
+
+import wire
+from models import Messages
+
+
+class HistoryRecord:
+    """A message as main.message_page() returns it; slots keep it small."""
+
+    __slots__ = ("id", "name", "message", "date", "user_type", "size")
+
+    def __init__(self, id, name, message, date, user_type):
+        self.id = id
+        self.name = name
+        self.message = message
+        self.date = date  # wire.timestamp()
+        self.user_type = user_type  # wire.user_type_code()
+        # Bytes held, for the memory cap (the two ints are small and cached)
+        self.size = sys.getsizeof(self) + sys.getsizeof(name) + sys.getsizeof(message)
+
+    @classmethod
+    def from_message(cls, message):
+        return cls(
+            message.id,
+            message.name,
+            message.message,
+            wire.timestamp(message.date),
+            wire.user_type_code(message.user_type),
+        )
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "message": self.message,
+            "date": self.date,
+            "user_type": self.user_type,
+        }
+
+
+class RoomBuffer:
+    """A room's newest messages, oldest first."""
+
+    __slots__ = ("records", "complete", "size")
+
+    def __init__(self, capacity, records=(), complete=False):
+        self.records = deque(maxlen=capacity)
+        # Whether these are all of the room's messages (none older in the database)
+        self.complete = complete
+        self.size = 0
+        for record in records:
+            self.add(record)
+
+    def add(self, record):
+        """Adds a saved message; returns the change in bytes held."""
+        records = self.records
+        freed = 0
+        if records and record.id < records[-1].id:
+            # Saved after a message that was given a later id; find its place
+            i = len(records)
+            while i and records[i - 1].id > record.id:
+                i -= 1
+            if (i and records[i - 1].id == record.id) or (i == 0 and not self.complete):
+                return 0
+            if len(records) == records.maxlen:
+                if i == 0:
+                    return 0
+                freed = self._pop_oldest()
+                i -= 1
+            records.insert(i, record)
+        elif records and record.id == records[-1].id:
+            return 0
+        else:
+            if len(records) == records.maxlen:
+                freed = self._pop_oldest()
+            records.append(record)
+        self.size += record.size
+        return record.size - freed
+
+    def _pop_oldest(self):
+        record = self.records.popleft()
+        self.complete = False
+        self.size -= record.size
+        return record.size
+
+    def page(self, before_id, limit):
+        """main.message_page() from memory, or None if it needs messages
+        older than those kept."""
+        records = self.records
+        end = len(records)
+        if before_id is not None:
+            while end and records[end - 1].id >= before_id:
+                end -= 1
+        start = end - limit
+        if start < 0 and not self.complete:
+            return None
+        start = max(start, 0)
+        has_more = start > 0 or not self.complete
+        return [record.as_dict() for record in islice(records, start, end)], has_more
+
+    def since(self, after_id, limit):
+        """main.messages_after() from memory, or None if messages newer than
+        after_id may be older than those kept."""
+        records = self.records
+        if not self.complete and (not records or records[0].id > after_id):
+            return None
+        start = len(records)
+        while start and records[start - 1].id > after_id:
+            start -= 1
+        end = min(start + limit, len(records))
+        return [record.as_dict() for record in islice(records, start, end)], end < len(records)
+
+
+class RoomHistory:
+    def __init__(self, capacity=300, max_bytes=32 * 1024 * 1024):
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.rooms = OrderedDict()
+        self.size = 0
+        # Rooms being loaded from the database -> whether a message was saved
+        # to it meanwhile; such a load may have missed it and is not kept
+        self.loading = {}
+        self.lock = Lock()
+        # Counters for stats()
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def page(self, room_code, before_id=None, limit=100):
+        """The page main.message_page() would return, from memory; loads the
+        room's newest messages for a first page. None if the page needs the
+        database."""
+        if self.capacity <= 0:
+            return None
+        with self.lock:
+            buffer = self.rooms.get(room_code)
+            if buffer is not None:
+                self.rooms.move_to_end(room_code)
+                page = buffer.page(before_id, limit)
+                if page is not None:
+                    self.hits += 1
+                    return page
+            self.misses += 1
+        if buffer is not None or before_id is not None or limit > self.capacity:
+            return None
+        return self._load(room_code).page(before_id, limit)
+
+    def since(self, room_code, after_id, limit=100):
+        """The messages main.messages_after() would return, from memory; None
+        if they need the database (rooms not in memory are not loaded)."""
+        if self.capacity <= 0:
+            return None
+        with self.lock:
+            buffer = self.rooms.get(room_code)
+            page = None if buffer is None else buffer.since(after_id, limit)
+            if page is None:
+                self.misses += 1
+            else:
+                self.rooms.move_to_end(room_code)
+                self.hits += 1
+            return page
+
+    def _load(self, room_code):
+        with self.lock:
+            self.loading.setdefault(room_code, False)
+        rows = (
+            Messages.query.filter_by(room_code=room_code)
+            .order_by(Messages.id.desc())
+            .limit(self.capacity + 1)
+            .all()
+        )
+        buffer = RoomBuffer(
+            self.capacity,
+            map(HistoryRecord.from_message, reversed(rows[: self.capacity])),
+            complete=len(rows) <= self.capacity,
+        )
+        with self.lock:
+            self.loads += 1
+            if not self.loading.pop(room_code, True) and room_code not in self.rooms:
+                self.rooms[room_code] = buffer
+                self.size += buffer.size
+                self._evict()
+        return buffer
+
+    def add(self, room_code, record):
+        """A message of the room (a HistoryRecord) was committed."""
+        if self.capacity <= 0:
+            return
+        with self.lock:
+            if room_code in self.loading:
+                self.loading[room_code] = True
+            buffer = self.rooms.get(room_code)
+            if buffer is None:
+                return
+            self.rooms.move_to_end(room_code)
+            self.size += buffer.add(record)
+            self._evict()
+
+    def _evict(self):
+        # Drop the rooms idle the longest, but keep the one just used
+        while self.size > self.max_bytes and len(self.rooms) > 1:
+            _, buffer = self.rooms.popitem(last=False)
+            self.size -= buffer.size
+            self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "rooms": len(self.rooms),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
+
+
+def room_history_from_env(shared=False):
+    """shared: whether rooms span several servers (a Socket.IO message queue);
+    off then, unless ROOM_HISTORY_SIZE is set."""
+    size = os.getenv("ROOM_HISTORY_SIZE")
+    capacity = int(size) if size else 0 if shared else 300
+    return RoomHistory(capacity=capacity, max_bytes=int(float(os.getenv("ROOM_HISTORY_MB", 32)) * 1024 * 1024))
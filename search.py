@@ -0,0 +1,114 @@
+# Full-text search over room messages and chatbot transcripts (PostgreSQL).
+# Messages and ChatbotMessages get a generated tsvector column, search_vector,
+# with a GIN index; PostgreSQL keeps it current on every write, so the write
+# path does not change. Add them to an existing database with
+#   python manage.py migrate
+# Queries use websearch_to_tsquery syntax ("exact phrase", -word, or), are
+# ranked with ts_rank and paged by keyset on (rank, id), and come back with a
+# highlighted snippet from ts_headline. Room messages are scoped to a room,
+# chatbot transcripts to their owner.
+import html
+import os
+
+from sqlalchemy.sql import text
+
+import wire
+
+# Text search configuration the columns are generated with. Changing it needs
+# the columns to be rebuilt (drop them and run python manage.py migrate)
+SEARCH_CONFIG = os.getenv("SEARCH_CONFIG", "english")
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", 20))
+
+# source: (table, scope column, extra columns returned)
+SOURCES = {
+    "messages": ("messages", "room_code", ["user_type"]),
+    "chatbot": ("chatbot_messages", "owner", ["session", "owner"]),
+}
+
+# ts_headline marks matches with these; they are turned into <mark> after the
+# snippet is HTML-escaped, so stored text can never inject markup
+START_SEL = "\x01"
+STOP_SEL = "\x02"
+HEADLINE_OPTIONS = f"StartSel={START_SEL}, StopSel={STOP_SEL}, MaxWords=30, MinWords=10, MaxFragments=2"
+
+
+class SearchError(ValueError):
+    pass
+
+
+def migrations(config=SEARCH_CONFIG):
+    """DDL adding the search columns and indexes; safe to run repeatedly."""
+    statements = []
+    for table, _, _ in SOURCES.values():
+        statements += [
+            f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+            f"GENERATED ALWAYS AS (to_tsvector('{config}'::regconfig, coalesce(message, ''))) STORED",
+            f"CREATE INDEX IF NOT EXISTS ix_{table}_search_vector ON {table} USING gin (search_vector)",
+        ]
+    return statements
+
+
+def supported(connection):
+    return connection.dialect.name == "postgresql"
+
+
+def encode_cursor(rank, row_id):
+    return f"{rank!r}:{row_id}"
+
+
+def decode_cursor(cursor):
+    try:
+        rank, row_id = cursor.split(":")
+        return float(rank), int(row_id)
+    except ValueError:
+        raise SearchError(f"Invalid cursor: {cursor}")
+
+
+def highlight(snippet):
+    return html.escape(snippet).replace(START_SEL, "<mark>").replace(STOP_SEL, "</mark>")
+
+
+def search(connection, query, source, scope, cursor=None, limit=SEARCH_PAGE_SIZE, config=SEARCH_CONFIG):
+    """One page of matches for query in source ("messages" or "chatbot"),
+    restricted to scope (a room code or an owner name). Returns the results,
+    best first, and the cursor of the next page (None on the last page)."""
+    if source not in SOURCES:
+        raise SearchError(f"Unknown search source: {source}")
+    if not query or not query.strip():
+        raise SearchError("Empty search query")
+    table, scope_column, extra = SOURCES[source]
+    params = {"config": config, "query": query, "scope": scope, "limit": limit + 1, "options": HEADLINE_OPTIONS}
+    after = ""
+    if cursor:
+        params["rank"], params["id"] = decode_cursor(cursor)
+        after = "AND (ts_rank(t.search_vector, q.query), t.id) < (CAST(:rank AS real), :id)"
+    columns = ", ".join(f"t.{column}" for column in extra)
+    # Rank every match (the GIN index finds them), but only build snippets for
+    # the page, as ts_headline has to re-parse the message text
+    sql = text(f"""
+        WITH q AS (SELECT websearch_to_tsquery(CAST(:config AS regconfig), :query) AS query)
+        SELECT page.*, ts_headline(CAST(:config AS regconfig), page.message, q.query, :options) AS snippet
+        FROM (
+            SELECT t.id, t.name, t.message, t.date, {columns}, ts_rank(t.search_vector, q.query) AS rank
+            FROM {table} t, q
+            WHERE t.search_vector @@ q.query AND t.{scope_column} = :scope {after}
+            ORDER BY rank DESC, t.id DESC
+            LIMIT :limit
+        ) page, q
+        ORDER BY page.rank DESC, page.id DESC
+    """)
+    rows = connection.execute(sql, params).mappings().all()
+    next_cursor = encode_cursor(rows[limit - 1]["rank"], rows[limit - 1]["id"]) if len(rows) > limit else None
+    results = []
+    for row in rows[:limit]:
+        result = {
+            "id": row["id"],
+            "name": row["name"],
+            "date": wire.timestamp(row["date"]),
+            "snippet": highlight(row["snippet"]),
+            "rank": row["rank"],
+        }
+        for column in extra:
+            result[column] = wire.user_type_code(row[column]) if column == "user_type" else row[column]
+        results.append(result)
+    return results, next_cursor
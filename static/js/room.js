@@ -0,0 +1,1106 @@
+// Client code for room.html. The page itself only embeds the room state as
+// JSON (#room-state); everything else lives here so browsers can cache it.
+// `python assets.py` builds fingerprinted, precompressed copies of this file.
+const ROOM = JSON.parse(document.getElementById("room-state").textContent);
+
+// When socketio initiated, you directly connect to the socketio server associated
+// with the Flask website on localhost. This emits the 'connect' event to the server.
+// Ask for msgpack if the server offers it and the decoder loaded. Every
+// (re)connect also sends the id of the newest chat message the page has, and
+// the server sends what was missed since in a "resume" event (see presence.py).
+let lastMessageId = null;
+var socketio = io({
+  transports: ["websocket"],
+  auth: (cb) =>
+    cb({ format: window.MessagePack ? "msgpack" : "json", last_id: lastMessageId }),
+});
+
+// msgpack events arrive as a single binary attachment, JSON ones as objects
+const decodeWire = (data) =>
+  data instanceof ArrayBuffer ? MessagePack.decode(new Uint8Array(data)) : data;
+const on = (event, handler) =>
+  socketio.on(event, (data) => handler(decodeWire(data)));
+
+// User types are sent as indexes into this list
+const USER_TYPES = ROOM.user_types;
+const userTypeName = (code) =>
+  typeof code === "number" ? USER_TYPES[code] : code;
+
+// Profile pictures are served (and cached by the browser) per name
+const identiconUrl = (name) => `/identicon/${encodeURIComponent(name)}.png`;
+
+// The server may coalesce several room events into one "batch" frame
+// (see fanout.py); replay them through the normal handlers in order
+on("batch", (events) => {
+  events.forEach(([event, data]) => {
+    socketio.listeners(event).forEach((handler) => handler(data));
+  });
+});
+
+const messages = document.getElementById("messages");
+const members = document.getElementById("members");
+
+const messagesChatbot = document.getElementById("messages-chatbot");
+const sessions = document.getElementById("sessions");
+
+const comments = document.getElementById("comments");
+
+const curr_name = document.getElementById("name").innerHTML;
+const room_code = document.getElementById("room_code").innerHTML;
+const announcementBox = document.getElementById("announcements");
+const user_type = ROOM.user_type;
+console.log("My name is: " + curr_name);
+
+var current_session = 1; // Initialize to 1 as default session
+
+const scrollToBottom = () => {
+  messages.offsetHeight;
+  messages.scrollTop = messages.scrollHeight;
+};
+
+const scrollToBottomChatbot = () => {
+  messagesChatbot.offsetHeight;
+  messagesChatbot.scrollTop = messagesChatbot.scrollHeight;
+};
+
+const scrollToBottomComment = () => {
+  comments.offsetHeight;
+  comments.scrollTop = comments.scrollHeight;
+};
+
+const checkEnter = (event) => {
+  if (event.key === "Enter" && !event.shiftKey) {
+    sendMessage();
+  } else if (event.key === "Enter" && event.shiftKey) {
+    event.preventDefault(); // Prevent default form submission
+    // const messageInput = document.getElementById('message');
+    // messageInput.value += '\n'; // Insert a newline
+  }
+};
+
+// Function to extract only the time from a timestamp
+function extractTime(timestamp) {
+  const dateObj = new Date(timestamp);
+  return dateObj.toLocaleTimeString("en-SG", {
+    hour: "2-digit",
+    minute: "2-digit",
+    second: "2-digit",
+  });
+}
+
+// Stored text is escaped before rendering, as the server-rendered template
+// used to do
+const escapeHtml = (text) =>
+  String(text)
+    .replace(/&/g, "&amp;")
+    .replace(/</g, "&lt;")
+    .replace(/>/g, "&gt;")
+    .replace(/"/g, "&quot;")
+    .replace(/'/g, "&#39;");
+
+const escapeMessage = (msg) => ({
+  ...msg,
+  name: escapeHtml(msg.name),
+  message: escapeHtml(msg.message),
+});
+
+// HTML for one chat message
+const renderMessage = ({ name, message, date, user_type }) => {
+  // Replace all newlines with <br> tags
+  const msg = message.replace(/\n/g, "<br>");
+  const timeOnly = extractTime(date);
+  user_type = userTypeName(user_type);
+  let userTypeInfo = "";
+  if (user_type === "Administrator") {
+    userTypeInfo = " (Administrator)";
+  } else if (user_type === "Moderator") {
+    userTypeInfo = " (Moderator)";
+  }
+  const content = `
+  <div class="text">
+    <div>
+      <img src="${identiconUrl(name)}" alt="Profile Picture">
+      <span>
+        <strong>${name} <i>${userTypeInfo}</i></strong>: ${timeOnly}
+      </span>
+    </div>
+    <span class="muted">${msg}</span>
+  </div>
+  `;
+  return content;
+};
+
+// The chat log is rendered as a window over messageStore (oldest first) so
+// long rooms keep a bounded number of DOM nodes. Scrolling to either end
+// slides the window; scrolling past the oldest loaded message fetches an
+// older page from the server.
+const MESSAGE_PAGE = ROOM.message_page_size || 100;
+const MAX_RENDERED_MESSAGES = MESSAGE_PAGE * 2;
+const messageStore = [];
+let windowStart = 0; // rendered messages are messageStore[windowStart:windowEnd]
+let windowEnd = 0;
+let hasOlderMessages = ROOM.has_older_messages;
+let loadingOlderMessages = false;
+// Ids of the messages received since the page loaded, as a reconnect may
+// resume with some that also arrived live
+const seenMessageIds = new Set();
+
+// False if the message was already received
+const noteMessageId = (id) => {
+  if (id == null) return true;
+  if (seenMessageIds.has(id)) return false;
+  seenMessageIds.add(id);
+  if (lastMessageId === null || id > lastMessageId) lastMessageId = id;
+  return true;
+};
+
+const isNearBottom = () =>
+  messages.scrollHeight - messages.scrollTop - messages.clientHeight < 50;
+
+// Drop rendered messages from the top, keeping what is on screen in place
+const trimTop = () => {
+  const before = messages.scrollHeight;
+  while (windowEnd - windowStart > MAX_RENDERED_MESSAGES) {
+    messages.firstElementChild.remove();
+    windowStart++;
+  }
+  messages.scrollTop -= before - messages.scrollHeight;
+};
+
+const trimBottom = () => {
+  while (windowEnd - windowStart > MAX_RENDERED_MESSAGES) {
+    messages.lastElementChild.remove();
+    windowEnd--;
+  }
+};
+
+const renderMessages = (list) =>
+  list.map(renderMessage).join("");
+
+const showOlderMessages = () => {
+  if (windowStart === 0) {
+    fetchOlderMessages();
+    return;
+  }
+  const start = Math.max(0, windowStart - MESSAGE_PAGE);
+  const before = messages.scrollHeight;
+  messages.insertAdjacentHTML(
+    "afterbegin",
+    renderMessages(messageStore.slice(start, windowStart))
+  );
+  // Keep the message the user was looking at in place
+  messages.scrollTop += messages.scrollHeight - before;
+  windowStart = start;
+  trimBottom();
+};
+
+const showNewerMessages = () => {
+  const end = Math.min(messageStore.length, windowEnd + MESSAGE_PAGE);
+  messages.insertAdjacentHTML(
+    "beforeend",
+    renderMessages(messageStore.slice(windowEnd, end))
+  );
+  windowEnd = end;
+  trimTop();
+};
+
+const fetchOlderMessages = () => {
+  if (!hasOlderMessages || loadingOlderMessages || !messageStore.length) return;
+  loadingOlderMessages = true;
+  fetch(`/messages?before_id=${messageStore[0].id}&limit=${MESSAGE_PAGE}`)
+    .then((response) => response.json())
+    .then((data) => {
+      hasOlderMessages = data.has_more;
+      messageStore.unshift(...data.messages.map(escapeMessage));
+      windowStart += data.messages.length;
+      windowEnd += data.messages.length;
+      loadingOlderMessages = false;
+      if (data.messages.length) showOlderMessages();
+    })
+    .catch(() => {
+      loadingOlderMessages = false;
+    });
+};
+
+messages.addEventListener("scroll", () => {
+  if (messages.scrollTop < 50) {
+    showOlderMessages();
+  } else if (windowEnd < messageStore.length && isNearBottom()) {
+    showNewerMessages();
+  }
+});
+
+// Show the latest page of the history the room was rendered with
+const loadMessageHistory = (history) => {
+  history.forEach((msg) => noteMessageId(msg.id));
+  messageStore.push(...history.map(escapeMessage));
+  windowStart = Math.max(0, messageStore.length - MESSAGE_PAGE);
+  windowEnd = messageStore.length;
+  messages.insertAdjacentHTML(
+    "beforeend",
+    renderMessages(messageStore.slice(windowStart))
+  );
+  scrollToBottom();
+};
+
+// Called for every new message in the room, with its text as sent (unescaped)
+const createMessage = (name, msg, date, user_type, id) => {
+  messageStore.push(escapeMessage({ id, name, message: msg, date, user_type }));
+  // Only render it if the newest messages are the ones on screen
+  if (windowEnd !== messageStore.length - 1) return;
+  const follow = isNearBottom();
+  messages.insertAdjacentHTML("beforeend", renderMessage(messageStore[windowEnd]));
+  windowEnd++;
+  trimTop();
+  if (follow) scrollToBottom();
+};
+
+on("message", (data) => {
+  if (!noteMessageId(data.id)) return;
+  createMessage(
+    data.name,
+    data.message,
+    data.date,
+    data.user_type,
+    data.id
+  );
+});
+
+// The messages sent while the socket was down; after a long outage there are
+// too many, and the page is reloaded with the latest ones instead
+on("resume", (data) => {
+  if (data.has_more) {
+    location.reload();
+    return;
+  }
+  data.messages.forEach((msg) => {
+    if (noteMessageId(msg.id)) {
+      createMessage(msg.name, msg.message, msg.date, msg.user_type, msg.id);
+    }
+  });
+});
+
+const sendMessage = () => {
+  // socketio.emit('heartbeat', { room: room_code, name: curr_name});
+  console.log("send message");
+  const message = document.getElementById("message");
+  if (message.value == "") return;
+  socketio.emit("message", { data: message.value });
+  message.value = ""; // clear the message box
+  // scrollToBottom();  // Scroll to the bottom after sending a message
+};
+
+// Comments are loaded a page at a time, one level at a time: the room opens
+// with the first page of top-level comments and replies are fetched when
+// their "Show replies" button is clicked (load_comments / comments_page).
+let commentSort = ROOM.comment_sort;
+// Reply counts of rendered comments, and which of them have their replies
+// loaded, so live replies either go into the thread or bump the count
+const replyCounts = {};
+const expandedComments = new Set();
+
+const showRepliesButton = (commentId) =>
+  `<button class="show-replies" onclick="loadComments(${commentId})">Show ${
+    replyCounts[commentId]
+  } ${replyCounts[commentId] > 1 ? "replies" : "reply"}</button>`;
+
+const loadComments = (parentId = null, cursor = null) => {
+  socketio.emit("load_comments", {
+    parent_id: parentId,
+    sort: commentSort,
+    cursor: cursor,
+  });
+};
+
+const changeCommentSort = (sort) => {
+  commentSort = sort;
+  loadComments();
+};
+
+// "Load more" button at the end of a level that has further pages
+const setMoreButton = (container, parentId, cursor) => {
+  const id = `more_comments_${parentId === null ? "top" : parentId}`;
+  const existing = document.getElementById(id);
+  if (existing) existing.remove();
+  if (!cursor) return;
+  const button = document.createElement("button");
+  button.id = id;
+  button.className = "more-comments";
+  button.textContent = parentId === null ? "Load more comments" : "Load more replies";
+  button.onclick = () => loadComments(parentId, cursor);
+  container.appendChild(button);
+};
+
+// Render a page of comments at the end of a level; a first page (no cursor)
+// replaces what the level showed before
+const renderCommentPage = (parentId, commentList, cursor, nextCursor) => {
+  const container =
+    parentId === null ? comments : document.getElementById(`replies_${parentId}`);
+  if (!container) return;
+  if (!cursor) container.innerHTML = "";
+  if (parentId !== null) {
+    expandedComments.add(parentId);
+  } else if (!cursor) {
+    expandedComments.clear();
+  }
+  const depth =
+    parentId === null
+      ? 0
+      : parseInt(document.getElementById(`comment_${parentId}`).getAttribute("data-depth")) + 1;
+  const fragment = document.createDocumentFragment();
+  commentList.forEach((comment) => createComment(comment, fragment, depth));
+  container.appendChild(fragment);
+  setMoreButton(container, parentId, nextCursor);
+};
+
+on("comments_page", (data) => {
+  if (data.sort !== commentSort) return; // answer to an earlier sort order
+  renderCommentPage(
+    data.parent_id,
+    data.comments.map(escapeComment),
+    data.cursor,
+    data.next_cursor
+  );
+});
+
+// Called multiple times to generate and display the comments. Replies are not
+// rendered with their comment, only a button that loads them.
+const createComment = (commentData, parentElement, depth = 0) => {
+  // Check if this comment already exists
+  if (document.getElementById(`comment_${commentData.id}`)) {
+    return; // Skip adding the comment if it already exists
+  }
+  replyCounts[commentData.id] = commentData.reply_count || 0;
+
+  var upvoteClass = commentData.userVote == 1 ? "voted" : "";
+  var downvoteClass = commentData.userVote == -1 ? "voted" : "";
+  var commentElement = document.createElement("div");
+
+  var reportButtonHtml = `<button onclick='showReportForm(${
+    commentData.id
+  }, "${commentData.username}", "${commentData.text.replace(
+    /"/g,
+    '\\"'
+  )}", "${extractTime(commentData.timestamp)}")'>Report</button>`;
+  if (commentData.reportedByUser) {
+    reportButtonHtml = `<span>(You reported this comment)</span>`;
+    reportButtonHtml.disabled = true;
+  }
+  // Check if there are replies to determine the initial state of the replies section
+  // const repliesDisplayStyle = (commentData.replies && commentData.replies.length > 0) ? 'block' : 'none';
+  repliesDisplayStyle = "block"; // Always show replies for now
+  //var toggleRepliesButtonHtml = '';
+  //if (commentData.replies && commentData.replies.length > 0) {
+  //  toggleRepliesButtonHtml = `<button id='toggle_${commentData.id}' onclick='toggleReplies(${commentData.id})'>Collapse Replies (${commentData.replies.length})</button>`;
+  //}
+
+  commentElement.id = `comment_${commentData.id}`;
+  commentElement.className = "comment";
+  commentElement.setAttribute("data-user-vote", commentData.userVote);
+  commentElement.setAttribute("data-depth", depth);
+  commentElement.style.marginLeft = `${depth * 5}px`;
+  // Determine background color based on depth
+  const backgroundColor = `rgba(175, 175, 175, ${0.03 + depth * 0.03})`; // Adjust the rgba values as needed
+  commentElement.style.backgroundColor = backgroundColor;
+  const timeOnly = extractTime(commentData.timestamp);
+  const commentUserType = userTypeName(commentData.user_type);
+  let userTypeInfo = "";
+  if (commentUserType === "Administrator") {
+    userTypeInfo = " (Administrator)";
+  } else if (commentUserType === "Moderator") {
+    userTypeInfo = " (Moderator)";
+  }
+  let commentIdStr = ""; // Only show the comment ID for Administrators and Moderators
+  if (user_type === "Administrator" || user_type === "Moderator") {
+    commentIdStr = ` (Comment ID: ${commentData.id})`;
+  }
+
+  commentElement.innerHTML = `
+    <div>
+      <img src='${identiconUrl(commentData.username)}' alt='Profile Picture'>
+      <strong>${commentData.username}<i>${userTypeInfo}</i></strong>: ${timeOnly} ${commentIdStr}
+    </div>
+    <div class='commentcolor'>${commentData.text}</div> 
+    <div class='votes'>
+      <i class='fa fa-thumbs-up ${upvoteClass}' onclick='voteComment(${
+    commentData.id
+  }, 1)'></i>
+      <span id='votes_${commentData.id}'>${commentData.votes}</span>
+      <i class='fa fa-thumbs-down ${downvoteClass}' onclick='voteComment(${
+    commentData.id
+  }, -1)'></i>
+      <button id='reply_${
+        commentData.id
+      }' class='reply-btn' onclick='handleReply(${commentData.id}, "${
+    commentData.username
+  }", "${commentData.text.replace(
+    /"/g,
+    '\\"'
+  )}", "${timeOnly}")'>Reply</button>
+      ${reportButtonHtml}
+    </div>
+
+    <div id='replies_${
+      commentData.id
+    }' class='replies' style='display: ${repliesDisplayStyle};'></div>
+    
+`;
+
+  // Replies are loaded on demand
+  if (replyCounts[commentData.id]) {
+    commentElement.querySelector(`#replies_${commentData.id}`).innerHTML =
+      showRepliesButton(commentData.id);
+  }
+
+  // Append the comment element to the parent
+  parentElement.appendChild(commentElement);
+
+  // Apply "voted" class if needed
+  applyVoteStyles(commentData.id, commentData.userVote);
+};
+
+const applyVoteStyles = (commentId, userVote) => {
+  console.log(
+    `Applying vote styles for comment ${commentId}, userVote: ${userVote}`
+  );
+  const commentElement = document.getElementById(`comment_${commentId}`);
+  if (commentElement) {
+    const upvoteButton = commentElement.querySelector(".fa-thumbs-up");
+    const downvoteButton =
+      commentElement.querySelector(".fa-thumbs-down");
+    if (userVote == 1) {
+      console.log(
+        `Adding 'voted' class to upvote button for comment ${commentId}`
+      );
+      upvoteButton.classList.add("voted");
+      downvoteButton.classList.remove("voted");
+    } else if (userVote == -1) {
+      console.log(
+        `Adding 'voted' class to downvote button for comment ${commentId}`
+      );
+      downvoteButton.classList.add("voted");
+      upvoteButton.classList.remove("voted");
+    } else {
+      console.log(
+        `Removing 'voted' class from both buttons for comment ${commentId}`
+      );
+      upvoteButton.classList.remove("voted");
+      downvoteButton.classList.remove("voted");
+    }
+  }
+};
+
+// Use this function to create top-level comments
+const createTopLevelComment = (commentData) => {
+  if (document.getElementById(`comment_${commentData.id}`)) {
+    return; // Skip adding the comment if it already exists
+  }
+  createComment(commentData, document.getElementById("comments"), 0);
+};
+
+// Function for replying to comments
+var currentlyReplyingTo = null;
+
+// Function to update the reply button styles
+const updateReplyButtonStyles = () => {
+  document
+    .querySelectorAll(".comment button.reply-btn")
+    .forEach((button) => {
+      button.classList.remove("highlighted");
+    });
+  if (currentlyReplyingTo) {
+    const replyButton = document.getElementById(
+      `reply_${currentlyReplyingTo}`
+    );
+    if (replyButton) {
+      replyButton.classList.add("highlighted");
+    }
+  }
+};
+
+// Function to handle a reply to a comment
+const handleReply = (commentId, username, text, timestamp) => {
+  if (currentlyReplyingTo !== commentId) {
+    currentlyReplyingTo = commentId;
+    document.getElementById(
+      "new-comment-text"
+    ).placeholder = `Replying to ${username}: "${text}" at ${timestamp}`;
+    document.getElementById("cancel-reply-btn").style.display = "inline"; // Show cancel button
+  } else {
+    cancelReply();
+  }
+  updateReplyButtonStyles();
+};
+
+const cancelReply = () => {
+  currentlyReplyingTo = null;
+  document.getElementById("new-comment-text").placeholder =
+    "Post your comments";
+  //document.getElementById("reply-info").innerHTML = '';
+  document.getElementById("cancel-reply-btn").style.display = "none"; // Hide cancel button
+  updateReplyButtonStyles();
+};
+
+const toggleComments = (commentId) => {
+  var repliesDiv = document.getElementById("replies_" + commentId);
+  repliesDiv.style.display =
+    repliesDiv.style.display === "none" ? "block" : "none";
+};
+
+// Function to submit a new comment
+const submitComment = () => {
+  var text = document.getElementById("new-comment-text").value.trim();
+
+  // Check if the text is empty
+  if (!text) {
+    alert("Comment cannot be empty.");
+    return;
+  }
+  socketio.emit("submit_comment", {
+    text: text,
+    parent_id: currentlyReplyingTo,
+  });
+  // New top-level comments are shown at the top
+  if (!currentlyReplyingTo) comments.scrollTop = 0;
+  document.getElementById("new-comment-text").value = "";
+  currentlyReplyingTo = null;
+  updateReplyButtonStyles();
+  cancelReply();
+};
+
+const checkEnterComment = (event) => {
+  if (event.key === "Enter" && !event.shiftKey) {
+    submitComment();
+  } else if (event.key === "Enter" && event.shiftKey) {
+    event.preventDefault();
+    // const commentInput = document.getElementById('new-comment-text');
+    // commentInput.value += '\n';
+  }
+};
+
+const voteComment = (commentId, voteValue) => {
+  // Emit the vote to the server
+  socketio.emit("vote_comment", {
+    comment_id: commentId,
+    vote: voteValue,
+  });
+  // Update the button styles locally
+  const commentElement = document.getElementById(`comment_${commentId}`);
+  if (commentElement) {
+    const upvoteButton = commentElement.querySelector(".fa-thumbs-up");
+    const downvoteButton =
+      commentElement.querySelector(".fa-thumbs-down");
+    const currentUserVote = parseInt(
+      commentElement.getAttribute("data-user-vote")
+    );
+
+    // Toggle vote
+    if (voteValue === currentUserVote) {
+      // User is undoing their vote
+      voteValue = 0; // Neutral state
+    }
+
+    // Apply the updated styles based on the new vote value
+    if (voteValue === 1) {
+      upvoteButton.classList.add("voted");
+      downvoteButton.classList.remove("voted");
+    } else if (voteValue === -1) {
+      downvoteButton.classList.add("voted");
+      upvoteButton.classList.remove("voted");
+    } else {
+      upvoteButton.classList.remove("voted");
+      downvoteButton.classList.remove("voted");
+    }
+
+    // Update the data-user-vote attribute to reflect the new vote state
+    commentElement.setAttribute("data-user-vote", voteValue);
+  }
+};
+
+on("update_vote", (data) => {
+  // console.log("Received vote update for comment: " + data.comment_id);
+  const voteElement = document.getElementById(`votes_${data.comment_id}`);
+  const commentElement = document.getElementById(
+    `comment_${data.comment_id}`
+  );
+
+  if (voteElement) {
+    voteElement.innerText = data.votes;
+    // console.log("Updated vote count for comment: " + data.comment_id);
+  }
+});
+
+// Report Stuff
+
+const showReportForm = (commentId, username, text, timestamp) => {
+  // Populate the report form with comment details
+  document.getElementById("report-comment-id").value = commentId;
+  document.getElementById(
+    "report-comment-details"
+  ).textContent = `Reporting comment by ${username}: "${text}" at ${timestamp}`;
+  // Show the report form
+  document.getElementById("report-form").style.display = "block";
+  // Disable the report button if the user has already reported this comment
+  const reportButton = document.getElementById(`report-btn-${commentId}`);
+  if (reportButton) reportButton.disabled = true;
+};
+
+const submitReport = () => {
+  const commentId = document.getElementById("report-comment-id").value;
+  const reason = document.getElementById("report-reason").value;
+
+  fetch("/submit_report", {
+    method: "POST",
+    headers: { "Content-Type": "application/x-www-form-urlencoded" },
+    body: `comment_id=${commentId}&reason=${encodeURIComponent(reason)}`,
+  })
+    .then((response) => response.json())
+    .then((data) => {
+      if (data.success) {
+        alert("Report submitted successfully");
+        // Update the report button for this comment
+        const commentElement = document.getElementById(
+          `comment_${commentId}`
+        );
+        if (commentElement) {
+          const reportButton = commentElement.querySelector(
+            `button[onclick*='showReportForm(${commentId}']`
+          );
+          if (reportButton) {
+            reportButton.outerHTML =
+              "<span>(You reported this comment)</span>";
+          }
+        }
+      } else {
+        alert("Failed to submit report: " + data.message);
+      }
+    });
+
+  // Hide the report form and clear fields
+  document.getElementById("report-form").style.display = "none";
+  document.getElementById("report-comment-id").value = "";
+  document.getElementById("report-reason").value = "";
+};
+
+const hideReportForm = () => {
+  document.getElementById("report-form").style.display = "none";
+  document.getElementById("report-comment-id").value = "";
+  document.getElementById("report-reason").value = "";
+};
+
+on("new_comment", (data) => {
+  // Check if the new comment is a reply (has a parent_id)
+  if (data.parent_id) {
+    const hadReplies = replyCounts[data.parent_id] > 0;
+    replyCounts[data.parent_id] = (replyCounts[data.parent_id] || 0) + 1;
+    if (hadReplies && !expandedComments.has(data.parent_id)) {
+      // The parent's replies are not loaded; just update the count
+      const repliesElement = document.getElementById(`replies_${data.parent_id}`);
+      if (repliesElement) repliesElement.innerHTML = showRepliesButton(data.parent_id);
+      return;
+    }
+    expandedComments.add(data.parent_id);
+    // Find the parent comment's replies container
+    const parentRepliesContainer = document.getElementById(
+      `replies_${data.parent_id}`
+    );
+    if (parentRepliesContainer) {
+      // Calculate the depth of the new comment based on the parent comment's depth
+      const parentCommentElement = document.getElementById(
+        `comment_${data.parent_id}`
+      );
+      const depth =
+        parseInt(parentCommentElement.getAttribute("data-depth")) + 1;
+
+      // Create the new reply at the top of the replies, as the newest
+      const fragment = document.createDocumentFragment();
+      createComment(data, fragment, depth);
+      parentRepliesContainer.insertBefore(fragment, parentRepliesContainer.firstChild);
+
+      // Update the collapse button for the parent comment
+      // updateCollapseButton(data.parent_id, true);
+    }
+  } else {
+    // If it's a top-level comment, put it at the top of the comments
+    const fragment = document.createDocumentFragment();
+    createComment(data, fragment, 0);
+    comments.insertBefore(fragment, comments.firstChild);
+  }
+});
+
+const createReport = (data) => {
+  const reportElement = document.createElement("div");
+  reportElement.className = "report";
+  let timeOnly = extractTime(data.date_reported);
+  reportElement.innerHTML = `
+  <div>
+    <strong>${data.reporter_username}</strong> reported comment ${data.comment_id} for reason: ${data.reason}. <span class="muted">${timeOnly}</span>
+  </div>
+`;
+  document.getElementById("reports").appendChild(reportElement);
+};
+
+on("new_report", (data) => {
+  createReport(data);
+});
+
+on("memberChange", (membersArr) => {
+  let content = "";
+  let currentUserType = user_type; // Assuming 'user_type' is defined elsewhere to hold the current user's type
+  membersArr.forEach((member) => {
+    console.log(member);
+    // Always add member names to the display
+    content += `<div class="text"><span>${
+      member.name === curr_name
+        ? `<strong>${member.name}</strong>`
+        : member.name
+    }</span>`;
+
+    // Conditionally show the vote button for non-Administrator and non-self (assuming 'castVote' and 'user_type' determination is handled elsewhere)
+    if (
+      member.name !== curr_name &&
+      userTypeName(member.user_type) !== "Administrator" &&
+      currentUserType !== "Administrator" &&
+      currentUserType !== "User"
+    ) {
+      content += `<button class="vote-btn" onclick="castVote('${member.name}')" style="display: none;">Vote</button>`;
+    }
+
+    // Close the div for the member entry
+    content += `</div>`;
+  });
+
+  // Update the innerHTML of the members container
+  members.innerHTML = content;
+});
+
+on("new_announcement", (data) => {
+  let timeOnly = extractTime(data.timestamp);
+  let announcementHTML = `<div class="announcement"><strong>${data.name}</strong> (${timeOnly}) : ${data.announcement} </div>`;
+  announcementBox.innerHTML = announcementHTML; // Display the announcement
+  announcementBox.style.display = "block"; // Make sure to show the box if it was hidden
+  console.log("New announcement received:", announcementHTML);
+});
+
+// Function to post an announcement
+function postAnnouncement() {
+  const announcement = document.getElementById("announcementText").value;
+  fetch("/post_announcement", {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/x-www-form-urlencoded",
+    },
+    body: `announcement=${encodeURIComponent(announcement)}`,
+  })
+    .then((response) => response.json())
+    .then((data) => {
+      if (data.success) {
+        console.log("Announcement posted successfully.");
+      } else {
+        alert("Failed to post announcement: " + data.error);
+      }
+    });
+}
+
+// CHATBOT SECTION
+
+// Function to set the current session
+function setCurrentSession(session) {
+  current_session = session;
+  loadSessionHistory(session); // Load the conversation history of the new session
+  updateActiveSession(); // Update which session is visually marked as active
+}
+
+// Function to visually update the active session
+function updateActiveSession() {
+  // socketio.emit('heartbeat', { room: room_code, name: curr_name});
+  // Remove the active class from all session items
+  document.querySelectorAll(".session-item").forEach((elem) => {
+    elem.classList.remove("active");
+  });
+
+  // Add the active class to the current session
+  document
+    .querySelector(`.session-item[data-session="${current_session}"]`)
+    .classList.add("active");
+}
+
+// Function to load available sessions
+function loadSessions() {
+  // socketio.emit('heartbeat', { room: room_code, name: curr_name});
+  // Implement an AJAX call here to fetch sessions.
+  // For example, it might look something like this:
+  fetch("/get_sessions", {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+    },
+    body: JSON.stringify({ name: ROOM.name }),
+  })
+    .then((response) => response.json())
+    .then((data) => {
+      /// Sort sessions in ascending order
+      data.sessions.sort((a, b) => a - b); // assuming sessions are numbers
+
+      // Titles (the session's first prompt), shown on hover
+      const titles = {};
+      (data.session_info || []).forEach((info) => {
+        titles[info.session] = info.title || "";
+      });
+      // Generate HTML for sorted sessions
+      let sessionsHtml = "";
+      data.sessions.forEach((session) => {
+        sessionsHtml += `<div class="session-item" data-session="${session}" title="${escapeHtml(
+          titles[session] || ""
+        )}" onclick="setCurrentSession(${session})">Session ${session}</div>`;
+      });
+      document.getElementById("sessions").innerHTML = sessionsHtml;
+      updateActiveSession(); // Set the initial active session
+    });
+}
+// Function to apply vote styles to all comments
+const applyVoteStylesToAllComments = () => {
+  document.querySelectorAll(".comment").forEach((commentElement) => {
+    const commentId = commentElement.id.split("_")[1];
+    const upvoteButton = commentElement.querySelector(".fa-thumbs-up");
+    const downvoteButton =
+      commentElement.querySelector(".fa-thumbs-down");
+
+    // Retrieve the userVote attribute stored in the comment element
+    const userVote = parseInt(
+      commentElement.getAttribute("data-user-vote")
+    );
+
+    if (userVote === 1) {
+      upvoteButton.classList.add("voted");
+      downvoteButton.classList.remove("voted");
+    } else if (userVote === -1) {
+      downvoteButton.classList.add("voted");
+      upvoteButton.classList.remove("voted");
+    } else {
+      upvoteButton.classList.remove("voted");
+      downvoteButton.classList.remove("voted");
+    }
+  });
+};
+
+// Called after all comments are loaded
+setTimeout(applyVoteStylesToAllComments, 0);
+
+function createNewSession() {
+  // socketio.emit('heartbeat', { room: room_code, name: curr_name});
+  // Make an AJAX call to the server to create a new session
+  fetch("/create_new_session", {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+    },
+    body: JSON.stringify({ name: ROOM.name }),
+  })
+    .then((response) => response.json())
+    .then((data) => {
+      if (data.success) {
+        // Refresh the sessions
+        loadSessions();
+      } else {
+        alert("Failed to create new session.");
+      }
+    });
+}
+
+// HTML of one Chatbot message
+const renderChatbotMessage = (name, msg, date) => {
+  // Replace all newlines with <br> tags
+  msg = msg.replace(/\n/g, "<br>");
+  const timeOnly = extractTime(date);
+  return `
+<div class="text">
+  <div>
+    <img src="${identiconUrl(name)}" alt="Profile Picture">
+    <span>
+      <strong>${name}</strong>: ${msg}
+    </span>
+  </div>
+  <span class="muted">${timeOnly}</span>
+</div>
+`;
+};
+
+// Called multiple times to generate and display the Chatbot messages
+const createChatbotMessage = (name, msg, date) => {
+  // socketio.emit('heartbeat', { room: room_code, name: curr_name});
+  messagesChatbot.insertAdjacentHTML("beforeend", renderChatbotMessage(name, msg, date));
+  scrollToBottomChatbot();
+};
+
+// Session transcripts come a page at a time, newest first; scrolling to the
+// top of the chatbot box fetches the page before (get_session_history)
+let chatbotCursor = ROOM.chatbot_cursor;
+let loadingChatbotHistory = false;
+
+const renderChatbotMessages = (list) =>
+  list
+    .map((msg) => renderChatbotMessage(escapeHtml(msg.name), escapeHtml(msg.message), msg.date))
+    .join("");
+
+const fetchChatbotHistory = (session, cursor) =>
+  fetch("/get_session_history", {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+    },
+    body: JSON.stringify({
+      name: ROOM.name,
+      session: session,
+      cursor: cursor,
+    }),
+  }).then((response) => response.json());
+
+const fetchOlderChatbotMessages = () => {
+  if (!chatbotCursor || loadingChatbotHistory) return;
+  loadingChatbotHistory = true;
+  const session = current_session;
+  fetchChatbotHistory(session, chatbotCursor)
+    .then((data) => {
+      loadingChatbotHistory = false;
+      if (session !== current_session) return; // switched sessions meanwhile
+      chatbotCursor = data.next_cursor;
+      const before = messagesChatbot.scrollHeight;
+      messagesChatbot.insertAdjacentHTML("afterbegin", renderChatbotMessages(data.messages));
+      // Keep the message the user was looking at in place
+      messagesChatbot.scrollTop += messagesChatbot.scrollHeight - before;
+    })
+    .catch(() => {
+      loadingChatbotHistory = false;
+    });
+};
+
+if (messagesChatbot) {
+  messagesChatbot.addEventListener("scroll", () => {
+    if (messagesChatbot.scrollTop < 50) fetchOlderChatbotMessages();
+  });
+}
+
+const sendMessageToChatbot = () => {
+  // socketio.emit('heartbeat', { room: room_code, name: curr_name});
+  const message = document.getElementById("message-chatbot");
+  if (message.value == "") return;
+  // Disable the send button and textbox
+  document.getElementById("send-btn-chatbot").disabled = true;
+  document.getElementById("message-chatbot").disabled = true;
+  document.getElementById("new-session-btn").disabled = true;
+  // Disable session items' onclick events and appearance
+  const session_items = document.querySelectorAll(".session-item");
+  session_items.forEach((item) => {
+    item.style.pointerEvents = "none";
+    item.style.opacity = "0.5";
+  });
+  // Send a request for acknowledgement
+  socketio.emit("chatbot_req", {
+    session: current_session,
+    message: message.value,
+  });
+  // At the same time, prompt the chatbot for a response
+  socketio.emit("chatbot_prompt", {
+    session: current_session,
+    message: message.value,
+  });
+  message.value = "";
+};
+
+on("chatbot_ack", (data) => {
+  createChatbotMessage(data.name, data.message, data.date);
+  var reqCount = data.requests_in_progress;
+  messagesChatbot.insertAdjacentHTML("beforeend", `<div class="loading">Processing ${reqCount} ${
+    reqCount > 1 ? "requests" : "request"
+  } in queue. Please wait about ${reqCount} ${
+    reqCount > 1 ? "minutes" : "minute"
+  }. <button type="button" onclick="cancelChatbotPrompt()">Cancel</button></div>`);
+});
+
+// Stop waiting for the chatbot; the server aborts the request
+const cancelChatbotPrompt = () => {
+  socketio.emit("chatbot_cancel", { session: current_session });
+};
+
+// Remove "...loading" text and renable the send button and chatbot textbox
+const chatbotIdle = () => {
+  document.querySelectorAll(".loading").forEach((elem) => elem.remove());
+  document.getElementById("send-btn-chatbot").removeAttribute("disabled");
+  document.getElementById("message-chatbot").removeAttribute("disabled");
+  document.getElementById("new-session-btn").removeAttribute("disabled");
+  // Re-enable session items' onclick events and appearance
+  const session_items = document.querySelectorAll(".session-item");
+  session_items.forEach((item) => {
+    item.style.pointerEvents = "auto";
+    item.style.opacity = "1";
+  });
+};
+
+// Listen for chatbot responses
+on("chatbot_response", (data) => {
+  chatbotIdle();
+  // Display the chatbot's response
+  createChatbotMessage(data.name, data.message, data.date);
+});
+
+on("chatbot_cancelled", () => chatbotIdle());
+
+const checkEnterChatbot = (event) => {
+  if (event.key === "Enter" && !event.shiftKey) {
+    sendMessageToChatbot();
+  } else if (event.key === "Enter" && event.shiftKey) {
+    event.preventDefault(); // Prevent default form submission
+    // const chatbotInput = document.getElementById('message-chatbot');
+    // chatbotInput.value += '\n'; // Insert a newline
+  }
+};
+
+// When the user clicks on the session
+const loadSessionHistory = (session) => {
+  // socketio.emit('heartbeat', { room: room_code, name: curr_name});
+  // Implement an AJAX call to fetch session history
+  // Clear the existing chatbot messages
+  messagesChatbot.innerHTML = "";
+  chatbotCursor = null;
+  // Fetch the latest page of this session
+  fetchChatbotHistory(session, null).then((data) => {
+    if (session !== current_session) return; // switched sessions meanwhile
+    chatbotCursor = data.next_cursor;
+    messagesChatbot.insertAdjacentHTML("beforeend", renderChatbotMessages(data.messages));
+    scrollToBottomChatbot();
+  });
+};
+//socketio.emit('heartbeat', { room: room_code, name: curr_name});
+setInterval(function () {
+  //socketio.emit('heartbeat', { room: room_code, name: curr_name});
+}, 30000); // 30 seconds
+loadSessions(); // Load the sessions when the page loads
+
+// Render the history the page was served with
+const escapeComment = (comment) => ({
+  ...comment,
+  username: escapeHtml(comment.username),
+  text: escapeHtml(comment.text),
+  replies: (comment.replies || []).map(escapeComment),
+});
+
+loadMessageHistory(ROOM.messages);
+if (messagesChatbot) {
+  messagesChatbot.insertAdjacentHTML("beforeend", renderChatbotMessages(ROOM.chatbot_messages));
+  scrollToBottomChatbot();
+}
+renderCommentPage(null, ROOM.comments.map(escapeComment), null, ROOM.comments_cursor);
+if (document.getElementById("reports")) {
+  ROOM.comment_reports.forEach((report) =>
+    createReport({
+      ...report,
+      reporter_username: escapeHtml(report.reporter_username),
+      reason: escapeHtml(report.reason),
+    })
+  );
+}
+
+// Marks the point where the room has rendered its history and is interactive;
+// read by benchmarks/bench_room_tti.py
+window.roomReady = performance.now();
@@ -0,0 +1,64 @@
+# Compact wire format for the events main.py sends to room.html:
+#  - timestamps are epoch milliseconds instead of "%Y-%m-%d %H:%M:%S" strings
+#  - user types are small integer codes (indexes into USER_TYPES, which the
+#    page receives once when it is rendered)
+#  - no inline base64 profile pictures; the client loads /identicon/<name>.png,
+#    which the browser caches
+# With WIRE_MSGPACK=1 (and msgpack installed) clients may also ask for msgpack
+# at connect time with io({auth: {format: "msgpack"}}). Those clients are put
+# in a per-format sub-room of the chat room so every broadcast is packed once
+# per format, not once per client. It is off by default: Socket.IO sends
+# binary payloads as an attachment behind a placeholder packet, which costs
+# more than msgpack saves on typical chat events (see benchmarks/bench_wire.py).
+import os
+from datetime import datetime
+
+try:
+    import msgpack
+except ImportError:  # optional; everyone gets JSON without it
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+
+FORMATS = [JSON]
+if msgpack is not None and os.getenv("WIRE_MSGPACK", "0") == "1":
+    FORMATS.append(MSGPACK)
+
+USER_TYPES = ["User", "Moderator", "Disinformer", "Administrator"]
+_USER_TYPE_CODES = {user_type: code for code, user_type in enumerate(USER_TYPES)}
+
+
+def timestamp(value=None):
+    """Epoch milliseconds for a (naive, local time) datetime; now by default."""
+    return int((value or datetime.now()).timestamp() * 1000)
+
+
+def user_type_code(user_type):
+    # Unknown or missing types are shown as plain users
+    return _USER_TYPE_CODES.get(user_type, 0)
+
+
+def members(members_list):
+    """Compact form of a room's members list (as stored in Rooms.members)."""
+    return [{"name": m["name"], "user_type": user_type_code(m.get("user_type"))} for m in members_list]
+
+
+def negotiate(auth):
+    """Pick the wire format for a new connection from its auth payload."""
+    requested = auth.get("format") if isinstance(auth, dict) else None
+    return requested if requested in FORMATS else JSON
+
+
+def format_room(room, wire_format):
+    # JSON clients stay in the plain room, so anything emitted straight to the
+    # room keeps reaching them unchanged
+    return room if wire_format == JSON else f"{room}|{wire_format}"
+
+
+def encode(payload, wire_format):
+    """Payload as it should be handed to emit() for clients of this format."""
+    if wire_format == MSGPACK:
+        # Sent as a single binary attachment; room.html unpacks it
+        return msgpack.packb(payload, use_bin_type=True)
+    return payload
@@ -1,5 +1,6 @@
-import shutil
+from export_engine import sync_archive
 if __name__ == "__main__":
   print("Zipping data folder...")
-  shutil.make_archive("data", 'zip', "data")
-  print("Zipping completed!")
\ No newline at end of file
+  # Appends files that are not in data.zip yet instead of re-zipping everything
+  sync_archive("data", "data.zip")
+  print("Zipping completed!")